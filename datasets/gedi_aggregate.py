@@ -0,0 +1,280 @@
+# Copyright 2020 The Google Earth Engine Community Authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Aggregates extracted GEDI tables into monthly multi-resolution statistics.
+
+Usage: gedi_aggregate.py <product> <tables> <month> <output dir>
+
+The arguments are those of gedi_rasterize_local.py. Instead of the
+highest sensitivity shot of every 25 m pixel, this computes statistics of
+all shots of the month in every pixel of several resolutions
+(--aggregate_scales, 25 m, 1 km and 10 km by default). For every column in
+--aggregate_columns there are the count of values, their mean, minimum,
+maximum and the percentiles in --aggregate_percentiles; num_shots counts
+all shots.
+
+Pixels are in the UTM CRS of the grid cells and aligned to its origin, so
+the 25 m pixels are those of the monthly rasters and every coarser pixel
+holds whole pixels of the finer levels. A shot belongs to the first grid
+cell, by grid id, whose bounds contain it. Pixel (row, col) of a level
+has its upper left corner at (col * scale, -row * scale) in the CRS of the
+grid cell; lon and lat are those of its center.
+
+Each level is written as <year>_<month>_<scale>m.parquet, with one row per
+grid cell and pixel that has shots. This needs pyproj, but not GDAL.
+"""
+
+import collections
+import datetime
+import os
+
+from absl import app
+from absl import flags
+from absl import logging
+import numpy as np
+import pandas as pd
+import pyproj
+
+import gedi_catalog
+import gedi_grid
+import gedi_lib
+import gedi_spatial_index
+
+AGGREGATE_SCALES = flags.DEFINE_list(
+    'aggregate_scales', ['25', '1000', '10000'],
+    'Pixel sizes in meters of the aggregation levels. Each must be a '
+    'multiple of the previous one.')
+
+AGGREGATE_COLUMNS = flags.DEFINE_list(
+    'aggregate_columns', None,
+    'Columns to compute statistics of; by default those of the product.')
+
+AGGREGATE_PERCENTILES = flags.DEFINE_list(
+    'aggregate_percentiles', ['50', '98'],
+    'Percentiles computed of every column.')
+
+# Product -> default columns.
+_COLUMNS = {
+    'l2a': ['rh98'],
+    'l2b': ['cover', 'pai'],
+    'l4a': ['agbd'],
+}
+
+
+def check_scales(scales: list[int]) -> None:
+  """Raises ValueError unless every scale is a multiple of the previous."""
+  if not scales or min(scales) <= 0:
+    raise ValueError('Scales must be positive: %s' % scales)
+  for finer, coarser in zip(scales, scales[1:]):
+    if coarser % finer:
+      raise ValueError('Scale %d is not a multiple of %d' % (coarser, finer))
+
+
+def split_by_cell(lons: np.ndarray, lats: np.ndarray,
+                  grid_cells: dict[int, gedi_grid.GridCell]
+                  ) -> dict[int, np.ndarray]:
+  """Returns the indices of the shots of every grid cell.
+
+  Args:
+    lons: shot longitudes
+    lats: shot latitudes
+    grid_cells: grid_id -> GridCell
+
+  Returns:
+    grid_id -> indices of its shots, for the cells with shots. A shot is
+    given to the first cell by grid id whose bounds contain it.
+  """
+  order = np.argsort(lons, kind='stable')
+  sorted_lons = lons[order]
+  assigned = np.zeros(len(lons), dtype=bool)
+  cell_shots = {}
+  for grid_id, cell in sorted(grid_cells.items()):
+    min_lon, min_lat, max_lon, max_lat = cell.bounds
+    candidates = order[np.searchsorted(sorted_lons, min_lon, 'left'):
+                       np.searchsorted(sorted_lons, max_lon, 'right')]
+    inside = candidates[(lats[candidates] >= min_lat) &
+                        (lats[candidates] <= max_lat) & ~assigned[candidates]]
+    if inside.size:
+      assigned[inside] = True
+      cell_shots[grid_id] = inside
+  return cell_shots
+
+
+def grouped_stats(groups: np.ndarray, num_groups: int, values: np.ndarray,
+                  percentiles: list[float]) -> dict[str, np.ndarray]:
+  """Computes statistics of values by group, ignoring NaN.
+
+  Args:
+    groups: group index of every value, in [0, num_groups)
+    num_groups: number of groups
+    values: float values
+    percentiles: percentiles in [0, 100], interpolated like np.percentile
+
+  Returns:
+    statistic name -> value for every group, NaN for groups without values
+  """
+  valid = ~np.isnan(values)
+  groups, values = groups[valid], values[valid]
+  count = np.bincount(groups, minlength=num_groups)
+  stats = {'count': count.astype(np.int32)}
+  with np.errstate(invalid='ignore', divide='ignore'):
+    stats['mean'] = (
+        np.bincount(groups, weights=values, minlength=num_groups) / count)
+
+  # Sorted by group and value, every group is a segment starting at starts.
+  values = values[np.lexsort((values, groups))]
+  starts = np.cumsum(count) - count
+  has_values = count > 0
+  last = np.maximum(count - 1, 0)
+
+  def rank(fraction: float) -> np.ndarray:
+    if not values.size:
+      return np.full(num_groups, np.nan)
+    position = fraction * last
+    lo = np.floor(position).astype(np.int64)
+    hi = np.minimum(lo + 1, last)
+    lo_values = values[np.minimum(starts + lo, values.size - 1)]
+    hi_values = values[np.minimum(starts + hi, values.size - 1)]
+    return np.where(has_values,
+                    lo_values + (hi_values - lo_values) * (position - lo),
+                    np.nan)
+
+  stats['min'] = rank(0)
+  stats['max'] = rank(1)
+  for p in percentiles:
+    stats['p%g' % p] = rank(p / 100)
+  return stats
+
+
+def aggregate_level(x: np.ndarray, y: np.ndarray,
+                    columns: dict[str, np.ndarray], scale: int,
+                    percentiles: list[float]) -> pd.DataFrame:
+  """Computes the statistics of the pixels of one level.
+
+  Args:
+    x: shot x coordinates, in CRS units
+    y: shot y coordinates, in CRS units
+    columns: column name -> shot values
+    scale: pixel size, in CRS units
+    percentiles: percentiles to compute
+
+  Returns:
+    DataFrame with row, col, num_shots and <column>_<statistic> of every
+    pixel with shots
+  """
+  col = np.floor(x / scale).astype(np.int64)
+  row = np.floor(-y / scale).astype(np.int64)
+  keys = (row - row.min()) * (col.max() - col.min() + 1) + (col - col.min())
+  _, first, groups = np.unique(keys, return_index=True, return_inverse=True)
+  level = {
+      'row': row[first].astype(np.int32),
+      'col': col[first].astype(np.int32),
+      'num_shots': np.bincount(groups).astype(np.int32),
+  }
+  for name, values in columns.items():
+    for stat, stat_values in grouped_stats(groups, len(first), values,
+                                           percentiles).items():
+      if stat != 'count':
+        stat_values = stat_values.astype(np.float32)
+      level['%s_%s' % (name, stat)] = stat_values
+  return pd.DataFrame(level)
+
+
+def aggregate_cell(shots: pd.DataFrame, cell: gedi_grid.GridCell,
+                   columns: list[str], scales: list[int],
+                   percentiles: list[float]) -> list[pd.DataFrame]:
+  """Aggregates the shots of one grid cell at every scale.
+
+  Args:
+    shots: shots of the cell, see gedi_lib.read_month and split_by_cell
+    cell: grid cell
+    columns: columns to compute statistics of
+    scales: pixel sizes, in meters
+    percentiles: percentiles to compute
+
+  Returns:
+    one DataFrame per scale, see aggregate_level, with grid_id and the lon
+    and lat of the pixel centers added
+  """
+  transformer = pyproj.Transformer.from_crs(
+      'EPSG:4326', cell.crs, always_xy=True)
+  x, y = transformer.transform(shots.lon_lowestmode.to_numpy(),
+                               shots.lat_lowestmode.to_numpy())
+  values = {
+      c: shots[c].to_numpy(dtype=np.float64, na_value=np.nan) for c in columns
+  }
+  levels = []
+  for scale in scales:
+    level = aggregate_level(x, y, values, scale, percentiles)
+    lon, lat = transformer.transform(
+        (level.col.to_numpy() + 0.5) * scale,
+        -(level.row.to_numpy() + 0.5) * scale,
+        direction=pyproj.enums.TransformDirection.INVERSE)
+    level.insert(0, 'grid_id', np.int32(cell.grid_id))
+    level.insert(3, 'lon', lon.astype(np.float32))
+    level.insert(4, 'lat', lat.astype(np.float32))
+    levels.append(level)
+  return levels
+
+
+def write_levels(levels: dict[int, list[pd.DataFrame]], output_dir: str,
+                 month_start: datetime.datetime) -> None:
+  """Writes the pixels of every level into one Parquet file."""
+  for scale, frames in sorted(levels.items()):
+    path = os.path.join(
+        output_dir, '%s_%dm.parquet' % (month_start.strftime('%Y_%m'), scale))
+    level = pd.concat(frames, ignore_index=True)
+    level.to_parquet(path, compression=gedi_lib.COLUMNAR_COMPRESSION,
+                     index=False)
+    logging.info('%s: %d pixels', path, len(level))
+
+
+def main(argv):
+  columns = AGGREGATE_COLUMNS.value or _COLUMNS[argv[1]]
+  scales = [int(s) for s in AGGREGATE_SCALES.value]
+  check_scales(scales)
+  percentiles = [float(p) for p in AGGREGATE_PERCENTILES.value]
+  if any(not 0 <= p <= 100 for p in percentiles):
+    raise ValueError('Percentiles must be in [0, 100]: %s' % percentiles)
+  table_paths = gedi_lib.list_tables(argv[2])
+  month_start = gedi_lib.parse_month(argv[3])
+  output_dir = argv[4]
+  os.makedirs(output_dir, exist_ok=True)
+
+  grid_cells = gedi_grid.grid_cells_from_flags()
+  catalog = gedi_catalog.catalog_from_flags()
+  if catalog is not None:
+    routes = gedi_spatial_index.route_tables(
+        catalog, table_paths,
+        {k: cell.bounds for k, cell in grid_cells.items()})
+    table_paths = sorted(set().union(*routes.values()))
+
+  shots = gedi_lib.read_month(table_paths, columns, month_start)
+  cell_shots = split_by_cell(shots.lon_lowestmode.to_numpy(),
+                             shots.lat_lowestmode.to_numpy(), grid_cells)
+  logging.info('%d shots in %d tables, %d in %d grid cells', len(shots),
+               len(table_paths), sum(len(i) for i in cell_shots.values()),
+               len(cell_shots))
+
+  levels = collections.defaultdict(list)
+  for grid_id, indices in cell_shots.items():
+    for scale, level in zip(
+        scales,
+        aggregate_cell(shots.iloc[indices], grid_cells[grid_id], columns,
+                       scales, percentiles)):
+      levels[scale].append(level)
+  write_levels(levels, output_dir, month_start)
+
+
+if __name__ == '__main__':
+  app.run(main)
@@ -0,0 +1,143 @@
+# Copyright 2020 The Google Earth Engine Community Authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Tests for gedi_aggregate."""
+
+import os
+import tempfile
+
+from absl.testing import absltest
+import numpy as np
+import pandas as pd
+import pyproj
+
+import gedi_aggregate
+import gedi_extract_l4a
+import gedi_grid
+import gedi_lib
+import gedi_synthetic
+
+
+def _cell(grid_id: int, crs: str, min_lon: float, min_lat: float,
+          max_lon: float, max_lat: float) -> gedi_grid.GridCell:
+  return gedi_grid.GridCell(
+      grid_id=grid_id,
+      crs=crs,
+      geometry={
+          'type': 'Polygon',
+          'coordinates': [[[min_lon, min_lat], [max_lon, min_lat],
+                           [max_lon, max_lat], [min_lon, max_lat],
+                           [min_lon, min_lat]]]
+      })
+
+
+class AggregateTest(absltest.TestCase):
+
+  def test_check_scales(self):
+    gedi_aggregate.check_scales([25, 1000, 10000])
+    with self.assertRaises(ValueError):
+      gedi_aggregate.check_scales([25, 1010])
+    with self.assertRaises(ValueError):
+      gedi_aggregate.check_scales([0, 25])
+
+  def test_grouped_stats(self):
+    groups = np.array([0, 0, 0, 2, 2, 1])
+    values = np.array([3, 1, np.nan, 5, 7, np.nan])
+    stats = gedi_aggregate.grouped_stats(groups, 3, values, [50])
+
+    np.testing.assert_array_equal(stats['count'], [2, 0, 2])
+    np.testing.assert_array_equal(stats['mean'], [2, np.nan, 6])
+    np.testing.assert_array_equal(stats['min'], [1, np.nan, 5])
+    np.testing.assert_array_equal(stats['max'], [3, np.nan, 7])
+    np.testing.assert_array_equal(stats['p50'], [2, np.nan, 6])
+
+  def test_split_by_cell_gives_shots_to_the_first_cell(self):
+    cells = {
+        2: _cell(2, 'EPSG:32610', -123, 37, -122, 38),
+        1: _cell(1, 'EPSG:32610', -122.5, 37, -121.5, 38),
+    }
+    lons = np.array([-122.8, -122.2, -121.6, -120])
+    lats = np.array([37.5, 37.5, 37.5, 37.5])
+    cell_shots = gedi_aggregate.split_by_cell(lons, lats, cells)
+
+    self.assertCountEqual(cell_shots, [1, 2])
+    np.testing.assert_array_equal(np.sort(cell_shots[1]), [1, 2])
+    np.testing.assert_array_equal(cell_shots[2], [0])
+
+  def test_nullable_integer_column(self):
+    shots = pd.DataFrame({
+        'lon_lowestmode': [-122.5, -122.5, -122.5],
+        'lat_lowestmode': [37.5, 37.5, 37.5],
+        'predictor_limit_flag': pd.array([1, None, 0], dtype='UInt8'),
+    })
+    (level,) = gedi_aggregate.aggregate_cell(
+        shots, _cell(1, 'EPSG:32610', -123, 37, -122, 38),
+        ['predictor_limit_flag'], [1000], [50])
+
+    self.assertEqual(level.num_shots[0], 3)
+    self.assertEqual(level.predictor_limit_flag_count[0], 2)
+    self.assertEqual(level.predictor_limit_flag_mean[0], 0.5)
+    self.assertEqual(level.predictor_limit_flag_max[0], 1)
+
+  def test_synthetic_orbit(self):
+    tmp_dir = self.enter_context(tempfile.TemporaryDirectory())
+    l4a_path = gedi_synthetic.write_orbit(
+        os.path.join(tmp_dir, 'orbit'), 2000, 0, None)[2]
+    table_path = os.path.join(tmp_dir, 'l4a.parquet')
+    gedi_extract_l4a.extract_values([l4a_path], table_path, 'parquet')
+    month_start = gedi_lib.parse_month('2019-04')
+    # The synthetic ground track crosses this cell at about a third.
+    cell = _cell(1, 'EPSG:32714', -101, -18, -97, -13)
+
+    shots = gedi_lib.read_month([table_path], ['agbd'], month_start)
+    cell_shots = gedi_aggregate.split_by_cell(
+        shots.lon_lowestmode.to_numpy(), shots.lat_lowestmode.to_numpy(),
+        {1: cell})
+    shots = shots.iloc[cell_shots[1]]
+    self.assertGreater(len(shots), 500)
+    levels = gedi_aggregate.aggregate_cell(shots, cell, ['agbd'],
+                                           [1000, 10000], [50])
+
+    transformer = pyproj.Transformer.from_crs(
+        'EPSG:4326', cell.crs, always_xy=True)
+    x, y = transformer.transform(shots.lon_lowestmode.to_numpy(),
+                                 shots.lat_lowestmode.to_numpy())
+    for scale, level in zip([1000, 10000], levels):
+      expected = pd.DataFrame({
+          'row': np.floor(-y / scale).astype(np.int32),
+          'col': np.floor(x / scale).astype(np.int32),
+          'agbd': shots.agbd.to_numpy(),
+      }).groupby(['row', 'col']).agg(
+          num_shots=('agbd', 'size'), agbd_count=('agbd', 'count'),
+          agbd_mean=('agbd', 'mean'), agbd_min=('agbd', 'min'),
+          agbd_max=('agbd', 'max'), agbd_p50=('agbd', 'median'))
+      actual = level.set_index(['row', 'col']).sort_index()
+
+      self.assertEqual(actual.num_shots.sum(), len(shots))
+      self.assertTrue((actual.grid_id == 1).all())
+      np.testing.assert_array_equal(actual.index, expected.index)
+      np.testing.assert_array_equal(actual.num_shots, expected.num_shots)
+      np.testing.assert_array_equal(actual.agbd_count, expected.agbd_count)
+      for stat in ('mean', 'min', 'max', 'p50'):
+        np.testing.assert_allclose(actual['agbd_' + stat],
+                                   expected['agbd_' + stat], rtol=1e-6)
+      # Pixel centers are within the cell.
+      self.assertTrue(actual.lon.between(-101, -97).all())
+      self.assertTrue(actual.lat.between(-18, -13).all())
+
+    # Coarser pixels hold whole finer ones.
+    self.assertEqual(levels[0].num_shots.sum(), levels[1].num_shots.sum())
+
+
+if __name__ == '__main__':
+  absltest.main()
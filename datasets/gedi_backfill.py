@@ -0,0 +1,253 @@
+# Copyright 2020 The Google Earth Engine Community Authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Rasterizes many months of several GEDI products in one run.
+
+Usage: gedi_backfill.py <table list> <first month> <last month>
+
+The table list has the table asset ids of all products and months; months
+are YYYY-MM. Every (product, month, grid cell) with tables becomes a work
+item. The grid cells are loaded once (see gedi_grid.py) and, with
+--gedi_catalog, all tables are routed to grid cells once (see
+gedi_spatial_index.py). Items are queued month by month, largest exports
+first, on a single gedi_tasks.TaskScheduler, so --max_running_tasks caps
+the tasks of all products and months together.
+
+The task ids and export fingerprints are checkpointed in --backfill_dir
+(unless --task_state or --export_state point elsewhere). A stopped run is
+resumed by starting it again with the same arguments: exports that
+completed, or still have a running task, are not started again.
+
+The rasters are named <grid id>_<year>_<month> in the collections of the
+rasterize scripts, so that months do not overwrite each other.
+"""
+
+import collections
+import datetime
+import os
+from typing import Callable, Optional
+
+from absl import app
+from absl import flags
+from absl import logging
+import attr
+from dateutil import relativedelta
+import ee
+
+import gedi_catalog
+import gedi_export_state
+import gedi_grid
+import gedi_lib
+import gedi_plan
+import gedi_rasterize_l2a
+import gedi_rasterize_l2b
+import gedi_rasterize_l4a
+import gedi_spatial_index
+import gedi_tasks
+
+BACKFILL_PRODUCTS = flags.DEFINE_list(
+    'backfill_products', ['l2a', 'l2b', 'l4a'], 'Products to rasterize.')
+
+BACKFILL_DIR = flags.DEFINE_string(
+    'backfill_dir', 'gedi_backfill',
+    'Directory for the task and export state files of the backfill.')
+
+
+@attr.s(frozen=True)
+class Product:
+  """How to rasterize a GEDI product."""
+  # Start of the file names of the product's tables, e.g. GEDI02_A.
+  name: str = attr.ib()
+  raster_collection: str = attr.ib()
+  export_function: Callable[..., gedi_lib.ExportParameters] = attr.ib()
+  num_bands: int = attr.ib()
+
+
+PRODUCTS = {
+    'l2a': Product('GEDI02_A', gedi_rasterize_l2a.RASTER_COLLECTION,
+                   gedi_rasterize_l2a.export_wrapper,
+                   len(gedi_rasterize_l2a.raster_bands)),
+    'l2b': Product('GEDI02_B', gedi_rasterize_l2b.RASTER_COLLECTION,
+                   gedi_rasterize_l2b.export_wrapper,
+                   len(gedi_rasterize_l2b.raster_bands)),
+    'l4a': Product('GEDI04_A', gedi_rasterize_l4a.RASTER_COLLECTION,
+                   gedi_rasterize_l4a.export_wrapper,
+                   len(gedi_rasterize_l4a.INTEGER_PROPS)),
+}
+
+
+@attr.s(frozen=True)
+class WorkItem:
+  """The export of one grid cell for one product and month."""
+  product: str = attr.ib()
+  month: datetime.datetime = attr.ib()
+  grid_id: int = attr.ib()
+  table_asset_ids: tuple[str, ...] = attr.ib()
+  # Estimated input shots, 0 if unknown; see gedi_plan.
+  num_shots: int = attr.ib(default=0)
+
+
+def months(first: datetime.datetime,
+           last: datetime.datetime) -> list[datetime.datetime]:
+  """Returns the first days of the months from first to last."""
+  result = []
+  month = first
+  while month <= last:
+    result.append(month)
+    month += relativedelta.relativedelta(months=1)
+  return result
+
+
+def group_tables(
+    table_asset_ids: list[str]) -> dict[tuple[str, str], list[str]]:
+  """Groups table asset ids by product name and YYYY-MM month."""
+  groups = collections.defaultdict(list)
+  for table_asset_id in table_asset_ids:
+    name = gedi_catalog.parse_gedi_filename(table_asset_id)
+    groups[(name.product,
+            name.acquisition_time.strftime('%Y-%m'))].append(table_asset_id)
+  return groups
+
+
+def plan_work(table_asset_ids: list[str], products: list[str],
+              backfill_months: list[datetime.datetime],
+              grid_cells: dict[int, gedi_grid.GridCell],
+              catalog: Optional[gedi_catalog.Catalog] = None
+              ) -> list[WorkItem]:
+  """Expands products, months and grid cells into ordered work items.
+
+  Args:
+    table_asset_ids: tables of all products and months
+    products: keys of PRODUCTS
+    backfill_months: first days of the months
+    grid_cells: grid_id -> GridCell
+    catalog: optional catalog, to route tables and order items by size
+
+  Returns:
+    list of WorkItems, by month and then largest first
+  """
+  groups = group_tables(table_asset_ids)
+  routes = None
+  if catalog is not None:
+    # Routed once for all products and months.
+    routes = gedi_spatial_index.route_tables(
+        catalog, table_asset_ids,
+        {k: cell.bounds for k, cell in grid_cells.items()})
+
+  items = []
+  for month in backfill_months:
+    for product in products:
+      tables = groups.get((PRODUCTS[product].name, month.strftime('%Y-%m')))
+      if not tables:
+        logging.warning('No %s tables for %s', product,
+                        month.strftime('%Y-%m'))
+        continue
+      if routes is None:
+        items.extend(
+            WorkItem(product, month, grid_id, tuple(tables))
+            for grid_id in sorted(grid_cells))
+        continue
+      tables = set(tables)
+      cell_routes = {
+          grid_id: [t for t in routed if t in tables]
+          for grid_id, routed in routes.items()
+      }
+      for plan in gedi_plan.plan_exports(catalog, cell_routes, grid_cells,
+                                         PRODUCTS[product].num_bands):
+        items.append(
+            WorkItem(product, month, plan.grid_id,
+                     tuple(cell_routes[plan.grid_id]), plan.num_shots))
+  items.sort(key=lambda i: (i.month, -i.num_shots, i.product, i.grid_id))
+  return items
+
+
+def run_backfill(items: list[WorkItem],
+                 grid_cells: dict[int, gedi_grid.GridCell],
+                 scheduler: gedi_tasks.TaskScheduler,
+                 export_state: Optional[gedi_export_state.ExportState] = None,
+                 overwrite: bool = False,
+                 wait: bool = False
+                 ) -> dict[tuple[str, str], gedi_tasks.TaskRecord]:
+  """Queues the exports of the work items and runs the scheduler.
+
+  Args:
+    items: work items, in the order they are to be started
+    grid_cells: grid_id -> GridCell
+    scheduler: scheduler starting the tasks
+    export_state: optional store of earlier exports, see gedi_export_state
+    overwrite: whether existing rasters can be replaced
+    wait: whether to wait until all tasks have finished
+
+  Returns:
+    (asset id, fingerprint) -> gedi_tasks.TaskRecord
+  """
+  for item in items:
+    product = PRODUCTS[item.product]
+    cell = grid_cells[item.grid_id]
+    try:
+      gedi_lib.rasterize_gedi_by_utm_zone(
+          list(item.table_asset_ids),
+          gedi_lib.raster_asset_id(product.raster_collection, item.grid_id,
+                                   item.month),
+          cell.feature(),
+          item.month,
+          product.export_function,
+          overwrite=overwrite,
+          crs=cell.crs,
+          scheduler=scheduler,
+          export_state=export_state)
+    except ValueError as e:
+      logging.error('Skipping %s %s grid cell %d: %s', item.product,
+                    item.month.strftime('%Y-%m'), item.grid_id, e)
+  try:
+    return scheduler.run(wait=wait)
+  finally:
+    if export_state is not None:
+      export_state.update_tasks(scheduler.records.values())
+
+
+def main(argv):
+  ee.Initialize()
+  table_asset_ids = gedi_lib.list_input_files(argv[1])
+  backfill_months = months(gedi_lib.parse_month(argv[2]),
+                           gedi_lib.parse_month(argv[3]))
+  os.makedirs(BACKFILL_DIR.value, exist_ok=True)
+
+  grid_cells = gedi_grid.grid_cells_from_flags()
+  catalog = gedi_catalog.catalog_from_flags()
+  items = plan_work(table_asset_ids, BACKFILL_PRODUCTS.value,
+                    backfill_months, grid_cells, catalog)
+  logging.info('%d exports to check', len(items))
+
+  scheduler = gedi_tasks.TaskScheduler(
+      gedi_tasks.EarthEngineBackend(),
+      max_running=gedi_tasks.MAX_RUNNING_TASKS.value,
+      submissions_per_second=gedi_tasks.TASK_SUBMISSIONS_PER_SECOND.value,
+      max_retries=gedi_tasks.TASK_RETRIES.value,
+      poll_seconds=gedi_tasks.TASK_POLL_SECONDS.value,
+      state_path=(gedi_tasks.TASK_STATE.value or
+                  os.path.join(BACKFILL_DIR.value, 'tasks.json')))
+  export_state = gedi_export_state.ExportState(
+      gedi_export_state.EXPORT_STATE.value or
+      os.path.join(BACKFILL_DIR.value, 'exports.sqlite'))
+  try:
+    export_state.refresh(scheduler.backend)
+    run_backfill(items, grid_cells, scheduler, export_state,
+                 overwrite=gedi_lib.ALLOW_GEDI_RASTERIZE_OVERWRITE.value,
+                 wait=gedi_tasks.WAIT_FOR_TASKS.value)
+  finally:
+    export_state.close()
+
+
+if __name__ == '__main__':
+  app.run(main)
@@ -0,0 +1,193 @@
+# Copyright 2020 The Google Earth Engine Community Authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Measures gedi_extract throughput on synthetic granules.
+
+Usage: gedi_benchmark.py [<work dir>]
+
+Writes a synthetic orbit with gedi_synthetic (unless it is already in the
+work dir) and runs every selected extractor with every selected output
+format, each in a fresh process. For every run it prints the shots per
+second, the HDF input MB per second, the output size and the peak RSS of
+the process. With --json_output the results are also appended to a file as
+JSON lines, so that runs of different revisions can be compared.
+"""
+
+from concurrent import futures
+import json
+import multiprocessing
+import os
+import resource
+import sys
+import tempfile
+import time
+from typing import Any, Optional
+
+from absl import app
+from absl import flags
+import attr
+import h5py
+
+import gedi_extract_l2a
+import gedi_extract_l2b
+import gedi_extract_l4a
+import gedi_extract_unified
+import gedi_lib
+import gedi_synthetic
+
+PRODUCTS = flags.DEFINE_list(
+    'products', ['l2a', 'l2b', 'l4a', 'unified'], 'Extractors to benchmark.')
+
+FORMATS = flags.DEFINE_list(
+    'formats', ['csv', 'parquet', 'arrow'], 'Output formats to benchmark.')
+
+REPEATS = flags.DEFINE_integer(
+    'repeats', 1, 'Runs per extractor and format; the fastest is reported.')
+
+JSON_OUTPUT = flags.DEFINE_string(
+    'json_output', None, 'If set, results are appended to this file.')
+
+# Product -> (extractor module, indices of its inputs in write_orbit order).
+_EXTRACTORS = {
+    'l2a': (gedi_extract_l2a, (0, 1)),
+    'l2b': (gedi_extract_l2b, (1,)),
+    'l4a': (gedi_extract_l4a, (2,)),
+    'unified': (gedi_extract_unified, (0, 1, 2)),
+}
+
+
+@attr.s
+class Result:
+  """Measurements of a single extraction."""
+  product: str = attr.ib()
+  output_format: str = attr.ib()
+  shots: int = attr.ib()
+  seconds: float = attr.ib()
+  input_bytes: int = attr.ib()
+  output_bytes: int = attr.ib()
+  peak_rss_bytes: int = attr.ib()
+
+  @property
+  def shots_per_second(self) -> float:
+    return self.shots / self.seconds
+
+  @property
+  def input_mb_per_second(self) -> float:
+    return self.input_bytes / 1e6 / self.seconds
+
+
+def _peak_rss_bytes() -> int:
+  peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+  # Kilobytes on Linux, bytes on macOS.
+  return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def count_shots(hdf_path: str) -> int:
+  with h5py.File(hdf_path, 'r') as hdf_fh:
+    return sum(len(hdf_fh[f'{k}/shot_number'])
+               for k in gedi_lib.beam_keys(hdf_fh))
+
+
+def run_extraction(product: str, input_paths: list[str], output_path: str,
+                   output_format: str, options: dict[str, Any]) -> Result:
+  """Runs one extractor and measures it (runs in a fresh process)."""
+  extractor = _EXTRACTORS[product][0]
+  start = time.perf_counter()
+  extractor.extract_values(input_paths, output_path, output_format, **options)
+  seconds = time.perf_counter() - start
+  return Result(
+      product=product,
+      output_format=output_format,
+      shots=count_shots(input_paths[0]),
+      seconds=seconds,
+      input_bytes=sum(os.path.getsize(p) for p in input_paths),
+      output_bytes=os.path.getsize(output_path),
+      peak_rss_bytes=_peak_rss_bytes())
+
+
+def run_benchmark(work_dir: str, products: list[str], formats: list[str],
+                  repeats: int = 1,
+                  options: Optional[dict[str, Any]] = None) -> list[Result]:
+  """Benchmarks the extractors on the synthetic orbit in work_dir.
+
+  Args:
+    work_dir: directory with the gedi_synthetic files, also used for output
+    products: keys of _EXTRACTORS
+    formats: output formats
+    repeats: runs per product and format; the fastest one is kept
+    options: additional extract_values arguments, e.g. num_workers
+
+  Returns:
+    list of Results, one per product and format
+  """
+  orbit_paths = [
+      os.path.join(work_dir, filename) for filename in (
+          gedi_synthetic.L2A_FILENAME, gedi_synthetic.L2B_FILENAME,
+          gedi_synthetic.L4A_FILENAME)
+  ]
+  results = []
+  # Every run gets a new process, so that peak RSS is not carried over.
+  context = multiprocessing.get_context('spawn')
+  for product in products:
+    input_paths = [orbit_paths[i] for i in _EXTRACTORS[product][1]]
+    for output_format in formats:
+      output_path = os.path.join(work_dir, f'{product}.{output_format}')
+      runs = []
+      for _ in range(repeats):
+        with futures.ProcessPoolExecutor(
+            max_workers=1, mp_context=context) as executor:
+          runs.append(executor.submit(
+              run_extraction, product, input_paths, output_path,
+              output_format, options or {}).result())
+      results.append(min(runs, key=lambda r: r.seconds))
+  return results
+
+
+def format_results(results: list[Result]) -> str:
+  lines = ['%-8s %-8s %10s %8s %10s %8s %10s %10s' % (
+      'product', 'format', 'shots', 'seconds', 'shots/s', 'MB/s',
+      'output MB', 'peak RSS MB')]
+  for r in results:
+    lines.append('%-8s %-8s %10d %8.2f %10.0f %8.1f %10.1f %10.1f' % (
+        r.product, r.output_format, r.shots, r.seconds, r.shots_per_second,
+        r.input_mb_per_second, r.output_bytes / 1e6, r.peak_rss_bytes / 1e6))
+  return '\n'.join(lines)
+
+
+def main(argv):
+  work_dir = argv[1] if len(argv) > 1 else tempfile.mkdtemp(
+      prefix='gedi_benchmark_')
+  if not os.path.exists(
+      os.path.join(work_dir, gedi_synthetic.L4A_FILENAME)):
+    compression = (None if gedi_synthetic.COMPRESSION.value == 'none'
+                   else gedi_synthetic.COMPRESSION.value)
+    gedi_synthetic.write_orbit(
+        work_dir, gedi_synthetic.NUM_SHOTS.value,
+        gedi_synthetic.CHUNK_ROWS.value, compression,
+        gedi_synthetic.SEED.value)
+
+  results = run_benchmark(
+      work_dir, PRODUCTS.value, FORMATS.value, REPEATS.value, {
+          'num_workers': gedi_lib.NUM_BEAM_WORKERS.value,
+          'window_rows': gedi_lib.STREAM_WINDOW_ROWS.value,
+          'prefetch_depth': gedi_lib.PREFETCH_BEAMS.value,
+      })
+  print(format_results(results))
+  if JSON_OUTPUT.value:
+    with open(JSON_OUTPUT.value, 'a') as fh:
+      for r in results:
+        fh.write(json.dumps(attr.asdict(r)) + '\n')
+
+
+if __name__ == '__main__':
+  app.run(main)
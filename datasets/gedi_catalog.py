@@ -0,0 +1,437 @@
+# Copyright 2020 The Google Earth Engine Community Authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""SQLite catalog of GEDI granules.
+
+Usage: gedi_catalog.py <input dir or file list> <catalog path>
+
+Records for every granule the fields parsed from its file name (product,
+acquisition time, orbit, sub-orbit and track) and, for local .h5 files, the
+shot count and lat/lon bounding box of every beam, and the bounding boxes
+of short segments of every beam's ground track. Adding granules is
+incremental: files already in the catalog with the same size and
+modification time are not read again, so the catalog can be updated every
+month from the full granule list.
+
+The batch extractor and the rasterize scripts take --gedi_catalog to skip
+granules and tables that cannot intersect the area they work on; see also
+gedi_spatial_index.py, which routes tables to grid cells by their segments.
+"""
+
+import datetime
+import functools
+import os
+import sqlite3
+from typing import Iterable, Optional
+
+from absl import app
+from absl import flags
+from absl import logging
+import attr
+import h5py
+import numpy as np
+
+import gedi_lib
+
+CATALOG = flags.DEFINE_string(
+    'gedi_catalog', None,
+    'Path of a catalog written by gedi_catalog.py, used to skip granules '
+    'outside the area of interest.')
+
+# Product -> HDF paths of the latitude and longitude used for the bounds.
+_COORDINATES = {
+    'GEDI02_A': ('lat_lowestmode', 'lon_lowestmode'),
+    'GEDI02_B': ('geolocation/lat_lowestmode', 'geolocation/lon_lowestmode'),
+    'GEDI04_A': ('lat_lowestmode', 'lon_lowestmode'),
+}
+
+# Tables whose bounding box is within this many degrees of a grid cell are
+# kept; this covers the buffer around grid cells in create_export.
+BOUNDS_MARGIN_DEGREES = 0.05
+
+# Shots per ground track segment, about 600 km along track. A whole orbit
+# spans most longitudes, so only segments can tell which grid cells it
+# passes over.
+_SEGMENT_SHOTS = 10000
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS granules (
+  path TEXT PRIMARY KEY,
+  product TEXT NOT NULL,
+  granule_key TEXT NOT NULL,
+  acquisition_time REAL NOT NULL,
+  orbit INTEGER NOT NULL,
+  sub_orbit INTEGER NOT NULL,
+  track INTEGER NOT NULL,
+  file_size INTEGER,
+  file_mtime REAL,
+  num_shots INTEGER,
+  min_lon REAL, min_lat REAL, max_lon REAL, max_lat REAL
+);
+CREATE INDEX IF NOT EXISTS granules_by_key ON granules (product, granule_key);
+CREATE INDEX IF NOT EXISTS granules_by_time ON granules (acquisition_time);
+CREATE TABLE IF NOT EXISTS beams (
+  path TEXT NOT NULL,
+  beam TEXT NOT NULL,
+  num_shots INTEGER NOT NULL,
+  min_lon REAL, min_lat REAL, max_lon REAL, max_lat REAL,
+  PRIMARY KEY (path, beam)
+);
+CREATE TABLE IF NOT EXISTS segments (
+  path TEXT NOT NULL,
+  beam TEXT NOT NULL,
+  min_lon REAL NOT NULL, min_lat REAL NOT NULL,
+  max_lon REAL NOT NULL, max_lat REAL NOT NULL,
+  num_shots INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS segments_by_path ON segments (path);
+"""
+
+
+@attr.s(frozen=True)
+class GranuleName:
+  """Fields of a GEDI file name or table asset id.
+
+  Example: GEDI02_A_2019108002011_O01961_03_T03909_02_005_01_V002.h5
+  """
+  product: str = attr.ib()  # GEDI02_A
+  acquisition_time: datetime.datetime = attr.ib()  # 2019-04-18 00:20:11 UTC
+  orbit: int = attr.ib()  # 1961
+  sub_orbit: int = attr.ib()  # 3
+  track: int = attr.ib()  # 3909
+  granule_key: str = attr.ib()  # 2019108002011_O01961_03
+
+
+@attr.s(frozen=True)
+class BeamInfo:
+  beam: str = attr.ib()
+  num_shots: int = attr.ib()
+  # (min_lon, min_lat, max_lon, max_lat), None if no shot has coordinates.
+  bounds: Optional[tuple[float, float, float, float]] = attr.ib()
+  # (min_lon, min_lat, max_lon, max_lat, num_shots) of consecutive pieces
+  # of the ground track, see _segments.
+  segments: tuple[tuple[float, float, float, float, int],
+                  ...] = attr.ib(default=())
+
+
+@functools.lru_cache(maxsize=None)
+def parse_gedi_filename(path: str) -> GranuleName:
+  """Parses a GEDI file path, file name or table asset id."""
+  parts = os.path.basename(path).split('_')
+  return GranuleName(
+      product='_'.join(parts[:2]),
+      acquisition_time=gedi_lib.parse_date_from_gedi_filename(path),
+      orbit=int(parts[3][1:]),
+      sub_orbit=int(parts[4]),
+      track=int(parts[5][1:]),
+      granule_key=gedi_lib.parse_granule_key_from_gedi_filename(path))
+
+
+def _bounds(
+    lat: np.ndarray, lon: np.ndarray
+) -> Optional[tuple[float, float, float, float]]:
+  if not len(lat):
+    return None
+  return (float(lon.min()), float(lat.min()), float(lon.max()),
+          float(lat.max()))
+
+
+def _segments(
+    lat: np.ndarray,
+    lon: np.ndarray) -> tuple[tuple[float, float, float, float, int], ...]:
+  """Returns the bounds and shot counts of pieces of a ground track.
+
+  The track is split every _SEGMENT_SHOTS shots and where it crosses the
+  antimeridian, so that no segment spans the globe.
+  """
+  if not len(lat):
+    return ()
+  crossings = np.flatnonzero(np.abs(np.diff(lon)) > 180) + 1
+  starts = np.union1d(np.arange(0, len(lat), _SEGMENT_SHOTS), crossings)
+  boxes = np.column_stack([
+      np.minimum.reduceat(lon, starts), np.minimum.reduceat(lat, starts),
+      np.maximum.reduceat(lon, starts), np.maximum.reduceat(lat, starts)
+  ])
+  num_shots = np.diff(np.append(starts, len(lat)))
+  return tuple(
+      tuple(b) + (n,) for b, n in zip(boxes.tolist(), num_shots.tolist()))
+
+
+def _valid(ds: h5py.Dataset) -> tuple[np.ndarray, np.ndarray]:
+  values = gedi_lib.read_rows(ds)
+  valid = np.isfinite(values)
+  fill_value = ds.attrs.get('_FillValue')
+  if fill_value is not None:
+    valid &= values != fill_value
+  return values, valid
+
+
+def read_beam_info(hdf_path: str, product: str) -> list[BeamInfo]:
+  """Reads the shot counts, bounding boxes and segments of the beams."""
+  lat_path, lon_path = _COORDINATES[product]
+  beams = []
+  with h5py.File(hdf_path, 'r') as hdf_fh:
+    for k in gedi_lib.beam_keys(hdf_fh):
+      lat, lat_valid = _valid(hdf_fh[f'{k}/{lat_path}'])
+      lon, lon_valid = _valid(hdf_fh[f'{k}/{lon_path}'])
+      valid = lat_valid & lon_valid
+      beams.append(BeamInfo(
+          beam=k,
+          num_shots=len(hdf_fh[f'{k}/shot_number']),
+          bounds=_bounds(lat[valid], lon[valid]),
+          segments=_segments(lat[valid], lon[valid])))
+  return beams
+
+
+def _union(boxes: Iterable[Optional[tuple[float, float, float, float]]]):
+  boxes = [b for b in boxes if b is not None]
+  if not boxes:
+    return None
+  return (min(b[0] for b in boxes), min(b[1] for b in boxes),
+          max(b[2] for b in boxes), max(b[3] for b in boxes))
+
+
+def _intersects(a: tuple[float, float, float, float],
+                b: tuple[float, float, float, float]) -> bool:
+  return a[0] <= b[2] and b[0] <= a[2] and a[1] <= b[3] and b[1] <= a[3]
+
+
+class Catalog:
+  """A GEDI granule catalog stored in SQLite."""
+
+  def __init__(self, db_path: str):
+    self._db = sqlite3.connect(db_path)
+    self._db.executescript(_SCHEMA)
+
+  def close(self) -> None:
+    self._db.close()
+
+  def add_granules(self, paths: list[str]) -> int:
+    """Adds or refreshes granules.
+
+    Local .h5 files are read for their beam bounds and shot counts, unless
+    they are in the catalog with the same size and modification time. Other
+    paths, like table asset ids, only get the fields of their names.
+
+    Args:
+      paths: GEDI file paths or table asset ids
+
+    Returns:
+      number of granules added or refreshed
+    """
+    num_added = 0
+    for path in paths:
+      name = parse_gedi_filename(path)
+      file_size = file_mtime = None
+      beams = []
+      if os.path.isfile(path):
+        stat = os.stat(path)
+        file_size, file_mtime = stat.st_size, stat.st_mtime
+        if self._db.execute(
+            'SELECT 1 FROM granules WHERE path = ? AND file_size = ? '
+            'AND file_mtime = ?', (path, file_size, file_mtime)).fetchone():
+          continue
+        if name.product in _COORDINATES:
+          beams = read_beam_info(path, name.product)
+      elif self._db.execute('SELECT 1 FROM granules WHERE path = ?',
+                            (path,)).fetchone():
+        continue
+
+      bounds = _union(b.bounds for b in beams)
+      with self._db:
+        self._db.execute('DELETE FROM beams WHERE path = ?', (path,))
+        self._db.execute('DELETE FROM segments WHERE path = ?', (path,))
+        self._db.execute(
+            'INSERT OR REPLACE INTO granules VALUES '
+            '(?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            (path, name.product, name.granule_key,
+             name.acquisition_time.timestamp(), name.orbit, name.sub_orbit,
+             name.track, file_size, file_mtime,
+             sum(b.num_shots for b in beams) if beams else None) +
+            (bounds or (None,) * 4))
+        self._db.executemany(
+            'INSERT INTO beams VALUES (?, ?, ?, ?, ?, ?, ?)',
+            [(path, b.beam, b.num_shots) + (b.bounds or (None,) * 4)
+             for b in beams])
+        self._db.executemany(
+            'INSERT INTO segments VALUES (?, ?, ?, ?, ?, ?, ?)',
+            [(path, b.beam) + segment for b in beams
+             for segment in b.segments])
+      num_added += 1
+    return num_added
+
+  def bounds(
+      self, path: str) -> Optional[tuple[float, float, float, float]]:
+    """Returns the bounds of a granule, looked up by product and granule key.
+
+    This also finds the bounds of tables extracted from a cataloged file,
+    as their asset ids keep the file name.
+
+    Args:
+      path: GEDI file path or table asset id
+
+    Returns:
+      (min_lon, min_lat, max_lon, max_lat), or None if unknown
+    """
+    name = parse_gedi_filename(path)
+    row = self._db.execute(
+        'SELECT min_lon, min_lat, max_lon, max_lat FROM granules '
+        'WHERE product = ? AND granule_key = ? AND min_lon IS NOT NULL',
+        (name.product, name.granule_key)).fetchone()
+    return row
+
+  def segments(
+      self, path: str) -> list[tuple[float, float, float, float]]:
+    """Returns the ground track segments of a granule.
+
+    Like bounds, this is looked up by product and granule key, so it also
+    works for table asset ids. Granules cataloged without segments get
+    their bounding box as a single segment.
+
+    Args:
+      path: GEDI file path or table asset id
+
+    Returns:
+      list of (min_lon, min_lat, max_lon, max_lat), empty if unknown
+    """
+    name = parse_gedi_filename(path)
+    row = self._db.execute(
+        'SELECT path, min_lon, min_lat, max_lon, max_lat FROM granules '
+        'WHERE product = ? AND granule_key = ? AND min_lon IS NOT NULL',
+        (name.product, name.granule_key)).fetchone()
+    if row is None:
+      return []
+    segments = self._db.execute(
+        'SELECT min_lon, min_lat, max_lon, max_lat FROM segments '
+        'WHERE path = ?', (row[0],)).fetchall()
+    return segments or [row[1:]]
+
+  def segment_shots(
+      self, path: str) -> list[tuple[float, float, float, float, int]]:
+    """Returns the ground track segments of a granule with shot counts.
+
+    Like segments, but every segment has its shot count appended. Granules
+    cataloged without segments get their bounding box and shot count as a
+    single segment.
+
+    Args:
+      path: GEDI file path or table asset id
+
+    Returns:
+      list of (min_lon, min_lat, max_lon, max_lat, num_shots), empty if
+      unknown
+    """
+    name = parse_gedi_filename(path)
+    row = self._db.execute(
+        'SELECT path, min_lon, min_lat, max_lon, max_lat, num_shots '
+        'FROM granules WHERE product = ? AND granule_key = ? '
+        'AND min_lon IS NOT NULL',
+        (name.product, name.granule_key)).fetchone()
+    if row is None:
+      return []
+    segments = self._db.execute(
+        'SELECT min_lon, min_lat, max_lon, max_lat, num_shots FROM segments '
+        'WHERE path = ?', (row[0],)).fetchall()
+    return segments or [row[1:]]
+
+  def beams(self, path: str) -> list[BeamInfo]:
+    """Returns the cataloged beams of a granule file."""
+    rows = self._db.execute(
+        'SELECT beam, num_shots, min_lon, min_lat, max_lon, max_lat '
+        'FROM beams WHERE path = ? ORDER BY beam', (path,)).fetchall()
+    return [
+        BeamInfo(beam, num_shots,
+                 None if bounds[0] is None else tuple(bounds))
+        for beam, num_shots, *bounds in rows
+    ]
+
+  def granules(self,
+               product: Optional[str] = None,
+               start: Optional[datetime.datetime] = None,
+               end: Optional[datetime.datetime] = None,
+               bbox: Optional[tuple[float, float, float, float]] = None
+               ) -> list[str]:
+    """Returns the cataloged paths matching all of the given conditions.
+
+    Args:
+      product: e.g. GEDI02_A
+      start: acquired at or after this time
+      end: acquired before this time
+      bbox: (min_lon, min_lat, max_lon, max_lat) the granule bounds
+        intersect; granules without bounds are not returned
+
+    Returns:
+      list of paths, by acquisition time
+    """
+    conditions, args = [], []
+    if product:
+      conditions.append('product = ?')
+      args.append(product)
+    if start:
+      conditions.append('acquisition_time >= ?')
+      args.append(start.timestamp())
+    if end:
+      conditions.append('acquisition_time < ?')
+      args.append(end.timestamp())
+    if bbox:
+      conditions.append(
+          'min_lon <= ? AND max_lon >= ? AND min_lat <= ? AND max_lat >= ?')
+      args.extend([bbox[2], bbox[0], bbox[3], bbox[1]])
+    where = ' WHERE ' + ' AND '.join(conditions) if conditions else ''
+    return [row[0] for row in self._db.execute(
+        'SELECT path FROM granules' + where +
+        ' ORDER BY acquisition_time, path', args)]
+
+  def filter_intersecting(
+      self, paths: list[str],
+      bbox: tuple[float, float, float, float],
+      margin: float = BOUNDS_MARGIN_DEGREES) -> list[str]:
+    """Drops the paths whose cataloged bounds do not intersect bbox.
+
+    Paths without cataloged bounds are kept.
+
+    Args:
+      paths: GEDI file paths or table asset ids
+      bbox: (min_lon, min_lat, max_lon, max_lat)
+      margin: degrees added to bbox on all sides
+
+    Returns:
+      the remaining paths, in order
+    """
+    bbox = (bbox[0] - margin, bbox[1] - margin, bbox[2] + margin,
+            bbox[3] + margin)
+    kept = []
+    for path in paths:
+      bounds = self.bounds(path)
+      if bounds is None or _intersects(bounds, bbox):
+        kept.append(path)
+    return kept
+
+
+def catalog_from_flags() -> Optional[Catalog]:
+  return Catalog(CATALOG.value) if CATALOG.value else None
+
+
+def main(argv):
+  catalog = Catalog(argv[2])
+  try:
+    paths = gedi_lib.list_input_files(argv[1])
+    num_added = catalog.add_granules(paths)
+    logging.info('%d of %d granules added or refreshed', num_added,
+                 len(paths))
+  finally:
+    catalog.close()
+
+
+if __name__ == '__main__':
+  app.run(main)
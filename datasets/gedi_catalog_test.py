@@ -0,0 +1,158 @@
+# Copyright 2020 The Google Earth Engine Community Authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Tests for gedi_catalog."""
+
+import datetime
+import os
+import tempfile
+
+from absl.testing import absltest
+import h5py
+import numpy as np
+import pytz
+
+import gedi_catalog
+
+_L2A = 'GEDI02_A_2019108002011_O01961_03_T03909_02_005_01_V002.h5'
+_L2B = 'GEDI02_B_2019108002011_O01961_03_T03909_02_003_01_V002.h5'
+_L2A_MAY = 'GEDI02_A_2019128120000_O02280_01_T01234_02_005_01_V002.h5'
+
+
+def _write_granule(path: str, tracks: dict[str, tuple[np.ndarray,
+                                                      np.ndarray]]) -> None:
+  """Writes the shot numbers and coordinates of every beam."""
+  coordinates = gedi_catalog._COORDINATES[  # pylint: disable=protected-access
+      os.path.basename(path)[:8]]
+  with h5py.File(path, 'w') as hdf_fh:
+    for beam_key, (lats, lons) in tracks.items():
+      beam = hdf_fh.create_group(beam_key)
+      beam['shot_number'] = np.arange(len(lats), dtype=np.uint64)
+      lat = beam.create_dataset(coordinates[0], data=lats)
+      lat.attrs['_FillValue'] = -9999.0
+      beam.create_dataset(coordinates[1], data=lons)
+
+
+class CatalogTest(absltest.TestCase):
+
+  def setUp(self):
+    super().setUp()
+    self.tmp_dir = self.enter_context(tempfile.TemporaryDirectory())
+    self.catalog_path = os.path.join(self.tmp_dir, 'catalog.db')
+    self.l2a_path = os.path.join(self.tmp_dir, _L2A)
+    # 25000 shots: three segments, with one fill value latitude.
+    lats = np.linspace(10, 20, 25000)
+    lats[7] = -9999
+    _write_granule(self.l2a_path, {
+        'BEAM0000': (lats, np.linspace(-100, -90, 25000)),
+        'BEAM0101': (np.array([5.0, 6.0]), np.array([-80.0, -79.0])),
+    })
+    self.l2b_path = os.path.join(self.tmp_dir, _L2B)
+    # Crosses the antimeridian after the second shot.
+    _write_granule(self.l2b_path, {
+        'BEAM0000': (np.array([0.0, 1, 2, 3]),
+                     np.array([178.0, 179.5, -179.5, -178])),
+    })
+
+  def _catalog(self):
+    catalog = gedi_catalog.Catalog(self.catalog_path)
+    self.addCleanup(catalog.close)
+    return catalog
+
+  def test_beams_and_segments(self):
+    catalog = self._catalog()
+    self.assertEqual(catalog.add_granules([self.l2a_path, self.l2b_path]), 2)
+
+    self.assertEqual(catalog.bounds(self.l2a_path), (-100, 5, -79, 20))
+    beams = catalog.beams(self.l2a_path)
+    self.assertEqual([b.beam for b in beams], ['BEAM0000', 'BEAM0101'])
+    self.assertEqual([b.num_shots for b in beams], [25000, 2])
+    segment_shots = catalog.segment_shots(self.l2a_path)
+    self.assertLen(segment_shots, 4)
+    # The shot with a fill value latitude is left out.
+    self.assertEqual(sum(s[4] for s in segment_shots), 25001)
+    self.assertEqual(catalog.segments(self.l2a_path),
+                     [s[:4] for s in segment_shots])
+    self.assertEqual(catalog.segments(self.l2b_path),
+                     [(178, 0, 179.5, 1), (-179.5, 2, -178, 3)])
+
+  def test_tables_find_their_granule(self):
+    catalog = self._catalog()
+    catalog.add_granules([self.l2a_path])
+    table_asset_id = 'users/a/gedi_l2a/' + _L2A[:-3]
+
+    self.assertEqual(catalog.bounds(table_asset_id),
+                     catalog.bounds(self.l2a_path))
+    self.assertEqual(catalog.segments(table_asset_id),
+                     catalog.segments(self.l2a_path))
+    self.assertIsNone(catalog.bounds('users/a/gedi_l2a/' + _L2A_MAY[:-3]))
+    self.assertEmpty(catalog.segments('users/a/gedi_l2a/' + _L2A_MAY[:-3]))
+
+  def test_adding_is_incremental(self):
+    catalog = self._catalog()
+    self.assertEqual(catalog.add_granules([self.l2a_path]), 1)
+    self.assertEqual(catalog.add_granules([self.l2a_path]), 0)
+
+    _write_granule(self.l2a_path, {
+        'BEAM0000': (np.array([1.0, 2.0]), np.array([3.0, 4.0])),
+    })
+    os.utime(self.l2a_path, (0, 0))
+    self.assertEqual(catalog.add_granules([self.l2a_path]), 1)
+    self.assertEqual(catalog.bounds(self.l2a_path), (3, 1, 4, 2))
+    self.assertEqual(catalog.segment_shots(self.l2a_path), [(3, 1, 4, 2, 2)])
+
+    # Files that are not local only get the fields of their names.
+    self.assertEqual(catalog.add_granules(['gs://bucket/' + _L2A_MAY]), 1)
+    self.assertEqual(catalog.add_granules(['gs://bucket/' + _L2A_MAY]), 0)
+
+  def test_round_trip(self):
+    catalog = self._catalog()
+    catalog.add_granules([self.l2a_path, self.l2b_path])
+    catalog.add_granules(['gs://bucket/' + _L2A_MAY])
+    catalog.close()
+
+    catalog = self._catalog()
+    self.assertEqual(catalog.granules(),
+                     [self.l2a_path, self.l2b_path, 'gs://bucket/' + _L2A_MAY])
+    self.assertEqual(catalog.granules(product='GEDI02_B'), [self.l2b_path])
+    may = pytz.utc.localize(datetime.datetime(2019, 5, 1))
+    self.assertEqual(catalog.granules(start=may), ['gs://bucket/' + _L2A_MAY])
+    self.assertEqual(catalog.granules(end=may),
+                     [self.l2a_path, self.l2b_path])
+    self.assertEqual(catalog.granules(bbox=(-85, 10, -84, 30)),
+                     [self.l2a_path])
+    # Crossing the antimeridian, the L2B granule spans all longitudes.
+    self.assertEqual(catalog.granules(bbox=(0, 0, 1, 1)), [self.l2b_path])
+
+    name = gedi_catalog.parse_gedi_filename(self.l2a_path)
+    self.assertEqual(name.orbit, 1961)
+    self.assertEqual(name.sub_orbit, 3)
+    self.assertEqual(name.track, 3909)
+    self.assertEqual(name.granule_key, '2019108002011_O01961_03')
+
+  def test_filter_intersecting(self):
+    catalog = self._catalog()
+    catalog.add_granules([self.l2a_path, self.l2b_path])
+    unknown = 'users/a/gedi_l2a/' + _L2A_MAY[:-3]
+    paths = [self.l2b_path, self.l2a_path, unknown]
+
+    self.assertEqual(
+        catalog.filter_intersecting(paths, (-78.9, 4, -78, 4.5), margin=0),
+        [unknown])
+    self.assertEqual(
+        catalog.filter_intersecting(paths, (-78.9, 4, -78, 4.5), margin=0.6),
+        [self.l2a_path, unknown])
+
+
+if __name__ == '__main__':
+  absltest.main()
@@ -0,0 +1,158 @@
+# Copyright 2020 The Google Earth Engine Community Authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""SQLite store of the monthly raster exports, for incremental reruns.
+
+For every raster asset (that is, product and grid cell) and month, the
+store keeps the table asset ids that went into the last export, the
+fingerprint of its parameters (see gedi_lib.export_fingerprint) and the
+state of its task. With --export_state the rasterize scripts skip the cells
+whose last export completed, or is still running, with the same
+fingerprint, so that after a granule is reprocessed only the cells it
+touches are exported again.
+"""
+
+import json
+import sqlite3
+import time
+from typing import Any, Iterable, Optional
+
+from absl import flags
+from absl import logging
+
+import gedi_lib
+
+EXPORT_STATE = flags.DEFINE_string(
+    'export_state', None,
+    'SQLite file recording the exports of every grid cell and month. Cells '
+    'whose inputs and parameters did not change since their last successful '
+    'export are skipped.')
+
+# Task states after which an export with the same fingerprint is not
+# started again.
+_CURRENT_STATES = ('COMPLETED', 'UNSUBMITTED', 'READY', 'RUNNING')
+# Task states that can still change.
+_ACTIVE_STATES = ('UNSUBMITTED', 'READY', 'RUNNING', 'CANCEL_REQUESTED')
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS exports (
+  asset_id TEXT NOT NULL,
+  month TEXT NOT NULL,
+  fingerprint TEXT NOT NULL,
+  table_asset_ids TEXT NOT NULL,
+  task_id TEXT,
+  state TEXT NOT NULL,
+  updated REAL NOT NULL,
+  PRIMARY KEY (asset_id, month)
+);
+"""
+
+
+def _month(grill_month: Any) -> str:
+  return grill_month.strftime('%Y-%m')
+
+
+class ExportState:
+  """Exports of grid cells by month, stored in SQLite."""
+
+  def __init__(self, db_path: str):
+    self._db = sqlite3.connect(db_path)
+    self._db.executescript(_SCHEMA)
+
+  def close(self) -> None:
+    self._db.close()
+
+  def _row(self, asset_id: str, month: str) -> Optional[tuple[Any, ...]]:
+    return self._db.execute(
+        'SELECT fingerprint, table_asset_ids, task_id, state FROM exports '
+        'WHERE asset_id = ? AND month = ?', (asset_id, month)).fetchone()
+
+  def is_current(self, export_params: gedi_lib.ExportParameters,
+                 grill_month: Any, fingerprint: str,
+                 table_asset_ids: list[str]) -> bool:
+    """Returns whether the last export of the asset and month is still valid.
+
+    Args:
+      export_params: parameters of the new export
+      grill_month: month of the export
+      fingerprint: gedi_lib.export_fingerprint of export_params
+      table_asset_ids: tables of the new export, only used for logging
+
+    Returns:
+      True if the last export had the same fingerprint and completed or is
+      still running
+    """
+    row = self._row(export_params.asset_id, _month(grill_month))
+    if row is None:
+      return False
+    last_fingerprint, last_tables, task_id, state = row
+    if last_fingerprint == fingerprint:
+      if state in _CURRENT_STATES:
+        return True
+      logging.info('Exporting %s again, task %s is %s',
+                   export_params.asset_id, task_id, state)
+      return False
+    last_tables = set(json.loads(last_tables))
+    logging.info('Exporting %s again: %d tables added, %d removed',
+                 export_params.asset_id,
+                 len(set(table_asset_ids) - last_tables),
+                 len(last_tables - set(table_asset_ids)))
+    return False
+
+  def record(self, export_params: gedi_lib.ExportParameters,
+             grill_month: Any, fingerprint: str,
+             table_asset_ids: list[str],
+             task_id: Optional[str] = None,
+             state: str = 'QUEUED') -> None:
+    """Records a new export of an asset and month."""
+    with self._db:
+      self._db.execute(
+          'INSERT OR REPLACE INTO exports VALUES (?, ?, ?, ?, ?, ?, ?)',
+          (export_params.asset_id, _month(grill_month), fingerprint,
+           json.dumps(sorted(table_asset_ids)), task_id, state, time.time()))
+
+  def update_tasks(self, task_records: Iterable[Any]) -> None:
+    """Copies task ids and states from gedi_tasks.TaskRecords.
+
+    Only the exports with the fingerprint of the task record are updated.
+    """
+    with self._db:
+      self._db.executemany(
+          'UPDATE exports SET task_id = ?, state = ?, updated = ? '
+          'WHERE asset_id = ? AND fingerprint = ?',
+          [(r.task_id, r.state, time.time(), r.asset_id, r.fingerprint)
+           for r in task_records if r.fingerprint])
+
+  def refresh(self, backend: Any) -> None:
+    """Updates the states of the tasks that were running at the last run.
+
+    Args:
+      backend: gedi_tasks.TaskBackend to look the task states up with
+    """
+    rows = self._db.execute(
+        'SELECT task_id FROM exports WHERE task_id IS NOT NULL AND state IN '
+        '(%s)' % ', '.join('?' * len(_ACTIVE_STATES)),
+        _ACTIVE_STATES).fetchall()
+    if not rows:
+      return
+    task_ids = [task_id for task_id, in rows]
+    states = backend.states(task_ids)
+    with self._db:
+      self._db.executemany(
+          'UPDATE exports SET state = ?, updated = ? WHERE task_id = ?',
+          [(states.get(task_id, ('UNKNOWN', ''))[0], time.time(), task_id)
+           for task_id in task_ids])
+
+
+def state_from_flags() -> Optional[ExportState]:
+  return ExportState(EXPORT_STATE.value) if EXPORT_STATE.value else None
@@ -0,0 +1,170 @@
+# Copyright 2020 The Google Earth Engine Community Authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Tests for gedi_export_state and gedi_lib.export_fingerprint."""
+
+import datetime
+import json
+import os
+import tempfile
+
+from absl.testing import absltest
+import attr
+import pytz
+
+import gedi_export_state
+import gedi_lib
+import gedi_tasks
+
+_MAY = pytz.utc.localize(datetime.datetime(2020, 5, 1))
+_JUNE = pytz.utc.localize(datetime.datetime(2020, 6, 1))
+
+
+class FakeExpression:
+  """Stands in for ee objects, which need ee.Initialize to serialize."""
+
+  def __init__(self, **args):
+    self._args = args
+
+  def serialize(self) -> str:
+    return json.dumps(self._args, sort_keys=True)
+
+
+def _export(table_asset_ids, raster_asset_id, grid_cell_feature, grill_month,
+            overwrite, crs=None):
+  """Like the export_wrapper of the rasterize scripts, without EE."""
+  image = FakeExpression(tables=table_asset_ids,
+                         month=grill_month.strftime('%Y-%m'),
+                         bands=['rh98', 'sensitivity'])
+  return gedi_lib.ExportParameters(
+      asset_id=raster_asset_id,
+      image=image,
+      pyramiding_policy={'.default': 'sample', 'rh98': 'mean'},
+      crs=crs or 'EPSG:32610',
+      region=FakeExpression(cell=grid_cell_feature),
+      overwrite=overwrite)
+
+
+class ExportFingerprintTest(absltest.TestCase):
+
+  def test_changes_with_inputs_and_parameters(self):
+    export_params = _export(['t/1', 't/2'], 'r/001', 1, _MAY, False)
+    fingerprint = gedi_lib.export_fingerprint(export_params)
+    self.assertEqual(
+        gedi_lib.export_fingerprint(
+            _export(['t/1', 't/2'], 'r/001', 1, _MAY, False)), fingerprint)
+    # Neither the order of the pyramiding policy nor overwriting matter.
+    self.assertEqual(
+        gedi_lib.export_fingerprint(attr.evolve(
+            export_params, overwrite=True,
+            pyramiding_policy={'rh98': 'mean', '.default': 'sample'})),
+        fingerprint)
+
+    changed = [
+        _export(['t/1', 't/3'], 'r/001', 1, _MAY, False),
+        _export(['t/1'], 'r/001', 1, _MAY, False),
+        _export(['t/1', 't/2'], 'r/002', 1, _MAY, False),
+        _export(['t/1', 't/2'], 'r/001', 2, _MAY, False),
+        _export(['t/1', 't/2'], 'r/001', 1, _JUNE, False),
+        _export(['t/1', 't/2'], 'r/001', 1, _MAY, False, crs='EPSG:32611'),
+        attr.evolve(export_params, pyramiding_policy={'.default': 'mean'}),
+    ]
+    fingerprints = {gedi_lib.export_fingerprint(p) for p in changed}
+    self.assertLen(fingerprints, len(changed))
+    self.assertNotIn(fingerprint, fingerprints)
+
+
+class ExportStateTest(absltest.TestCase):
+
+  def setUp(self):
+    super().setUp()
+    self.db_path = os.path.join(
+        self.enter_context(tempfile.TemporaryDirectory()), 'exports.db')
+
+  def _state(self):
+    export_state = gedi_export_state.ExportState(self.db_path)
+    self.addCleanup(export_state.close)
+    return export_state
+
+  def test_is_current(self):
+    export_state = self._state()
+    export_params = _export(['t/1'], 'r/001', 1, _MAY, False)
+    fingerprint = gedi_lib.export_fingerprint(export_params)
+    self.assertFalse(
+        export_state.is_current(export_params, _MAY, fingerprint, ['t/1']))
+
+    export_state.record(export_params, _MAY, fingerprint, ['t/1'], 'T1',
+                        'READY')
+    self.assertTrue(
+        export_state.is_current(export_params, _MAY, fingerprint, ['t/1']))
+    # Another month, or new inputs, are exported again.
+    self.assertFalse(
+        export_state.is_current(export_params, _JUNE, fingerprint, ['t/1']))
+    self.assertFalse(
+        export_state.is_current(export_params, _MAY, 'other', ['t/1', 't/2']))
+
+    # As are failed exports with the same fingerprint.
+    export_state.update_tasks([gedi_tasks.TaskRecord(
+        'r/001', fingerprint=fingerprint, task_id='T1', state='FAILED')])
+    self.assertFalse(
+        export_state.is_current(export_params, _MAY, fingerprint, ['t/1']))
+
+  def test_refresh(self):
+    backend = gedi_tasks.FakeBackend(polls_to_complete=2)
+    export_state = self._state()
+    export_params = _export(['t/1'], 'r/001', 1, _MAY, False)
+    fingerprint = gedi_lib.export_fingerprint(export_params)
+    task_id = backend.start(export_params)
+    export_state.record(export_params, _MAY, fingerprint, ['t/1'], task_id,
+                        'READY')
+    export_state.close()
+
+    # The task is RUNNING after the first poll, then COMPLETED.
+    export_state = self._state()
+    for _ in range(2):
+      export_state.refresh(backend)
+      self.assertTrue(
+          export_state.is_current(export_params, _MAY, fingerprint, ['t/1']))
+
+    # A task that is not known any more is exported again.
+    export_state.record(export_params, _JUNE, fingerprint, ['t/1'], 'GONE',
+                        'RUNNING')
+    export_state.refresh(backend)
+    self.assertFalse(
+        export_state.is_current(export_params, _JUNE, fingerprint, ['t/1']))
+
+  def test_rasterize_skips_current_exports(self):
+    export_state = self._state()
+    scheduler = gedi_tasks.TaskScheduler(gedi_tasks.FakeBackend())
+
+    def rasterize(table_asset_ids, grid_cell_id):
+      return gedi_lib.rasterize_gedi_by_utm_zone(
+          table_asset_ids, 'r/%03d' % grid_cell_id, grid_cell_id, _MAY,
+          _export, scheduler=scheduler, export_state=export_state)
+
+    rasterize(['t/1'], 1)
+    rasterize(['t/1', 't/2'], 2)
+    self.assertLen(scheduler.records, 2)
+    # Nothing changed.
+    rasterize(['t/1'], 1)
+    rasterize(['t/1', 't/2'], 2)
+    self.assertLen(scheduler.records, 2)
+    # A table was reprocessed under a new asset id.
+    rasterize(['t/1'], 1)
+    rasterize(['t/1', 't/2v2'], 2)
+    self.assertCountEqual([asset_id for asset_id, _ in scheduler.records],
+                          ['r/001', 'r/002', 'r/002'])
+
+
+if __name__ == '__main__':
+  absltest.main()
@@ -0,0 +1,277 @@
+# Copyright 2020 The Google Earth Engine Community Authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Extracts many GEDI granules in a single process launch.
+
+Usage: gedi_extract_batch.py <input dir or file list> <output dir>
+
+The input is either a directory containing GEDI .h5 files or a text file with
+one path per line. For --product=l2a the L2A granules are paired with the L2B
+granules of the same orbit, and with the L4A granules if --l4a_variables is
+set, which must be in the same input. --product=unified needs all three.
+
+Every finished granule is appended to a manifest in the output directory, so
+an interrupted run can simply be restarted and will skip the finished work.
+The manifest records also hold the timings and counters of each granule, see
+gedi_lib.ExtractionStats.
+"""
+
+from concurrent import futures
+import json
+import os
+from typing import Any, Optional
+
+from absl import app
+from absl import flags
+from absl import logging
+import attr
+
+import gedi_catalog
+import gedi_extract_l2a
+import gedi_extract_l2b
+import gedi_extract_l4a
+import gedi_extract_unified
+import gedi_lib
+
+PRODUCT = flags.DEFINE_enum(
+    'product', 'l2a', ['l2a', 'l2b', 'l4a', 'unified'],
+    'GEDI product to extract; unified combines L2A, L2B and L4A.')
+
+NUM_GRANULE_WORKERS = flags.DEFINE_integer(
+    'num_granule_workers', os.cpu_count(),
+    'Number of granules extracted in parallel.')
+
+MANIFEST_NAME = flags.DEFINE_string(
+    'manifest_name', 'manifest.jsonl',
+    'Name of the manifest file, relative to the output directory.')
+
+# Product -> (extractor module, file name prefix of its input granules).
+_EXTRACTORS = {
+    'l2a': (gedi_extract_l2a, ('GEDI02_A', 'GEDI02_B')),
+    'l2b': (gedi_extract_l2b, ('GEDI02_B',)),
+    'l4a': (gedi_extract_l4a, ('GEDI04_A',)),
+    'unified': (gedi_extract_unified, ('GEDI02_A', 'GEDI02_B', 'GEDI04_A')),
+}
+
+_OUTPUT_EXTENSIONS = {
+    'csv': '.csv',
+    'csv.gz': '.csv.gz',
+    'csv.zst': '.csv.zst',
+    'parquet': '.parquet',
+    'arrow': '.arrow',
+}
+
+
+def group_granules(paths: list[str],
+                   prefixes: tuple[str, ...]) -> dict[str, list[str]]:
+  """Groups input files into the path lists expected by extract_values.
+
+  Args:
+    paths: GEDI file paths
+    prefixes: file name prefixes of the products, in extract_values order
+
+  Returns:
+    dict from granule key to a list of paths, one per prefix. Granules
+    missing one of the products are logged and left out.
+  """
+  by_key = {}
+  for path in paths:
+    basename = os.path.basename(path)
+    for i, prefix in enumerate(prefixes):
+      if basename.startswith(prefix + '_'):
+        key = gedi_lib.parse_granule_key_from_gedi_filename(basename)
+        by_key.setdefault(key, [None] * len(prefixes))[i] = path
+
+  granules = {}
+  for key, granule_paths in sorted(by_key.items()):
+    if None in granule_paths:
+      logging.warning('Skipping %s: missing %s', key, [
+          prefix for prefix, path in zip(prefixes, granule_paths)
+          if path is None])
+      continue
+    granules[key] = granule_paths
+  return granules
+
+
+def read_manifest(manifest_path: str) -> set[str]:
+  """Returns the granule keys recorded as finished in the manifest."""
+  if not os.path.exists(manifest_path):
+    return set()
+  done = set()
+  with open(manifest_path) as fh:
+    for line in fh:
+      try:
+        done.add(json.loads(line)['granule'])
+      except (ValueError, KeyError):
+        # A line cut short by an interrupted run; the granule is redone.
+        logging.warning('Ignoring manifest line: %r', line)
+  return done
+
+
+def _append_manifest(manifest_fh, record: dict[str, Any]) -> None:
+  manifest_fh.write(json.dumps(record) + '\n')
+  manifest_fh.flush()
+  os.fsync(manifest_fh.fileno())
+
+
+def extract_granule(product: str, input_paths: list[str], output_path: str,
+                    output_format: str, num_beam_workers: int,
+                    shot_filter: Optional[gedi_lib.ShotFilter],
+                    window_rows: int, prefetch_depth: int,
+                    extractor_options: dict[str, Any]
+                    ) -> tuple[str, dict[str, Any]]:
+  """Extracts a single granule (runs in a worker process).
+
+  The output is first written to a temporary name, so that a granule is
+  never left half-written under its final name. The temporary file is
+  removed if the extraction fails. A granule without any shots that pass
+  the filters is written as an empty table, so it is recorded as done.
+
+  Returns:
+    the output path, and the ExtractionStats of the granule as a dict
+
+  Raises:
+    ValueError: if an input is not a GEDI file name, or the extractor
+      wrote no output
+  """
+  for path in input_paths:
+    basename = os.path.basename(path)
+    if not basename.startswith('GEDI') or not basename.endswith('.h5'):
+      raise ValueError('Input path is not a GEDI filename: %s' % path)
+  extractor = _EXTRACTORS[product][0]
+  tmp_path = output_path + '.tmp'
+  try:
+    with gedi_lib.collect_stats() as stats:
+      extractor.extract_values(input_paths, tmp_path, output_format,
+                               num_beam_workers, shot_filter, window_rows,
+                               prefetch_depth, **extractor_options)
+    if not os.path.exists(tmp_path):
+      raise ValueError('No output written for %s' % input_paths)
+    os.replace(tmp_path, output_path)
+  finally:
+    if os.path.exists(tmp_path):
+      os.remove(tmp_path)
+  return output_path, attr.asdict(stats)
+
+
+def extract_batch(product: str,
+                  input_paths: list[str],
+                  output_dir: str,
+                  output_format: str = 'csv',
+                  num_granule_workers: int = 1,
+                  num_beam_workers: int = 1,
+                  manifest_name: str = 'manifest.jsonl',
+                  shot_filter: Optional[gedi_lib.ShotFilter] = None,
+                  window_rows: int = 0,
+                  prefetch_depth: int = 0,
+                  extractor_options: Optional[dict[str, Any]] = None,
+                  catalog: Optional[gedi_catalog.Catalog] = None
+                  ) -> list[str]:
+  """Extracts all granules that are not yet recorded in the manifest.
+
+  Args:
+    product: 'l2a', 'l2b', 'l4a' or 'unified'
+    input_paths: GEDI file paths
+    output_dir: directory for the output files and the manifest
+    output_format: 'csv', 'csv.gz', 'csv.zst', 'parquet' or 'arrow'
+    num_granule_workers: number of granules extracted in parallel
+    num_beam_workers: number of processes reading beams within a granule
+    manifest_name: manifest file name in output_dir
+    shot_filter: optional filter passed on to extract_values
+    window_rows: if set, stream beams in windows of about this many shots
+    prefetch_depth: number of beams read ahead while writing
+    extractor_options: additional extract_values arguments, e.g. the
+      joined variables of gedi_extract_l2a
+    catalog: optional granule catalog; with a bounding box in shot_filter,
+      granules cataloged outside of it are skipped without being opened
+
+  Returns:
+    list of granule keys that failed
+  """
+  extractor_options = extractor_options or {}
+  prefixes = _EXTRACTORS[product][1]
+  if extractor_options.get('l4a_variables'):
+    prefixes += ('GEDI04_A',)
+  granules = group_granules(input_paths, prefixes)
+  if catalog is not None and shot_filter is not None and shot_filter.bbox:
+    granules = {
+        k: v for k, v in granules.items()
+        if catalog.filter_intersecting(v[:1], shot_filter.bbox, margin=0)
+    }
+  manifest_path = os.path.join(output_dir, manifest_name)
+  done = read_manifest(manifest_path)
+  todo = {k: v for k, v in granules.items() if k not in done}
+  logging.info('%d granules, %d already done, %d to extract',
+               len(granules), len(granules) - len(todo), len(todo))
+
+  failed = []
+  os.makedirs(output_dir, exist_ok=True)
+  with open(manifest_path, 'a') as manifest_fh:
+    with futures.ProcessPoolExecutor(
+        max_workers=max(1, num_granule_workers)) as executor:
+      future_to_key = {}
+      for key, granule_paths in todo.items():
+        basename = os.path.basename(granule_paths[0])
+        output_path = os.path.join(
+            output_dir,
+            os.path.splitext(basename)[0] + _OUTPUT_EXTENSIONS[output_format])
+        future = executor.submit(extract_granule, product, granule_paths,
+                                 output_path, output_format, num_beam_workers,
+                                 shot_filter, window_rows, prefetch_depth,
+                                 extractor_options)
+        future_to_key[future] = key
+      for future in futures.as_completed(future_to_key):
+        key = future_to_key[future]
+        try:
+          output_path, stats = future.result()
+        except Exception:  # pylint:disable=broad-except
+          logging.exception('Extraction failed for %s', key)
+          failed.append(key)
+          continue
+        _append_manifest(manifest_fh, {
+            'granule': key,
+            'inputs': todo[key],
+            'output': output_path,
+            'stats': stats,
+        })
+  return sorted(failed)
+
+
+def _extractor_options_from_flags(product: str) -> dict[str, Any]:
+  if product == 'l2a':
+    return gedi_extract_l2a.join_options_from_flags()
+  if product == 'unified':
+    return {'join_mismatch': gedi_lib.JOIN_MISMATCH.value}
+  return {}
+
+
+def main(argv):
+  failed = extract_batch(
+      PRODUCT.value,
+      gedi_lib.list_input_files(argv[1]),
+      argv[2],
+      output_format=gedi_lib.OUTPUT_FORMAT.value,
+      num_granule_workers=NUM_GRANULE_WORKERS.value,
+      num_beam_workers=gedi_lib.NUM_BEAM_WORKERS.value,
+      manifest_name=MANIFEST_NAME.value,
+      shot_filter=gedi_lib.shot_filter_from_flags(),
+      window_rows=gedi_lib.STREAM_WINDOW_ROWS.value,
+      prefetch_depth=gedi_lib.PREFETCH_BEAMS.value,
+      extractor_options=_extractor_options_from_flags(PRODUCT.value),
+      catalog=gedi_catalog.catalog_from_flags())
+  if failed:
+    raise RuntimeError('%d granules failed: %s' % (len(failed), failed))
+
+
+if __name__ == '__main__':
+  app.run(main)
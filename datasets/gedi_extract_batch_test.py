@@ -0,0 +1,86 @@
+# Copyright 2020 The Google Earth Engine Community Authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Tests for gedi_extract_batch."""
+
+import json
+import os
+import shutil
+import tempfile
+
+from absl.testing import absltest
+
+import gedi_extract_batch
+import gedi_lib
+import gedi_synthetic
+
+
+class ExtractBatchTest(absltest.TestCase):
+
+  def setUp(self):
+    super().setUp()
+    self.tmp_dir = self.enter_context(tempfile.TemporaryDirectory())
+    self.input_paths = gedi_synthetic.write_orbit(
+        os.path.join(self.tmp_dir, 'orbit'), 100, 0, None)
+    self.output_dir = os.path.join(self.tmp_dir, 'output')
+
+  def _manifest(self):
+    with open(os.path.join(self.output_dir, 'manifest.jsonl')) as fh:
+      return [json.loads(line) for line in fh]
+
+  def test_granule_without_shots_is_done(self):
+    for output_format in ('csv', 'parquet', 'arrow'):
+      shutil.rmtree(self.output_dir, ignore_errors=True)
+      shot_filter = gedi_lib.ShotFilter(bbox=(0, 0, 1, 1))
+      failed = gedi_extract_batch.extract_batch(
+          'l2b', self.input_paths, self.output_dir, output_format,
+          shot_filter=shot_filter)
+
+      self.assertEmpty(failed)
+      (record,) = self._manifest()
+      self.assertEqual(record['stats']['rows_kept'], 0)
+      self.assertEqual(record['stats']['rows_read'], 0)
+      self.assertEmpty(gedi_lib.read_table(record['output'], None))
+      self.assertCountEqual(os.listdir(self.output_dir),
+                            ['manifest.jsonl',
+                             os.path.basename(record['output'])])
+
+      # A second run finds the granule in the manifest.
+      self.assertEmpty(gedi_extract_batch.extract_batch(
+          'l2b', self.input_paths, self.output_dir, output_format,
+          shot_filter=shot_filter))
+      self.assertLen(self._manifest(), 1)
+
+  def test_records_kept_rows(self):
+    failed = gedi_extract_batch.extract_batch(
+        'l2b', self.input_paths, self.output_dir, 'parquet')
+
+    self.assertEmpty(failed)
+    (record,) = self._manifest()
+    num_shots = 100 * len(gedi_synthetic.BEAM_KEYS)
+    self.assertEqual(record['stats']['rows_kept'], num_shots)
+    self.assertLen(gedi_lib.read_table(record['output'], None), num_shots)
+
+  def test_not_a_gedi_file_name_fails(self):
+    path = os.path.join(self.tmp_dir, 'GEDI02_B_granule.txt')
+    shutil.copy(self.input_paths[1], path)
+
+    with self.assertRaisesRegex(ValueError, 'not a GEDI filename'):
+      gedi_extract_batch.extract_granule(
+          'l2b', [path], os.path.join(self.tmp_dir, 'out.csv'), 'csv', 1,
+          None, 0, 0, {})
+    self.assertFalse(os.path.exists(os.path.join(self.tmp_dir, 'out.csv')))
+
+
+if __name__ == '__main__':
+  absltest.main()
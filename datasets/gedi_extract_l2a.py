@@ -12,122 +12,156 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import functools
+from typing import Any, Optional
+
 from absl import app
+from absl import flags
 from absl import logging
-import h5py
 import pandas as pd
 import os
 
 import gedi_lib
-
-numeric_variables = (
-    'beam',
-    'degrade_flag',
-    'delta_time',
-    'digital_elevation_model',
-    'digital_elevation_model_srtm',
-    'elev_highestreturn',
-    'elev_lowestmode',
-    'elevation_bias_flag',
-    'energy_total',
-
-    'land_cover_data/landsat_treecover',
-    'land_cover_data/landsat_water_persistence',
-    'land_cover_data/leaf_off_doy',
-    'land_cover_data/leaf_off_flag',
-    'land_cover_data/leaf_on_cycle',
-    'land_cover_data/leaf_on_doy',
-    'land_cover_data/modis_nonvegetated',
-    'land_cover_data/modis_nonvegetated_sd',
-    'land_cover_data/modis_treecover',
-    'land_cover_data/modis_treecover_sd',
-    'land_cover_data/pft_class',
-    'land_cover_data/region_class',
-    'land_cover_data/urban_focal_window_size',
-    'land_cover_data/urban_proportion',
-
-    'lat_highestreturn',
-    'lat_lowestmode',
-    'lon_highestreturn',
-    'lon_lowestmode',
-
-    'num_detectedmodes',
-    'quality_flag',
-
-    'selected_algorithm',
-    'selected_mode',
-    'selected_mode_flag',
-
-    'sensitivity',
-    'solar_azimuth',
-    'solar_elevation',
-    'surface_flag'
-)
-
-string_variables = ('shot_number',)
-
-rh_names = tuple([f'rh{d}' for d in range(101)])
-
-
-def extract_values(input_paths: list[str], output_path: str) -> None:
+import gedi_schema
+
+L2B_VARIABLES = flags.DEFINE_list(
+    'l2b_variables', None,
+    'Additional L2B variables (names or HDF paths in gedi_schema.L2B) joined '
+    'into the L2A output by shot_number.')
+
+L4A_VARIABLES = flags.DEFINE_list(
+    'l4a_variables', None,
+    'L4A variables (names or HDF paths in gedi_schema.L4A) joined into the L2A '
+    'output by shot_number. Requires the L4A file as a third input.')
+
+filter_variables = gedi_lib.FilterVariables(
+    lat='lat_lowestmode',
+    lon='lon_lowestmode',
+    quality_flag='quality_flag',
+    degrade_flag='degrade_flag',
+    sensitivity='sensitivity',
+    delta_time='delta_time')
+
+
+def extract_values(input_paths: list[str], output_path: str,
+                   output_format: str = 'csv',
+                   num_workers: int = 1,
+                   shot_filter: Optional[gedi_lib.ShotFilter] = None,
+                   window_rows: int = 0,
+                   prefetch_depth: int = 0,
+                   l2b_variables: tuple[str, ...] = (),
+                   l4a_variables: tuple[str, ...] = (),
+                   join_mismatch: str = 'keep') -> None:
   """Extracts all rh (relative heights) from all algorithms and some qa flags.
 
   Args:
-     input_paths: GEDI L2A and GEDI L2B file paths
-     output_path: csv output file path
+     input_paths: GEDI L2A and GEDI L2B file paths, followed by the GEDI L4A
+       file path if l4a_variables are set
+     output_path: output file path
+     output_format: 'csv', 'csv.gz', 'csv.zst', 'parquet' or 'arrow'
+     num_workers: number of processes reading beams in parallel
+     shot_filter: optional filter applied before reading most datasets
+     window_rows: if set, stream beams in windows of about this many shots
+     prefetch_depth: number of beams read ahead while writing
+     l2b_variables: L2B variables to add besides the incidence angles
+     l4a_variables: L4A variables to add
+     join_mismatch: 'keep', 'drop' or 'error', see
+       gedi_lib.join_by_shot_number
   """
   l2a_path = input_paths[0]
-  l2b_path = input_paths[1]
+  hdf_paths = list(input_paths[:2])
 
   basename = os.path.basename(l2a_path)
   if not basename.startswith('GEDI') or not basename.endswith('.h5'):
     logging.error('Input path is not a GEDI filename: %s', l2a_path)
     return
-
-  with h5py.File(l2a_path, 'r') as l2a_hdf_fh:
-    with h5py.File(l2b_path, 'r') as l2b_hdf_fh:
-      with open(output_path, 'w') as csv_fh:
-        write_csv(l2a_hdf_fh, l2b_hdf_fh, csv_fh)
+  if l4a_variables:
+    if len(input_paths) < 3:
+      logging.error('L4A variables requested without an L4A input: %s',
+                    l4a_variables)
+      return
+    hdf_paths.append(input_paths[2])
+
+  l2b_decoders = (
+      gedi_schema.L2B_FOR_L2A_DECODERS + gedi_schema.compile_variables(
+          gedi_schema.select_variables(
+              gedi_schema.L2B_FOR_L2A + gedi_schema.L2B, l2b_variables)))
+  l4a_decoders = gedi_schema.compile_variables(
+      gedi_schema.select_variables(gedi_schema.L4A, l4a_variables))
+  beam_fn = functools.partial(
+      beam_to_df, shot_filter=shot_filter, l2b_decoders=l2b_decoders,
+      l4a_decoders=l4a_decoders, join_mismatch=join_mismatch)
+  with gedi_lib.open_table_writer(output_path, output_format) as writer:
+    for df in gedi_lib.read_beams(hdf_paths, beam_fn, num_workers,
+                                  window_rows, prefetch_depth):
+      writer.write(df)
+
+
+def beam_to_df(
+    l2a_hdf_fh, l2b_hdf_fh, *l4a_hdf_fh_and_key,
+    shot_filter: Optional[gedi_lib.ShotFilter] = None,
+    window: Optional[slice] = None,
+    l2b_decoders: tuple[gedi_schema.Decoder, ...] = (
+        gedi_schema.L2B_FOR_L2A_DECODERS),
+    l4a_decoders: tuple[gedi_schema.Decoder, ...] = (),
+    join_mismatch: str = 'keep') -> pd.DataFrame:
+  """Reads the output rows for a single beam, or a window of it.
+
+  Called as beam_to_df(l2a_hdf_fh, l2b_hdf_fh, [l4a_hdf_fh,] k); the L4A
+  file handle is only passed when l4a_decoders are set.
+  """
+  *l4a_hdf_fh, k = l4a_hdf_fh_and_key
+  rows = gedi_lib.beam_rows(
+      l2a_hdf_fh, k, filter_variables, shot_filter, window)
+  df = pd.DataFrame(gedi_lib.read_variables(
+      l2a_hdf_fh, k, gedi_schema.L2A_DECODERS, rows))
+
+  gedi_lib.add_shot_number_breakdown(df)
+  # Add the incidence angle variables from the corresponding L2B file,
+  # and any other requested L2B and L4A variables.
+  df = gedi_lib.join_by_shot_number(
+      df, l2b_hdf_fh, k, l2b_decoders, rows, join_mismatch, prefix='l2b_')
+  if l4a_decoders:
+    df = gedi_lib.join_by_shot_number(
+        df, l4a_hdf_fh[0], k, l4a_decoders, rows, join_mismatch,
+        prefix='l4a_')
+
+  # Filter our rows with nan values for lat_lowestmode or lon_lowestmode.
+  # Such rows are not ingestable into EE.
+  df = gedi_lib.drop_missing_coordinates(df)
+  return df
+
+
+def join_options_from_flags() -> dict[str, Any]:
+  """Returns the extract_values arguments for joined L2B and L4A variables."""
+  return {
+      'l2b_variables': tuple(L2B_VARIABLES.value or ()),
+      'l4a_variables': tuple(L4A_VARIABLES.value or ()),
+      'join_mismatch': gedi_lib.JOIN_MISMATCH.value,
+  }
+
+
+def write_table(l2a_hdf_fh, l2b_hdf_fh, writer: gedi_lib.TableWriter):
+  """Writes a single table based on the contents of HDF file."""
+  # Iterating over relative height percentage values from 0 to 100
+  for k in gedi_lib.beam_keys(l2a_hdf_fh):
+    logging.info('Reading %s', k)
+    writer.write(beam_to_df(l2a_hdf_fh, l2b_hdf_fh, k))
 
 
 def write_csv(l2a_hdf_fh, l2b_hdf_fh, csv_file):
   """Writes a single CSV file based on the contents of HDF file."""
-  is_first = True
-  # Iterating over relative height percentage values from 0 to 100
-  for k in l2a_hdf_fh.keys():
-    if not k.startswith('BEAM'):
-      continue
-    print('\t', k)
-
-    df = pd.DataFrame()
-
-    for v in numeric_variables + string_variables:
-      gedi_lib.hdf_to_df(l2a_hdf_fh, k, v, df)
-
-    rh = pd.DataFrame(l2a_hdf_fh[f'{k}/rh'], columns=rh_names)
-    df = pd.concat((df, rh), axis=1)
-
-    gedi_lib.add_shot_number_breakdown(df)
-    # Add the incidence angle variables from the corresponding L2B file.
-    for l2b_var in gedi_lib.l2b_variables_for_l2a:
-      gedi_lib.hdf_to_df(l2b_hdf_fh, k, 'geolocation/' + l2b_var, df)
-
-    # Filter our rows with nan values for lat_lowestmode or lon_lowestmode.
-    # Such rows are not ingestable into EE.
-    df = df[df.lat_lowestmode.notnull()]
-    df = df[df.lon_lowestmode.notnull()]
-
-    df.to_csv(
-        csv_file,
-        float_format='%3.6f',
-        index=False,
-        header=is_first,
-        mode='a',
-        line_terminator='\n')
-    is_first = False
+  write_table(l2a_hdf_fh, l2b_hdf_fh, gedi_lib.CsvTableWriter(csv_file))
+
 
 def main(argv):
-  extract_values(argv[1], argv[2])
+  with gedi_lib.instrument_from_flags(argv[2]):
+    extract_values(argv[1], argv[2], gedi_lib.OUTPUT_FORMAT.value,
+                   gedi_lib.NUM_BEAM_WORKERS.value,
+                   gedi_lib.shot_filter_from_flags(),
+                   gedi_lib.STREAM_WINDOW_ROWS.value,
+                   gedi_lib.PREFETCH_BEAMS.value,
+                   **join_options_from_flags())
 
 if __name__ == '__main__':
   app.run(main)
@@ -12,51 +12,44 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import functools
+from typing import Optional
+
 from absl import app
 from absl import logging
-import h5py
-import numpy as np
 import pandas as pd
 import os
 
 import gedi_lib
+import gedi_schema
+
+filter_variables = gedi_lib.FilterVariables(
+    lat='geolocation/lat_lowestmode',
+    lon='geolocation/lon_lowestmode',
+    quality_flag='l2b_quality_flag',
+    degrade_flag='geolocation/degrade_flag',
+    sensitivity='sensitivity',
+    delta_time='geolocation/delta_time')
 
-numeric_variables = (
-    'cover',
-    'pai',
-    'fhd_normal',
-    'pgap_theta',
-    'beam',
-    'shot_number',
-    'l2b_quality_flag',
-    'algorithmrun_flag',
-    'selected_rg_algorithm',
-    'selected_l2a_algorithm',
-    'sensitivity',
-    'geolocation/degrade_flag',
-    'geolocation/delta_time',
-    'geolocation/lat_lowestmode',
-    'geolocation/lon_lowestmode',
-    'geolocation/local_beam_azimuth',
-    'geolocation/local_beam_elevation',
-    'geolocation/solar_azimuth',
-    'geolocation/solar_elevation',
-)
-
-string_variables = ('shot_number',)
-
-cover_names = [f'cover_z{d}' for d in range(30)]
-pai_names = [f'pai_z{d}' for d in range(30)]
-pavd_names = [f'pavd_z{d}' for d in range(30)]
 
 
 # pylint:disable=line-too-long
-def extract_values(input_paths: list[str], output_path: str) -> None:
+def extract_values(input_paths: list[str], output_path: str,
+                   output_format: str = 'csv',
+                   num_workers: int = 1,
+                   shot_filter: Optional[gedi_lib.ShotFilter] = None,
+                   window_rows: int = 0,
+                   prefetch_depth: int = 0) -> None:
   """Extracts all relative height values from all algorithms and some qa flags.
 
   Args:
      input_paths: GEDI L2B file path in a single-element list
-     output_path: csv output file path
+     output_path: output file path
+     output_format: 'csv', 'csv.gz', 'csv.zst', 'parquet' or 'arrow'
+     num_workers: number of processes reading beams in parallel
+     shot_filter: optional filter applied before reading most datasets
+     window_rows: if set, stream beams in windows of about this many shots
+     prefetch_depth: number of beams read ahead while writing
   """
   assert len(input_paths) == 1
   input_path = input_paths[0]
@@ -65,60 +58,51 @@ def extract_values(input_paths: list[str], output_path: str) -> None:
     logging.error('Input path is not a GEDI filename: %s', input_path)
     return
 
-  with h5py.File(input_path, 'r') as hdf_fh:
-    with open(output_path, 'w') as csv_fh:
-      write_csv(hdf_fh, csv_fh)
-
+  with gedi_lib.open_table_writer(output_path, output_format) as writer:
+    for df in gedi_lib.read_beams(
+        [input_path],
+        functools.partial(beam_to_df, shot_filter=shot_filter), num_workers,
+        window_rows, prefetch_depth):
+      writer.write(df)
 
-def write_csv(hdf_fh, csv_file):
-  """Writes a single CSV file based on the contents of HDF file."""
-  is_first = True
-  # Iterating over metrics using a height profile defined for 30 slices.
-  for k in hdf_fh.keys():
-    if not k.startswith('BEAM'):
-      continue
-    print('\t', k)
 
-    df = pd.DataFrame()
+def beam_to_df(hdf_fh, k: str,
+               shot_filter: Optional[gedi_lib.ShotFilter] = None,
+               window: Optional[slice] = None) -> pd.DataFrame:
+  """Reads the output rows for a single beam, or a window of it."""
+  rows = gedi_lib.beam_rows(
+      hdf_fh, k, filter_variables, shot_filter, window)
+  df = pd.DataFrame(gedi_lib.read_variables(
+      hdf_fh, k, gedi_schema.L2B_DECODERS, rows))
 
-    for v in numeric_variables + string_variables:
-      gedi_lib.hdf_to_df(hdf_fh, k, v, df)
+  # Filter our rows with nan values for lat_lowestmode or lon_lowestmode.
+  # Such rows are not ingestable into EE.
+  df = gedi_lib.drop_missing_coordinates(df)
 
-    ds = hdf_fh[f'{k}/cover_z']
-    cover_z = pd.DataFrame(ds, columns=cover_names)
-    cover_z.replace(ds.attrs.get('_FillValue'), np.nan, True)
+  gedi_lib.add_shot_number_breakdown(df)
+  return df
 
-    ds = hdf_fh[f'{k}/pai_z']
-    pai_z = pd.DataFrame(ds, columns=pai_names)
-    pai_z.replace(ds.attrs.get('_FillValue'), np.nan, True)
 
-    ds = hdf_fh[f'{k}/pavd_z']
-    pavd_z = pd.DataFrame(ds, columns=pavd_names)
-    pavd_z.replace(ds.attrs.get('_FillValue'), np.nan, True)
-
-    df = pd.concat((df, cover_z), axis=1)
-    df = pd.concat((df, pai_z), axis=1)
-    df = pd.concat((df, pavd_z), axis=1)
-
-    # Filter our rows with nan values for lat_lowestmode or lon_lowestmode.
-    # Such rows are not ingestable into EE.
-    df = df[df.lat_lowestmode.notnull()]
-    df = df[df.lon_lowestmode.notnull()]
+def write_table(hdf_fh, writer: gedi_lib.TableWriter):
+  """Writes a single table based on the contents of HDF file."""
+  # Iterating over metrics using a height profile defined for 30 slices.
+  for k in gedi_lib.beam_keys(hdf_fh):
+    logging.info('Reading %s', k)
+    writer.write(beam_to_df(hdf_fh, k))
 
-    gedi_lib.add_shot_number_breakdown(df)
 
-    df.to_csv(
-        csv_file,
-        float_format='%3.6f',
-        index=False,
-        header=is_first,
-        mode='a',
-        line_terminator='\n')
-    is_first = False
+def write_csv(hdf_fh, csv_file):
+  """Writes a single CSV file based on the contents of HDF file."""
+  write_table(hdf_fh, gedi_lib.CsvTableWriter(csv_file))
 
 
 def main(argv):
-  extract_values(argv[1], argv[2])
+  with gedi_lib.instrument_from_flags(argv[2]):
+    extract_values(argv[1], argv[2], gedi_lib.OUTPUT_FORMAT.value,
+                   gedi_lib.NUM_BEAM_WORKERS.value,
+                   gedi_lib.shot_filter_from_flags(),
+                   gedi_lib.STREAM_WINDOW_ROWS.value,
+                   gedi_lib.PREFETCH_BEAMS.value)
 
 
 if __name__ == '__main__':
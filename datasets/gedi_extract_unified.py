@@ -0,0 +1,81 @@
+# Copyright 2020 The Google Earth Engine Community Authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Extracts GEDI L2A, L2B and L4A variables of an orbit into one table.
+
+Usage: gedi_extract_unified.py <L2A path> <L2B path> <L4A path> <output path>
+
+The three products are read in a single pass over the L2A shots. Geolocation,
+quality and land cover variables that the products repeat are read once,
+from L2A, and the L2B and L4A variables are joined to the L2A shots by
+shot_number. Compared to running gedi_extract_l2a, gedi_extract_l2b and
+gedi_extract_l4a separately and joining their tables, this reads the repeated
+datasets and writes the repeated columns only once.
+"""
+
+from typing import Optional
+
+from absl import app
+
+import gedi_extract_l2a
+import gedi_lib
+import gedi_schema
+
+# L2B and L4A variables that are not already part of the L2A table.
+L2B_VARIABLES = gedi_schema.new_variables(
+    gedi_schema.L2B, gedi_schema.L2A + gedi_schema.L2B_FOR_L2A)
+L4A_VARIABLES = gedi_schema.new_variables(
+    gedi_schema.L4A, gedi_schema.L2A + gedi_schema.L2B_FOR_L2A + L2B_VARIABLES)
+
+
+def extract_values(input_paths: list[str], output_path: str,
+                   output_format: str = 'csv',
+                   num_workers: int = 1,
+                   shot_filter: Optional[gedi_lib.ShotFilter] = None,
+                   window_rows: int = 0,
+                   prefetch_depth: int = 0,
+                   join_mismatch: str = 'keep') -> None:
+  """Extracts all L2A, L2B and L4A variables into a single table.
+
+  Args:
+     input_paths: GEDI L2A, GEDI L2B and GEDI L4A file paths of one orbit
+     output_path: output file path
+     output_format: 'csv', 'csv.gz', 'csv.zst', 'parquet' or 'arrow'
+     num_workers: number of processes reading beams in parallel
+     shot_filter: optional filter applied before reading most datasets,
+       evaluated on the L2A variables
+     window_rows: if set, stream beams in windows of about this many shots
+     prefetch_depth: number of beams read ahead while writing
+     join_mismatch: 'keep', 'drop' or 'error' for L2A shots missing from the
+       L2B or L4A file, see gedi_lib.join_by_shot_number
+  """
+  gedi_extract_l2a.extract_values(
+      input_paths, output_path, output_format, num_workers, shot_filter,
+      window_rows, prefetch_depth,
+      l2b_variables=tuple(v.hdf_path for v in L2B_VARIABLES),
+      l4a_variables=tuple(v.hdf_path for v in L4A_VARIABLES),
+      join_mismatch=join_mismatch)
+
+
+def main(argv):
+  with gedi_lib.instrument_from_flags(argv[4]):
+    extract_values(argv[1:4], argv[4], gedi_lib.OUTPUT_FORMAT.value,
+                   gedi_lib.NUM_BEAM_WORKERS.value,
+                   gedi_lib.shot_filter_from_flags(),
+                   gedi_lib.STREAM_WINDOW_ROWS.value,
+                   gedi_lib.PREFETCH_BEAMS.value,
+                   gedi_lib.JOIN_MISMATCH.value)
+
+
+if __name__ == '__main__':
+  app.run(main)
@@ -0,0 +1,156 @@
+# Copyright 2020 The Google Earth Engine Community Authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""UTM grid cells of the monthly GEDI rasters, fetched once and cached.
+
+The rasterize scripts need the geometry and CRS of each of the grid cells.
+Looking them up cell by cell costs a blocking EE request per cell, so
+load_grid_cells fetches all of them with one request and keeps them in a
+local JSON file. The cache is reused as long as the update time of the grid
+cell collection asset is unchanged.
+"""
+
+import json
+import math
+import os
+from typing import Any, Optional
+
+from absl import flags
+from absl import logging
+import attr
+import ee
+
+import gedi_lib
+
+GRID_CELL_CACHE = flags.DEFINE_string(
+    'grid_cell_cache', None,
+    'JSON file caching the UTM grid cells between runs. It is refreshed '
+    'when the grid cell collection changes.')
+
+# Bumped when the cache file layout changes.
+_CACHE_FORMAT = 1
+
+METERS_PER_DEGREE = 111320
+
+
+@attr.s(frozen=True)
+class GridCell:
+  """A UTM grid cell."""
+  grid_id: int = attr.ib()
+  crs: str = attr.ib()
+  # GeoJSON geometry, as returned by getInfo.
+  geometry: dict[str, Any] = attr.ib(hash=False)
+
+  @property
+  def bounds(self) -> tuple[float, float, float, float]:
+    """(min_lon, min_lat, max_lon, max_lat) of the geometry."""
+    points = list(_points(self.geometry['coordinates']))
+    lons = [p[0] for p in points]
+    lats = [p[1] for p in points]
+    return min(lons), min(lats), max(lons), max(lats)
+
+  def buffered_bounds(self,
+                      meters: float) -> tuple[float, float, float, float]:
+    """Returns bounds with a margin of at least the given meters."""
+    min_lon, min_lat, max_lon, max_lat = self.bounds
+    dlat = meters / METERS_PER_DEGREE
+    max_abs_lat = min(max(abs(min_lat), abs(max_lat)) + dlat, 89)
+    dlon = dlat / math.cos(math.radians(max_abs_lat))
+    return min_lon - dlon, min_lat - dlat, max_lon + dlon, max_lat + dlat
+
+  def feature(self) -> ee.Feature:
+    """Returns the cell as an ee.Feature, without a request."""
+    return ee.Feature(
+        ee.Geometry(self.geometry), {'grid_id': self.grid_id, 'crs': self.crs})
+
+
+def _points(coordinates):
+  """Yields the [lon, lat] points of nested GeoJSON coordinates."""
+  if coordinates and isinstance(coordinates[0], (int, float)):
+    yield coordinates
+  else:
+    for c in coordinates:
+      yield from _points(c)
+
+
+def collection_version(collection_id: str) -> str:
+  """Returns the update time of an asset, used to invalidate the cache."""
+  return ee.data.getAsset(collection_id)['updateTime']
+
+
+def fetch_grid_cells(collection_id: str) -> dict[int, GridCell]:
+  """Fetches all grid cells of a collection with a single EE request."""
+  collection = ee.FeatureCollection(collection_id).select(['grid_id', 'crs'])
+  cells = {}
+  for feature in collection.getInfo()['features']:
+    grid_id = int(feature['properties']['grid_id'])
+    cells[grid_id] = GridCell(
+        grid_id=grid_id,
+        crs=feature['properties']['crs'],
+        geometry=feature['geometry'])
+  return cells
+
+
+def _read_cache(cache_path: str, collection_id: str,
+                version: str) -> Optional[dict[int, GridCell]]:
+  if not os.path.exists(cache_path):
+    return None
+  with open(cache_path) as fh:
+    cache = json.load(fh)
+  if (cache.get('format') != _CACHE_FORMAT or
+      cache.get('collection') != collection_id or
+      cache.get('version') != version):
+    return None
+  return {c['grid_id']: GridCell(**c) for c in cache['cells']}
+
+
+def _write_cache(cache_path: str, collection_id: str, version: str,
+                 cells: dict[int, GridCell]) -> None:
+  tmp_path = cache_path + '.tmp'
+  with open(tmp_path, 'w') as fh:
+    json.dump({
+        'format': _CACHE_FORMAT,
+        'collection': collection_id,
+        'version': version,
+        'cells': [attr.asdict(c) for c in cells.values()],
+    }, fh)
+  os.replace(tmp_path, cache_path)
+
+
+def load_grid_cells(collection_id: str = gedi_lib.UTM_GRID_CELLS,
+                    cache_path: Optional[str] = None) -> dict[int, GridCell]:
+  """Returns the grid cells of a collection by grid_id.
+
+  Args:
+    collection_id: grid cell collection with grid_id and crs properties
+    cache_path: optional JSON cache file. It is used if it was written for
+      the current version of the collection, and (re)written otherwise.
+
+  Returns:
+    grid_id -> GridCell
+  """
+  if not cache_path:
+    return fetch_grid_cells(collection_id)
+  version = collection_version(collection_id)
+  cells = _read_cache(cache_path, collection_id, version)
+  if cells is not None:
+    return cells
+  logging.info('Fetching grid cells of %s (version %s)', collection_id,
+               version)
+  cells = fetch_grid_cells(collection_id)
+  _write_cache(cache_path, collection_id, version, cells)
+  return cells
+
+
+def grid_cells_from_flags() -> dict[int, GridCell]:
+  return load_grid_cells(gedi_lib.UTM_GRID_CELLS, GRID_CELL_CACHE.value)
@@ -12,11 +12,25 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import collections
+from concurrent import futures
+import contextlib
+import cProfile
 import datetime
+import functools
+import glob
+import gzip
+import hashlib
+import io
+import json
 import os
+import queue
+import threading
 import time
-from typing import Any
+import tracemalloc
+from typing import Any, Callable, Iterator, Optional, Union
 from absl import flags
+from absl import logging
 import attr
 from dateutil import relativedelta
 import h5py
@@ -25,10 +39,15 @@ import pandas as pd
 import pytz
 
 import ee
+import gedi_schema
 
-l2b_variables_for_l2a = ('local_beam_azimuth', 'local_beam_elevation')
+l2b_variables_for_l2a = tuple(
+    v.output_name for v in gedi_schema.L2B_FOR_L2A)
 
 
+# Grid cells of the monthly rasters, with a grid_id property.
+UTM_GRID_CELLS = 'users/yang/GEETables/GEDI/GEDI_UTM_GRIDS_LandOnly'
+
 NUM_UTM_GRID_CELLS = flags.DEFINE_integer(
     'num_utm_grid_cells', 389, 'UTM grid cell count')
 
@@ -37,6 +56,171 @@ ALLOW_GEDI_RASTERIZE_OVERWRITE = flags.DEFINE_bool(
     'Whether exported assets from gedi_rasterize are allowed to overwrite '
     'existing assets.')
 
+OUTPUT_FORMAT = flags.DEFINE_enum(
+    'output_format', 'csv', ['csv', 'csv.gz', 'csv.zst', 'parquet', 'arrow'],
+    'File format written by gedi_extract: csv, csv compressed on the fly with '
+    'gzip or zstd, or parquet/arrow for typed, compressed columnar output with '
+    'one row group per beam.')
+
+NUM_BEAM_WORKERS = flags.DEFINE_integer(
+    'num_beam_workers', 1,
+    'Number of processes gedi_extract uses to read the beams of a granule in '
+    'parallel. With 1, beams are read one after another in the main process.')
+
+STREAM_WINDOW_ROWS = flags.DEFINE_integer(
+    'stream_window_rows', 0,
+    'If set, gedi_extract reads, decodes and writes every beam in windows of '
+    'about this many shots (rounded up to the HDF5 chunk size) to bound peak '
+    'memory. 0 reads whole beams.')
+
+PREFETCH_BEAMS = flags.DEFINE_integer(
+    'prefetch_beams', 2,
+    'Number of beams (or beam windows) gedi_extract reads and decodes ahead '
+    'in a background thread while the current one is written. 0 reads and '
+    'writes in turn.')
+
+FILTER_BBOX = flags.DEFINE_list(
+    'filter_bbox', None,
+    'Only extract shots inside min_lon,min_lat,max_lon,max_lat.')
+
+FILTER_QUALITY_FLAG = flags.DEFINE_integer(
+    'filter_quality_flag', None,
+    'Only extract shots with this value of the product quality flag.')
+
+FILTER_DEGRADE_FLAG = flags.DEFINE_integer(
+    'filter_degrade_flag', None,
+    'Only extract shots with this value of degrade_flag.')
+
+FILTER_MIN_SENSITIVITY = flags.DEFINE_float(
+    'filter_min_sensitivity', None,
+    'Only extract shots with at least this beam sensitivity.')
+
+FILTER_DELTA_TIME = flags.DEFINE_list(
+    'filter_delta_time', None,
+    'Only extract shots with start <= delta_time < end, given as start,end.')
+
+JOIN_MISMATCH = flags.DEFINE_enum(
+    'join_mismatch', 'keep', ['keep', 'drop', 'error'],
+    'What gedi_extract does with shots that have no match in a joined '
+    'product: keep them with null values, drop them, or fail.')
+
+STATS_OUTPUT = flags.DEFINE_string(
+    'stats_output', None,
+    'If set, gedi_extract appends the timings and counters of every '
+    'extraction to this file as a JSON line.')
+
+PROFILE_OUTPUT = flags.DEFINE_string(
+    'profile_output', None,
+    'If set, gedi_extract runs under cProfile and writes the profile to this '
+    'path (readable with pstats). Beams read in worker processes are not '
+    'profiled.')
+
+TRACE_MEMORY = flags.DEFINE_bool(
+    'trace_memory', False,
+    'Whether gedi_extract traces Python allocations with tracemalloc and '
+    'records the peak and the top allocation sites in the stats.')
+
+# Upper bound of the raw data chunk cache of a single dataset, see
+# open_dataset. HDF5 caches 1 MiB per dataset by default.
+MAX_CHUNK_CACHE_BYTES = 64 * 2**20
+
+# Compression of the csv.gz and csv.zst output formats. Gzip output is
+# compressed in blocks of CSV_COMPRESSION_BLOCK_BYTES by one thread per CPU.
+CSV_GZIP_LEVEL = 4
+CSV_ZSTD_LEVEL = 3
+CSV_COMPRESSION_BLOCK_BYTES = 4 * 2**20
+
+# Codec used for the parquet and arrow output formats.
+COLUMNAR_COMPRESSION = 'zstd'
+# Extensions of the tables written by open_table_writer.
+TABLE_EXTENSIONS = ('.csv', '.csv.gz', '.csv.zst', '.parquet', '.arrow')
+
+
+@attr.s
+class ShotFilter:
+  """Shot selection applied before reading the bulk of a beam.
+
+  Unset fields do not filter anything. Shots without a valid latitude and
+  longitude are always dropped, as they are not ingestable into EE.
+  """
+  # (min_lon, min_lat, max_lon, max_lat)
+  bbox: Optional[tuple[float, float, float, float]] = attr.ib(default=None)
+  quality_flag: Optional[int] = attr.ib(default=None)
+  degrade_flag: Optional[int] = attr.ib(default=None)
+  min_sensitivity: Optional[float] = attr.ib(default=None)
+  # [start, end) in GEDI delta_time seconds
+  delta_time_range: Optional[tuple[float, float]] = attr.ib(default=None)
+
+
+@attr.s(frozen=True)
+class FilterVariables:
+  """Per-product HDF variable names (relative to a beam) used by ShotFilter."""
+  lat: str = attr.ib()
+  lon: str = attr.ib()
+  quality_flag: str = attr.ib()
+  degrade_flag: str = attr.ib()
+  sensitivity: str = attr.ib()
+  delta_time: str = attr.ib()
+
+
+@attr.s
+class PipelineStats:
+  """Counters of a prefetch pipeline, see prefetch.
+
+  Many reader stalls mean that the consumer (encoding and writing the output)
+  limits throughput; many consumer stalls mean that reading and decoding does.
+  """
+  items: int = attr.ib(default=0)
+  max_queue_depth: int = attr.ib(default=0)
+  # Times the reader found the queue full, and how long it waited for space.
+  reader_stalls: int = attr.ib(default=0)
+  reader_stall_seconds: float = attr.ib(default=0.0)
+  # Times the consumer found the queue empty, and how long it waited.
+  consumer_stalls: int = attr.ib(default=0)
+  consumer_stall_seconds: float = attr.ib(default=0.0)
+
+
+@attr.s
+class ExtractionStats:
+  """Timings and counters of an extraction, see collect_stats.
+
+  Stages are 'read' (HDF5 reads of the output variables), 'decode' (fill
+  value masking and type conversion), 'filter' (shot selection and the
+  coordinate filter), 'join' (matching shots of other products) and 'write'
+  (serializing and writing the output).
+  """
+  seconds: dict[str, float] = attr.ib(factory=dict)
+  # HDF path within a beam -> bytes read, summed over the beams.
+  bytes_read: dict[str, int] = attr.ib(factory=dict)
+  beams: int = attr.ib(default=0)
+  # Rows before and after dropping shots without coordinates.
+  rows_read: int = attr.ib(default=0)
+  rows_kept: int = attr.ib(default=0)
+  peak_memory_bytes: Optional[int] = attr.ib(default=None)
+  top_allocations: Optional[list[str]] = attr.ib(default=None)
+
+  def add_seconds(self, stage: str, seconds: float) -> None:
+    self.seconds[stage] = self.seconds.get(stage, 0.0) + seconds
+
+  def add_bytes(self, hdf_path: str, num_bytes: int) -> None:
+    self.bytes_read[hdf_path] = self.bytes_read.get(hdf_path, 0) + num_bytes
+
+  def merge(self, other: 'ExtractionStats') -> None:
+    """Adds the timings and counters of another extraction."""
+    for stage, seconds in other.seconds.items():
+      self.add_seconds(stage, seconds)
+    for hdf_path, num_bytes in other.bytes_read.items():
+      self.add_bytes(hdf_path, num_bytes)
+    self.beams += other.beams
+    self.rows_read += other.rows_read
+    self.rows_kept += other.rows_kept
+
+
+# Pixel size of the monthly rasters, and the buffer around grid cells, in
+# meters.
+EXPORT_SCALE = 25
+GRID_CELL_BUFFER = 2500
+
 
 @attr.s
 class ExportParameters:
@@ -47,33 +231,79 @@ class ExportParameters:
   crs: str = attr.ib()
   region: Any = attr.ib()  # ee.Geometry.Polygon | ee.Geometry.LinearRing
   overwrite: bool = attr.ib()
+  # Seconds spent building the expression graph, and the size of the
+  # serialized image and region, as measured by create_export.
+  build_seconds: Optional[float] = attr.ib(default=None)
+  payload_bytes: Optional[int] = attr.ib(default=None)
 
 
-def _start_task(export_params: ExportParameters) -> str:
-  """Starts an EE export task with the given parameters."""
+def export_task(export_params: ExportParameters) -> ee.batch.Task:
+  """Creates an EE export task with the given parameters."""
   asset_id = export_params.asset_id
-  task = ee.batch.Export.image.toAsset(
+  return ee.batch.Export.image.toAsset(
       image=export_params.image,
       description=os.path.basename(asset_id),
       assetId=asset_id,
       region=export_params.region,
       pyramidingPolicy=export_params.pyramiding_policy,
-      scale=25,
+      scale=EXPORT_SCALE,
       crs=export_params.crs,
       maxPixels=1e13,
       overwrite=export_params.overwrite)
 
+
+def export_fingerprint(export_params: ExportParameters) -> str:
+  """Returns a hash of everything that determines an exported raster.
+
+  The image and region are hashed in their serialized form, which is built
+  locally and includes the table asset ids, bands and time filter.
+  """
+  sha = hashlib.sha256()
+  for part in (export_params.asset_id, export_params.crs,
+               json.dumps(export_params.pyramiding_policy, sort_keys=True),
+               export_params.image.serialize(),
+               export_params.region.serialize()):
+    sha.update(part.encode())
+    sha.update(b'\0')
+  return sha.hexdigest()
+
+
+def _start_task(export_params: ExportParameters) -> str:
+  """Starts an EE export task with the given parameters."""
+  task = export_task(export_params)
   time.sleep(0.1)
   task.start()
   return task.status()['id']
 
 
+def raster_asset_id(raster_collection: str, grid_cell_id: int,
+                    grill_month: Optional[datetime.datetime] = None) -> str:
+  """Returns the asset id of the raster of a grid cell.
+
+  Args:
+    raster_collection: image collection of the monthly rasters
+    grid_cell_id: grid_id of the cell
+    grill_month: if given, the month is added to the id, for collections
+      holding several months
+
+  Returns:
+    string, the asset id
+  """
+  name = '%03d' % grid_cell_id
+  if grill_month is not None:
+    name += grill_month.strftime('_%Y_%m')
+  return raster_collection + '/' + name
+
+
 def rasterize_gedi_by_utm_zone(table_asset_ids,
                                raster_asset_id,
                                grid_cell_feature,
                                grill_month,
                                export_function,
-                               overwrite=False):
+                               overwrite=False,
+                               crs=None,
+                               scheduler=None,
+                               export_state=None):
   """Creates and runs an EE export job.
 
   Args:
@@ -83,13 +313,150 @@ def rasterize_gedi_by_utm_zone(table_asset_ids,
     grill_month: datetime, the 1st of the month for the data to be rasterized
     export_function: function to create export
     overwrite: bool, if any of the assets can be replaced if they already exist
+    crs: string, CRS of the grid cell if known, saves a request per export
+    scheduler: optional gedi_tasks.TaskScheduler to queue the export on
+      instead of starting it right away. The export is told apart from
+      earlier ones to the same asset id by its fingerprint.
+    export_state: optional gedi_export_state.ExportState; the export is
+      skipped if the last one of this asset and month is still current
 
   Returns:
-    string, task id of the created task
+    string, task id of the created task, or None if the export was queued
+    or skipped
   """
   export_params = export_function(table_asset_ids, raster_asset_id,
-                                  grid_cell_feature, grill_month, overwrite)
-  return _start_task(export_params)
+                                  grid_cell_feature, grill_month, overwrite,
+                                  crs=crs)
+  fingerprint = None
+  if scheduler is not None or export_state is not None:
+    fingerprint = export_fingerprint(export_params)
+  if export_state is not None:
+    if export_state.is_current(export_params, grill_month, fingerprint,
+                               table_asset_ids):
+      logging.info('%s is up to date', raster_asset_id)
+      return None
+  if scheduler is not None:
+    scheduler.submit(export_params, fingerprint)
+    task_id, state = None, 'QUEUED'
+  else:
+    task_id, state = _start_task(export_params), 'READY'
+  if export_state is not None:
+    export_state.record(export_params, grill_month, fingerprint,
+                        table_asset_ids, task_id, state)
+  return task_id
+
+
+# Stats of the running extraction, if collected. The prefetch reader thread
+# and the main thread both add to them, under _stats_lock.
+_stats: Optional[ExtractionStats] = None
+_stats_lock = threading.Lock()
+
+
+@contextlib.contextmanager
+def collect_stats(
+    callback: Optional[Callable[[ExtractionStats], None]] = None
+) -> Iterator[ExtractionStats]:
+  """Collects the ExtractionStats of everything run in the context.
+
+  Stats of beams read in worker processes are sent back with the beams.
+
+  Args:
+    callback: optional function called with the stats when the context exits
+
+  Yields:
+    the ExtractionStats, complete once the context exits
+  """
+  global _stats
+  previous = _stats
+  stats = _stats = ExtractionStats()
+  try:
+    yield stats
+  finally:
+    _stats = previous
+    if previous is not None:
+      with _stats_lock:
+        previous.merge(stats)
+  if callback is not None:
+    callback(stats)
+
+
+@contextlib.contextmanager
+def _timed(stage: str):
+  """Adds the time spent in the context to a stage of the collected stats."""
+  if _stats is None:
+    yield
+    return
+  start = time.perf_counter()
+  try:
+    yield
+  finally:
+    seconds = time.perf_counter() - start
+    with _stats_lock:
+      _stats.add_seconds(stage, seconds)
+
+
+def _count_bytes(hdf_path: str, values: np.ndarray) -> None:
+  if _stats is not None:
+    with _stats_lock:
+      _stats.add_bytes(hdf_path, values.nbytes)
+
+
+@contextlib.contextmanager
+def instrument(label: str,
+               stats_output: Optional[str] = None,
+               profile_output: Optional[str] = None,
+               trace_memory: bool = False,
+               callback: Optional[Callable[[ExtractionStats], None]] = None
+               ) -> Iterator[ExtractionStats]:
+  """Collects stats and optional profiles of an extraction.
+
+  Args:
+    label: recorded with the stats, e.g. the output path
+    stats_output: if set, the stats are appended to this file as a JSON line
+    profile_output: if set, the context runs under cProfile and the profile
+      is written to this path
+    trace_memory: whether to trace allocations with tracemalloc
+    callback: optional function called with the stats at the end
+
+  Yields:
+    the ExtractionStats, complete once the context exits
+  """
+  profile = cProfile.Profile() if profile_output else None
+  if trace_memory:
+    tracemalloc.start()
+  start = time.perf_counter()
+  try:
+    with collect_stats() as stats:
+      if profile is not None:
+        profile.enable()
+      try:
+        yield stats
+      finally:
+        if profile is not None:
+          profile.disable()
+  finally:
+    if trace_memory:
+      stats.peak_memory_bytes = tracemalloc.get_traced_memory()[1]
+      stats.top_allocations = [
+          str(s) for s in tracemalloc.take_snapshot().statistics('lineno')[:10]
+      ]
+      tracemalloc.stop()
+    if profile is not None:
+      profile.dump_stats(profile_output)
+  record = {'label': label, 'total_seconds': time.perf_counter() - start}
+  record.update(attr.asdict(stats))
+  logging.info('Extraction stats: %s', record)
+  if stats_output:
+    with open(stats_output, 'a') as fh:
+      fh.write(json.dumps(record) + '\n')
+  if callback is not None:
+    callback(stats)
+
+
+def instrument_from_flags(label: str):
+  """Returns instrument() configured by the --stats_output etc. flags."""
+  return instrument(label, STATS_OUTPUT.value, PROFILE_OUTPUT.value,
+                    TRACE_MEMORY.value)
 
 
 def add_shot_number_breakdown(df: pd.DataFrame) -> None:
@@ -104,37 +471,896 @@ def add_shot_number_breakdown(df: pd.DataFrame) -> None:
   Args:
     df: pd.DataFrame
   """
-  # It's simpler to use substrings than to do math.
-  df['shot_number_within_beam'] = [
-      int(str(x)[-8:]) for x in df['shot_number']]
-  df['minor_frame_number'] = [int(str(x)[-11:-8]) for x in df['shot_number']]
-  # beam number, [-13:-11], is already in the 'beam' property
-  df['orbit_number'] = [int(str(x)[:-13]) for x in df['shot_number']]
+  shot_number = np.asarray(df['shot_number'], dtype=np.uint64)
+  df['shot_number_within_beam'] = (
+      shot_number % np.uint64(10**8)).astype(np.uint32)
+  df['minor_frame_number'] = (
+      shot_number // np.uint64(10**8) % np.uint64(1000)).astype(np.uint16)
+  # beam number, the next two digits, is already in the 'beam' property
+  df['orbit_number'] = (shot_number // np.uint64(10**13)).astype(np.uint32)
+
+
+def beam_keys(hdf_fh: h5py.File) -> list[str]:
+  """Returns the BEAMxxxx group names of a GEDI file, in file order."""
+  return [k for k in hdf_fh.keys() if k.startswith('BEAM')]
+
+
+def beam_windows(hdf_fh: h5py.File, beam_key: str,
+                 window_rows: int = 0) -> list[Optional[slice]]:
+  """Splits a beam into row windows aligned to the HDF5 chunk layout.
+
+  Args:
+    hdf_fh: h5 file handle
+    beam_key: a string like BEAM0110
+    window_rows: approximate number of shots per window; the window is
+      rounded up to a whole number of shot_number chunks. 0 means no
+      windowing.
+
+  Returns:
+    list of row slices, or [None] to read the whole beam at once
+  """
+  if window_rows <= 0:
+    return [None]
+  ds = hdf_fh[f'{beam_key}/shot_number']
+  num_shots = ds.shape[0]
+  if ds.chunks:
+    chunk_rows = ds.chunks[0]
+    window_rows = -(-window_rows // chunk_rows) * chunk_rows
+  return [slice(start, min(start + window_rows, num_shots))
+          for start in range(0, max(num_shots, 1), window_rows)]
+
+
+def _read_beam(hdf_paths: list[str],
+               beam_fn: Callable[..., pd.DataFrame],
+               beam_key: str,
+               window: Optional[slice]) -> pd.DataFrame:
+  """Opens the HDF files and reads a single beam (runs in a worker process)."""
+  with contextlib.ExitStack() as stack:
+    hdf_fhs = [stack.enter_context(h5py.File(p, 'r')) for p in hdf_paths]
+    with collect_stats() as stats:
+      df = beam_fn(*hdf_fhs, beam_key, window=window)
+    return df, stats
+
+
+def read_beams(hdf_paths: list[str],
+               beam_fn: Callable[..., pd.DataFrame],
+               num_workers: int = 1,
+               window_rows: int = 0,
+               prefetch_depth: int = 0) -> Iterator[pd.DataFrame]:
+  """Reads all beams of a granule.
+
+  Beam keys are taken from the first file. With more than one worker, every
+  beam (or beam window) is read and decoded in its own process; the results
+  are still yielded in beam order, so the output does not depend on the
+  number of workers.
+
+  With window_rows set, every beam is read in windows of about that many
+  shots and each window is yielded before the next one is read, which keeps
+  peak memory bounded for long beams. At most two windows per worker are in
+  flight at any time.
+
+  With prefetch_depth set, beams are read in a background thread up to that
+  many beams ahead of the consumer, so that reading overlaps with writing.
+
+  Args:
+    hdf_paths: HDF file paths, passed as open handles to beam_fn
+    beam_fn: module-level function called as
+      beam_fn(*hdf_fhs, beam_key, window=window), where window is a row slice
+      or None for the whole beam
+    num_workers: number of worker processes
+    window_rows: shots per window, see beam_windows; 0 reads whole beams
+    prefetch_depth: number of beams read ahead, see prefetch; 0 reads a beam
+      only when the consumer asks for it
+
+  Returns:
+    iterator over the DataFrame returned by beam_fn for every beam or window
+  """
+  beams = _read_beams(hdf_paths, beam_fn, num_workers, window_rows)
+  if prefetch_depth > 0:
+    return prefetch(beams, prefetch_depth)
+  return beams
+
+
+def _read_beams(hdf_paths: list[str],
+                beam_fn: Callable[..., pd.DataFrame],
+                num_workers: int,
+                window_rows: int) -> Iterator[pd.DataFrame]:
+  if num_workers <= 1:
+    with contextlib.ExitStack() as stack:
+      hdf_fhs = [stack.enter_context(h5py.File(p, 'r')) for p in hdf_paths]
+      for k in beam_keys(hdf_fhs[0]):
+        logging.info('Reading %s', k)
+        for window in beam_windows(hdf_fhs[0], k, window_rows):
+          _count_beam()
+          yield beam_fn(*hdf_fhs, k, window=window)
+    return
+
+  with h5py.File(hdf_paths[0], 'r') as hdf_fh:
+    tasks = [(k, window) for k in beam_keys(hdf_fh)
+             for window in beam_windows(hdf_fh, k, window_rows)]
+  if not tasks:
+    return
+  with futures.ProcessPoolExecutor(
+      max_workers=min(num_workers, len(tasks))) as executor:
+    pending = collections.deque()
+    for k, window in tasks:
+      pending.append((k, window, executor.submit(
+          _read_beam, hdf_paths, beam_fn, k, window)))
+      if len(pending) >= 2 * num_workers:
+        yield _next_result(pending)
+    while pending:
+      yield _next_result(pending)
+
+
+def _next_result(pending: collections.deque) -> pd.DataFrame:
+  k, window, future = pending.popleft()
+  if window is None or window.start == 0:
+    logging.info('Reading %s', k)
+  df, stats = future.result()
+  _count_beam(stats)
+  return df
+
+
+def _count_beam(stats: Optional[ExtractionStats] = None) -> None:
+  """Counts a beam read here, or adds the stats of a beam read elsewhere."""
+  if _stats is None:
+    return
+  with _stats_lock:
+    if stats is not None:
+      _stats.merge(stats)
+    _stats.beams += 1
+
+
+def prefetch(items: Iterator[Any], depth: int,
+             stats: Optional[PipelineStats] = None) -> Iterator[Any]:
+  """Produces items in a background thread, at most depth ahead.
+
+  The items are yielded in order. An exception raised while producing them
+  is re-raised in the consumer. The stall counters are logged at the end.
+
+  Args:
+    items: iterator to run in the background thread
+    depth: maximum number of produced items waiting for the consumer
+    stats: optional PipelineStats to update
+
+  Yields:
+    the items
+  """
+  stats = stats if stats is not None else PipelineStats()
+  pending = queue.Queue(maxsize=depth)
+  stop = threading.Event()
+  end = object()
+
+  def put(item) -> bool:
+    try:
+      pending.put_nowait(item)
+      return True
+    except queue.Full:
+      pass
+    stats.reader_stalls += 1
+    start = time.monotonic()
+    try:
+      while not stop.is_set():
+        try:
+          pending.put(item, timeout=0.1)
+          return True
+        except queue.Full:
+          pass
+      return False
+    finally:
+      stats.reader_stall_seconds += time.monotonic() - start
+
+  def produce():
+    try:
+      for item in items:
+        if not put((None, item)):
+          return
+    except BaseException as e:  # pylint:disable=broad-except
+      put((e, None))
+      return
+    finally:
+      if hasattr(items, 'close'):
+        items.close()
+    put((None, end))
+
+  reader = threading.Thread(target=produce, daemon=True)
+  reader.start()
+  try:
+    while True:
+      stats.max_queue_depth = max(stats.max_queue_depth, pending.qsize())
+      try:
+        error, item = pending.get_nowait()
+      except queue.Empty:
+        stats.consumer_stalls += 1
+        start = time.monotonic()
+        error, item = pending.get()
+        stats.consumer_stall_seconds += time.monotonic() - start
+      if error is not None:
+        raise error
+      if item is end:
+        return
+      stats.items += 1
+      yield item
+  finally:
+    stop.set()
+    reader.join()
+    logging.info('Prefetch pipeline: %s', stats)
+
+
+def shot_filter_from_flags() -> Optional[ShotFilter]:
+  """Returns the ShotFilter given by the --filter_* flags, if any is set."""
+  shot_filter = ShotFilter(
+      bbox=(tuple(float(x) for x in FILTER_BBOX.value)
+            if FILTER_BBOX.value else None),
+      quality_flag=FILTER_QUALITY_FLAG.value,
+      degrade_flag=FILTER_DEGRADE_FLAG.value,
+      min_sensitivity=FILTER_MIN_SENSITIVITY.value,
+      delta_time_range=(tuple(float(x) for x in FILTER_DELTA_TIME.value)
+                        if FILTER_DELTA_TIME.value else None))
+  if shot_filter == ShotFilter():
+    return None
+  if shot_filter.bbox and len(shot_filter.bbox) != 4:
+    raise ValueError('--filter_bbox needs 4 values: %s' % FILTER_BBOX.value)
+  if (shot_filter.delta_time_range and
+      len(shot_filter.delta_time_range) != 2):
+    raise ValueError(
+        '--filter_delta_time needs 2 values: %s' % FILTER_DELTA_TIME.value)
+  return shot_filter
+
+
+def _valid_values(
+    ds: h5py.Dataset,
+    window: Optional[slice] = None) -> tuple[np.ndarray, np.ndarray]:
+  """Reads a dataset and returns it with a mask of non-fill, finite values."""
+  values = read_rows(ds, window)
+  _count_bytes(ds.name.split('/', 2)[-1], values)
+  valid = np.ones(values.shape, dtype=bool)
+  if np.issubdtype(values.dtype, np.floating):
+    valid &= np.isfinite(values)
+  fill_value = ds.attrs.get('_FillValue')
+  if fill_value is not None:
+    valid &= values != fill_value
+  return values, valid
+
+
+def select_shots(hdf_fh: h5py.File, beam_key: str,
+                 filter_vars: FilterVariables,
+                 shot_filter: ShotFilter,
+                 window: Optional[slice] = None) -> np.ndarray:
+  """Computes the indices of the shots of a beam that pass a filter.
+
+  Only the datasets needed by the filter are read.
+
+  Args:
+    hdf_fh: h5 file handle
+    beam_key: a string like BEAM0110
+    filter_vars: names of the filtered variables in this product
+    shot_filter: the filter to apply
+    window: optional row slice to restrict the selection to
+
+  Returns:
+    sorted int64 array of row indices
+  """
+  def read(var):
+    return _valid_values(hdf_fh[f'{beam_key}/{var}'], window)
+
+  lat, keep = read(filter_vars.lat)
+  lon, lon_valid = read(filter_vars.lon)
+  keep &= lon_valid
+  if shot_filter.bbox:
+    min_lon, min_lat, max_lon, max_lat = shot_filter.bbox
+    keep &= (lon >= min_lon) & (lon <= max_lon)
+    keep &= (lat >= min_lat) & (lat <= max_lat)
+  if shot_filter.quality_flag is not None:
+    values, valid = read(filter_vars.quality_flag)
+    keep &= valid & (values == shot_filter.quality_flag)
+  if shot_filter.degrade_flag is not None:
+    values, valid = read(filter_vars.degrade_flag)
+    keep &= valid & (values == shot_filter.degrade_flag)
+  if shot_filter.min_sensitivity is not None:
+    values, valid = read(filter_vars.sensitivity)
+    keep &= valid & (values >= shot_filter.min_sensitivity)
+  if shot_filter.delta_time_range:
+    start, end = shot_filter.delta_time_range
+    values, valid = read(filter_vars.delta_time)
+    keep &= valid & (values >= start) & (values < end)
+  rows = np.flatnonzero(keep)
+  if window is not None:
+    rows += window.start
+  return rows
+
+
+def beam_rows(
+    hdf_fh: h5py.File, beam_key: str,
+    filter_vars: FilterVariables,
+    shot_filter: Optional[ShotFilter] = None,
+    window: Optional[slice] = None) -> Union[np.ndarray, slice, None]:
+  """Returns row indices, a row slice, or None to read a whole beam.
+
+  Args:
+    hdf_fh: h5 file handle
+    beam_key: a string like BEAM0110
+    filter_vars: names of the filtered variables in this product
+    shot_filter: optional filter, see select_shots
+    window: optional row slice, see beam_windows
+  """
+  if shot_filter is not None:
+    with _timed('filter'):
+      return select_shots(hdf_fh, beam_key, filter_vars, shot_filter, window)
+  return window
+
+
+def drop_missing_coordinates(df: pd.DataFrame) -> pd.DataFrame:
+  """Drops rows with nan values for lat_lowestmode or lon_lowestmode.
+
+  Such rows are not ingestable into EE.
+  """
+  with _timed('filter'):
+    kept = df[df.lat_lowestmode.notnull() & df.lon_lowestmode.notnull()]
+  if _stats is not None:
+    with _stats_lock:
+      _stats.rows_read += len(df)
+      _stats.rows_kept += len(kept)
+  return kept
+
+
+def read_rows(ds: h5py.Dataset,
+              rows: Union[np.ndarray, slice, None] = None) -> np.ndarray:
+  """Reads the given rows of a dataset, or all of it if rows is None.
+
+  Slices are read by HDF5 in one call. Selected rows of contiguous,
+  uncompressed datasets are gathered from a mapping of the file (see
+  map_dataset), which only touches the pages holding them. Otherwise,
+  selected rows are grouped into spans that are read as hyperslabs; rows
+  closer together than a chunk are read in the same span, as HDF5 has to
+  decompress the whole chunk anyway.
+
+  Args:
+    ds: h5py dataset, 1-D or 2-D with shots along the first axis
+    rows: sorted row indices, or a slice of rows
+
+  Returns:
+    numpy array with the selected rows
+  """
+  if rows is None:
+    rows = slice(None)
+  if isinstance(rows, slice):
+    return ds[rows]
+  mapped = map_dataset(ds)
+  if mapped is not None:
+    return mapped[rows]
+  if not len(rows):
+    return np.empty((0,) + ds.shape[1:], dtype=ds.dtype)
+  max_gap = ds.chunks[0] if ds.chunks else 1024
+  breaks = np.flatnonzero(np.diff(rows) > max_gap) + 1
+  span_starts = np.concatenate(([0], breaks))
+  span_ends = np.concatenate((breaks, [len(rows)]))
+  parts = []
+  for first, last in zip(span_starts, span_ends):
+    start = rows[first]
+    span = ds[start:rows[last - 1] + 1]
+    parts.append(span[rows[first:last] - start])
+  return np.concatenate(parts)
+
+
+def map_dataset(ds: h5py.Dataset) -> Optional[np.ndarray]:
+  """Maps a contiguous dataset from the file without reading it.
+
+  Args:
+    ds: h5py dataset
+
+  Returns:
+    read-only numpy view of the dataset in the file, or None if the dataset
+    is chunked (and possibly compressed), not numeric, empty or not stored
+    in a plain file
+  """
+  if ds.chunks is not None or ds.dtype.kind not in 'biuf' or not ds.size:
+    return None
+  offset = ds.id.get_offset()
+  if offset is None or ds.id.get_storage_size() != ds.nbytes:
+    return None
+  path = os.fsdecode(h5py.h5f.get_name(ds.id))
+  try:
+    stat = os.stat(path)
+  except OSError:
+    # Not a plain file, e.g. a file object or a family of files.
+    return None
+  if offset + ds.nbytes > stat.st_size:
+    return None
+  return np.memmap(path, dtype=ds.dtype, mode='r', offset=offset,
+                   shape=ds.shape).view(np.ndarray)
+
+
+def open_dataset(group: h5py.Group, hdf_path: str) -> h5py.Dataset:
+  """Opens a dataset with a chunk cache that holds two of its chunks.
+
+  HDF5 decompresses a chunk that does not fit in the cache again for every
+  read that touches it, e.g. windows that are not aligned to the chunks of
+  this dataset. The default cache of 1 MiB is smaller than a single chunk of
+  the 2-D datasets like rh.
+
+  Args:
+    group: h5py group, e.g. a beam
+    hdf_path: path of the dataset relative to the group
+
+  Returns:
+    h5py dataset
+  """
+  ds = group[hdf_path]
+  if not ds.chunks:
+    return ds
+  cache_bytes = min(2 * int(np.prod(ds.chunks)) * ds.dtype.itemsize,
+                    MAX_CHUNK_CACHE_BYTES)
+  if cache_bytes <= 2**20:
+    return ds
+  dapl = h5py.h5p.create(h5py.h5p.DATASET_ACCESS)
+  # Number of hash slots, a prime much larger than the chunks cached.
+  dapl.set_chunk_cache(521, cache_bytes, 0.75)
+  return h5py.Dataset(h5py.h5d.open(group.id, hdf_path.encode(), dapl))
+
+
+def _file_offset(ds: h5py.Dataset) -> int:
+  """Returns the file offset of the first data of a dataset, -1 if none."""
+  if ds.chunks is None:
+    offset = ds.id.get_offset()
+  elif ds.id.get_num_chunks():
+    offset = ds.id.get_chunk_info(0).byte_offset
+  else:
+    offset = None
+  return -1 if offset is None else offset
+
+
+def plan_reads(
+    hdf_fh: h5py.File, beam_key: str,
+    decoders: tuple[gedi_schema.Decoder, ...]
+) -> list[tuple[gedi_schema.Decoder, h5py.Dataset]]:
+  """Opens the datasets of schema variables in the order they are stored.
+
+  Reading the variables of a beam in file offset order rather than schema
+  order turns many scattered reads into a mostly forward scan of the file,
+  which matters most on network and FUSE-mounted file systems. Every dataset
+  is opened with open_dataset.
+
+  Args:
+    hdf_fh: h5 file handle
+    beam_key: a string like BEAM0110
+    decoders: compiled schema variables, see gedi_schema
+
+  Returns:
+    list of (decoder, dataset) pairs, sorted by file offset
+  """
+  group = hdf_fh[beam_key]
+  planned = [(decoder, open_dataset(group, decoder.variable.hdf_path))
+             for decoder in decoders]
+  return sorted(planned, key=lambda p: _file_offset(p[1]))
+
+
+def read_variables(
+    hdf_fh: h5py.File, beam_key: str,
+    decoders: tuple[gedi_schema.Decoder, ...],
+    rows: Union[np.ndarray, slice, None] = None) -> dict[str, Any]:
+  """Reads and decodes schema variables of a beam.
+
+  Args:
+    hdf_fh: h5 file handle
+    beam_key: a string like BEAM0110
+    decoders: compiled schema variables, see gedi_schema
+    rows: optional rows to read, see beam_rows
+
+  Returns:
+    dict from output column name to column values, in schema order
+  """
+  decoded = {}
+  for decoder, ds in plan_reads(hdf_fh, beam_key, decoders):
+    with _timed('read'):
+      values = read_rows(ds, rows)
+    _count_bytes(decoder.variable.hdf_path, values)
+    with _timed('decode'):
+      decoded[decoder] = decoder.decode(values, ds.attrs.get('_FillValue'))
+  columns = {}
+  for decoder in decoders:
+    columns.update(decoded[decoder])
+  return columns
+
+
+def match_shot_numbers(shot_numbers: np.ndarray,
+                       other_shot_numbers: np.ndarray) -> np.ndarray:
+  """Finds each shot in another product with a sorted merge on the keys.
+
+  GEDI products store the shots of a beam in increasing shot_number order,
+  so the other keys are normally used as is; they are only sorted if not.
+  Duplicate keys in the other product match their first occurrence.
+
+  Args:
+    shot_numbers: uint64 keys to look up
+    other_shot_numbers: uint64 keys of the other product's beam
+
+  Returns:
+    int64 array with the row of each shot in the other product, -1 if missing
+  """
+  other_shot_numbers = np.asarray(other_shot_numbers, dtype=np.uint64)
+  shot_numbers = np.asarray(shot_numbers, dtype=np.uint64)
+  order = None
+  if np.any(other_shot_numbers[1:] <= other_shot_numbers[:-1]):
+    order = np.argsort(other_shot_numbers, kind='stable')
+    other_shot_numbers = other_shot_numbers[order]
+    num_duplicates = np.count_nonzero(
+        other_shot_numbers[1:] == other_shot_numbers[:-1])
+    if num_duplicates:
+      logging.warning('%d duplicate shot numbers in joined product',
+                      num_duplicates)
+  positions = np.searchsorted(other_shot_numbers, shot_numbers)
+  found = positions < len(other_shot_numbers)
+  found[found] = (
+      other_shot_numbers[positions[found]] == shot_numbers[found])
+  if order is not None:
+    positions[found] = order[positions[found]]
+  return np.where(found, positions, -1).astype(np.int64)
+
+
+def _take(values, indices: np.ndarray):
+  """Takes values by position, with nulls where indices is -1."""
+  if isinstance(values, np.ndarray) and values.dtype.kind in 'iu':
+    values = pd.arrays.IntegerArray(values, np.zeros(len(values), dtype=bool))
+  return pd.api.extensions.take(values, indices, allow_fill=True)
+
+
+def _key_range(ds: h5py.Dataset, low: int, high: int) -> slice:
+  """Returns the rows of a sorted key dataset with keys in [low, high].
+
+  The dataset is bisected with single element reads, so that only the
+  range itself has to be read.
+  """
+
+  def bisect(key: int, after_equal: bool) -> int:
+    lo, hi = 0, len(ds)
+    while lo < hi:
+      mid = (lo + hi) // 2
+      value = int(ds[mid])
+      if value < key or (after_equal and value == key):
+        lo = mid + 1
+      else:
+        hi = mid
+    return lo
+
+  return slice(bisect(low, False), bisect(high, True))
+
+
+def _match_in_range(shot_numbers: np.ndarray,
+                    other_ds: h5py.Dataset) -> np.ndarray:
+  """Runs match_shot_numbers on the rows of other_ds that can match.
+
+  For a window of a beam, this reads the other keys between the smallest
+  and largest shot number of the window instead of the whole beam, relying
+  on the increasing shot_number order of GEDI products. All keys are read
+  if that range turns out not to be sorted.
+
+  Args:
+    shot_numbers: uint64 keys to look up
+    other_ds: shot_number dataset of the other product's beam
+
+  Returns:
+    int64 array with the row of each shot in other_ds, -1 if missing
+  """
+  if not len(shot_numbers):
+    return np.empty(0, dtype=np.int64)
+  key_range = _key_range(other_ds, int(shot_numbers.min()),
+                         int(shot_numbers.max()))
+  other_shot_numbers = np.asarray(read_rows(other_ds, key_range),
+                                  dtype=np.uint64)
+  if np.any(other_shot_numbers[1:] <= other_shot_numbers[:-1]):
+    return match_shot_numbers(shot_numbers, other_ds[:])
+  indices = match_shot_numbers(shot_numbers, other_shot_numbers)
+  return np.where(indices >= 0, indices + key_range.start, -1)
+
+
+def join_by_shot_number(
+    df: pd.DataFrame, hdf_fh: h5py.File, beam_key: str,
+    decoders: tuple[gedi_schema.Decoder, ...],
+    rows: Union[np.ndarray, slice, None] = None,
+    mismatch: str = 'keep', prefix: str = '') -> pd.DataFrame:
+  """Adds variables of another GEDI product to df, matched on shot_number.
+
+  When the other product has the same shots at the same rows, which is the
+  usual case, the variables are read at the given rows directly. Otherwise
+  every shot is looked up by shot_number with match_shot_numbers, among
+  the other shots within the range of shot numbers of df.
+
+  Args:
+    df: beam table with a shot_number column
+    hdf_fh: h5 file handle of the other product
+    beam_key: a string like BEAM0110
+    decoders: compiled schema variables to add, see gedi_schema
+    rows: rows of df in its own product, see beam_rows
+    mismatch: for shots missing from the other product, 'keep' them with
+      null values, 'drop' them or raise an 'error'
+    prefix: prepended to added column names that already exist in df
+
+  Returns:
+    df with the added columns
+
+  Raises:
+    ValueError: if mismatch is 'error' and shots are missing
+  """
+  shot_numbers = np.asarray(df['shot_number'], dtype=np.uint64)
+  other_ds = hdf_fh[f'{beam_key}/shot_number']
+  aligned = rows is not None or len(other_ds) == len(shot_numbers)
+  if aligned:
+    try:
+      with _timed('join'):
+        aligned = np.array_equal(read_rows(other_ds, rows), shot_numbers)
+    except (IndexError, ValueError):
+      aligned = False
+
+  if aligned:
+    columns = read_variables(hdf_fh, beam_key, decoders, rows)
+  else:
+    with _timed('join'):
+      indices = _match_in_range(shot_numbers, other_ds)
+    found = indices >= 0
+    num_missing = len(indices) - np.count_nonzero(found)
+    if num_missing:
+      logging.warning('%s: %d of %d shots not found in %s', beam_key,
+                      num_missing, len(indices), hdf_fh.filename)
+      if mismatch == 'error':
+        raise ValueError(f'{beam_key}: {num_missing} shots not found in '
+                         f'{hdf_fh.filename}')
+    other_rows, positions = np.unique(indices[found], return_inverse=True)
+    take = np.full(len(indices), -1, dtype=np.int64)
+    take[found] = positions
+    columns = {
+        name: _take(values, take) for name, values in read_variables(
+            hdf_fh, beam_key, decoders, other_rows).items()
+    }
+    if num_missing and mismatch == 'drop':
+      df = df[found]
+      columns = {name: values[found] for name, values in columns.items()}
+
+  # Adding all columns at once; many single inserts fragment the frame.
+  return pd.concat([
+      df,
+      pd.DataFrame({
+          (prefix + name if name in df else name): values
+          for name, values in columns.items()
+      }, index=df.index)
+  ], axis=1)
 
 
 def hdf_to_df(
-    hdf_fh: h5py.File, beam_key: str, var: str, df: pd.DataFrame) -> None:
+    hdf_fh: h5py.File, beam_key: str, var: str, df: pd.DataFrame,
+    rows: Union[np.ndarray, slice, None] = None) -> None:
   """Copies data for a single var from an HDF file to a Pandas DataFrame.
 
+  This is meant for ad-hoc 1-D variables; the extractors read the variables
+  declared in gedi_schema with read_variables.
+
   Args:
     hdf_fh: h5 file handle
     beam_key: a string like BEAM0110, first part of the HDF variable key
     var: second part of the HDF variable key (also used for the dataframe key)
     df: output Pandsa DataFrame
+    rows: optional rows to read, see beam_rows
   """
   if var.startswith('#'):
     return
-  hdf_key = f'{beam_key}/{var}'
-  df_key = var.split('/')[-1]
+  ds = hdf_fh[f'{beam_key}/{var}']
+  dtype = gedi_schema.STRING if ds.dtype.kind == 'S' else ds.dtype.name
+  decoder = gedi_schema.Decoder(gedi_schema.Variable(var, dtype))
+  for name, values in decoder.decode(
+      read_rows(ds, rows), ds.attrs.get('_FillValue')).items():
+    df[name] = values
+
+
+class TableWriter:
+  """Writes per-beam DataFrames into a single output file."""
 
-  ds = hdf_fh[hdf_key]
-  df[df_key] = ds[:]
-  if len(df[df_key]) and isinstance(df[df_key][0], bytes):
-    df[df_key] = df[df_key].apply(lambda x: x.decode())
-  df[df_key].replace([np.inf, -np.inf], np.nan, inplace=True)
-  if ds.attrs.get('_FillValue') is not None:
-    # We need to use pd.NA that works with integer types (np.nan does not)
-    df[df_key].replace(ds.attrs.get('_FillValue'), pd.NA, inplace=True)
+  def write(self, df: pd.DataFrame) -> None:
+    raise NotImplementedError
+
+  def close(self) -> None:
+    pass
+
+
+class CsvTableWriter(TableWriter):
+  """Appends DataFrames to an open text file handle as CSV."""
+
+  def __init__(self, csv_file):
+    self._csv_file = csv_file
+    self._is_first = True
+
+  def write(self, df: pd.DataFrame) -> None:
+    with _timed('write'):
+      df.to_csv(
+          self._csv_file,
+          float_format='%3.6f',
+          index=False,
+          header=self._is_first,
+          mode='a',
+          line_terminator='\n')
+    self._is_first = False
+
+
+class ParallelGzipWriter(io.RawIOBase):
+  """Binary writer that gzips blocks of the stream in parallel threads.
+
+  Every block is compressed into its own gzip member, so the output is a
+  standard multi-member gzip file (as written by pigz) that gunzip, zcat and
+  Python's gzip module read as a whole. zlib releases the GIL while
+  compressing, so the threads run in parallel with each other and with the
+  code producing the data.
+  """
+
+  def __init__(self, fh, level: int = CSV_GZIP_LEVEL,
+               block_bytes: int = CSV_COMPRESSION_BLOCK_BYTES,
+               num_threads: Optional[int] = None):
+    """Creates the writer.
+
+    Args:
+      fh: binary file handle the compressed data is written to; it is not
+        closed with the writer
+      level: gzip compression level
+      block_bytes: uncompressed size of each gzip member
+      num_threads: number of compression threads, one per CPU by default
+    """
+    super().__init__()
+    self._fh = fh
+    self._level = level
+    self._block_bytes = block_bytes
+    self._num_threads = num_threads or os.cpu_count() or 1
+    self._executor = futures.ThreadPoolExecutor(self._num_threads)
+    self._buffer = bytearray()
+    self._pending = collections.deque()
+    self._num_blocks = 0
+
+  def writable(self) -> bool:
+    return True
+
+  def write(self, data) -> int:
+    self._buffer += data
+    while len(self._buffer) >= self._block_bytes:
+      self._submit(bytes(self._buffer[:self._block_bytes]))
+      del self._buffer[:self._block_bytes]
+    return len(data)
+
+  def _submit(self, block: bytes) -> None:
+    self._pending.append(
+        self._executor.submit(gzip.compress, block, self._level, mtime=0))
+    self._num_blocks += 1
+    # Bounds the memory held by blocks waiting to be written.
+    while len(self._pending) > 2 * self._num_threads:
+      self._fh.write(self._pending.popleft().result())
+
+  def close(self) -> None:
+    if self.closed:
+      return
+    try:
+      if self._buffer or not self._num_blocks:
+        self._submit(bytes(self._buffer))
+        self._buffer.clear()
+      while self._pending:
+        self._fh.write(self._pending.popleft().result())
+      self._fh.flush()
+    finally:
+      self._executor.shutdown()
+      super().close()
+
+
+def _zstd_writer(fh):
+  """Returns a multi-threaded zstd stream writer, which needs zstandard."""
+  import zstandard  # pylint:disable=g-import-not-at-top
+  return zstandard.ZstdCompressor(
+      level=CSV_ZSTD_LEVEL, threads=-1).stream_writer(fh, closefd=False)
+
+
+# Output format -> function wrapping a binary file handle into a compressor.
+_CSV_COMPRESSORS = {
+    'csv.gz': ParallelGzipWriter,
+    'csv.zst': _zstd_writer,
+}
+
+
+class _ColumnarTableWriter(TableWriter):
+  """Base class for the Arrow-based writers.
+
+  The schema is taken from the first non-empty beam. Later beams are cast to
+  it, so that a column that happens to be all-null in one beam keeps the type
+  it has everywhere else. If no beam has rows, the output is an empty table
+  with the columns of the first beam.
+  """
+
+  def __init__(self, output_path: str):
+    self._output_path = output_path
+    self._schema = None
+    self._writer = None
+
+  def _open(self, schema):
+    raise NotImplementedError
+
+  def _write_table(self, table) -> None:
+    raise NotImplementedError
+
+  def write(self, df: pd.DataFrame) -> None:
+    import pyarrow as pa  # pylint:disable=g-import-not-at-top
+    if df.empty and self._schema is not None:
+      return
+    with _timed('write'):
+      table = pa.Table.from_pandas(df, preserve_index=False)
+      if self._writer is None:
+        self._schema = table.schema.remove_metadata()
+        if not table.num_rows:
+          return
+        self._writer = self._open(self._schema)
+      self._write_table(table.cast(self._schema))
+
+  def close(self) -> None:
+    if self._writer is None:
+      import pyarrow as pa  # pylint:disable=g-import-not-at-top
+      # No rows were written, but the output still has to exist.
+      schema = self._schema if self._schema is not None else pa.schema([])
+      self._writer = self._open(schema)
+      self._write_table(schema.empty_table())
+    self._writer.close()
+    self._writer = None
+
+
+class ParquetTableWriter(_ColumnarTableWriter):
+  """Writes a Parquet file with one compressed row group per beam."""
+
+  def _open(self, schema):
+    import pyarrow.parquet as pq  # pylint:disable=g-import-not-at-top
+    return pq.ParquetWriter(
+        self._output_path, schema, compression=COLUMNAR_COMPRESSION)
+
+  def _write_table(self, table) -> None:
+    self._writer.write_table(table, row_group_size=max(table.num_rows, 1))
+
+
+class ArrowTableWriter(_ColumnarTableWriter):
+  """Writes an Arrow IPC (Feather v2) file with one record batch per beam."""
+
+  def _open(self, schema):
+    import pyarrow as pa  # pylint:disable=g-import-not-at-top
+    return pa.ipc.new_file(
+        self._output_path, schema,
+        options=pa.ipc.IpcWriteOptions(compression=COLUMNAR_COMPRESSION))
+
+  def _write_table(self, table) -> None:
+    for batch in table.combine_chunks().to_batches():
+      self._writer.write_batch(batch)
+
+
+@contextlib.contextmanager
+def open_table_writer(output_path: str, output_format: str = 'csv'):
+  """Opens a TableWriter for the given output format.
+
+  Args:
+    output_path: output file path
+    output_format: one of 'csv', 'csv.gz', 'csv.zst', 'parquet' or 'arrow'
+
+  Yields:
+    a TableWriter, closed when the context exits
+  """
+  if output_format == 'csv':
+    with open(output_path, 'w') as csv_fh:
+      yield CsvTableWriter(csv_fh)
+    return
+  if output_format in _CSV_COMPRESSORS:
+    with open(output_path, 'wb') as fh:
+      with io.TextIOWrapper(
+          _CSV_COMPRESSORS[output_format](fh), encoding='utf-8',
+          newline='') as csv_fh:
+        yield CsvTableWriter(csv_fh)
+    return
+  if output_format == 'parquet':
+    writer = ParquetTableWriter(output_path)
+  elif output_format == 'arrow':
+    writer = ArrowTableWriter(output_path)
+  else:
+    raise ValueError('Unknown output format: %s' % output_format)
+  try:
+    yield writer
+  finally:
+    writer.close()
 
 
 def gedi_deltatime_epoch(dt):
@@ -146,12 +1372,108 @@ def timestamp_ms_for_datetime(dt):
   return time.mktime(dt.timetuple()) * 1000
 
 
+def parse_month(month: str) -> datetime.datetime:
+  """Returns the first day of a YYYY-MM month, in UTC."""
+  return pytz.utc.localize(datetime.datetime.strptime(month, '%Y-%m'))
+
+
+@functools.lru_cache(maxsize=None)
 def parse_date_from_gedi_filename(table_asset_id):
   return pytz.utc.localize(
       datetime.datetime.strptime(
           os.path.basename(table_asset_id).split('_')[2], '%Y%j%H%M%S'))
 
 
+def list_input_files(input_path: str) -> list[str]:
+  """Lists .h5 files in a directory, or reads a file with one path per line."""
+  if os.path.isdir(input_path):
+    return sorted(glob.glob(os.path.join(input_path, '*.h5')))
+  with open(input_path) as fh:
+    return [x.strip() for x in fh if x.strip()]
+
+
+def list_tables(input_path: str) -> list[str]:
+  """Lists extracted tables in a directory, or reads a list of paths."""
+  if os.path.isdir(input_path):
+    return sorted(
+        os.path.join(input_path, f) for f in os.listdir(input_path)
+        if f.endswith(TABLE_EXTENSIONS))
+  return list_input_files(input_path)
+
+
+def read_table(path: str, columns: list[str]) -> pd.DataFrame:
+  """Reads columns of a CSV (also compressed), Parquet or Arrow table."""
+  if path.endswith('.parquet'):
+    return pd.read_parquet(path, columns=columns)
+  if path.endswith('.arrow'):
+    return pd.read_feather(path, columns=columns)
+  return pd.read_csv(path, usecols=columns)
+
+
+def read_month(
+    paths: list[str],
+    columns: list[str],
+    month_start: datetime.datetime,
+    bounds: Optional[list[tuple[float, float, float, float]]] = None
+) -> pd.DataFrame:
+  """Reads the shots of a month with coordinates from tables.
+
+  Args:
+    paths: table paths
+    columns: columns to read besides the coordinates
+    month_start: first day of the month, in UTC
+    bounds: optional (min_lon, min_lat, max_lon, max_lat) boxes; only the
+      shots within one of them are kept, before the tables are concatenated
+
+  Returns:
+    DataFrame with the shots of all tables
+  """
+  columns = sorted(
+      set(columns) |
+      {'lat_lowestmode', 'lon_lowestmode', 'sensitivity', 'delta_time'})
+  start = gedi_deltatime_epoch(month_start)
+  end = gedi_deltatime_epoch(
+      month_start + relativedelta.relativedelta(months=1))
+  frames = []
+  for path in paths:
+    df = read_table(path, columns)
+    # The same inclusive range as ee.Filter.rangeContains.
+    df = df[df.delta_time.between(start, end)]
+    if bounds is not None:
+      df = df[_within_any(df.lon_lowestmode.to_numpy(),
+                          df.lat_lowestmode.to_numpy(), bounds)]
+    frames.append(drop_missing_coordinates(df))
+  if not frames:
+    return pd.DataFrame(columns=columns)
+  return pd.concat(frames, ignore_index=True)
+
+
+def _within_any(lons: np.ndarray, lats: np.ndarray,
+                bounds: list[tuple[float, float, float, float]]) -> np.ndarray:
+  """Returns which points are within one of the boxes, edges included."""
+  within = np.zeros(len(lons), dtype=bool)
+  for min_lon, min_lat, max_lon, max_lat in bounds:
+    within |= ((lons >= min_lon) & (lons <= max_lon) & (lats >= min_lat) &
+               (lats <= max_lat))
+  return within
+
+
+def parse_granule_key_from_gedi_filename(path: str) -> str:
+  """Returns the part of a GEDI file name shared by all products of a granule.
+
+  Example: GEDI02_A_2019108002011_O01961_03_T03909_02_005_01_V002.h5 and
+  GEDI02_B_2019108002011_O01961_03_T03909_02_003_01_V002.h5 both give
+  2019108002011_O01961_03 (acquisition time, orbit and sub-orbit granule).
+
+  Args:
+    path: GEDI file path, table asset id or file name
+
+  Returns:
+    string, the granule key
+  """
+  return '_'.join(os.path.basename(path).split('_')[2:5])
+
+
 def create_export(
     table_asset_ids: list[str],
     raster_asset_id: str,
@@ -159,7 +1481,8 @@ def create_export(
     int_bands: list[str],
     grid_cell_feature: Any,
     grill_month: datetime.datetime,
-    overwrite: bool) -> ExportParameters:
+    overwrite: bool,
+    crs: Optional[str] = None) -> ExportParameters:
   """Creates an EE export job definition.
 
   Args:
@@ -170,6 +1493,8 @@ def create_export(
     grid_cell_feature: ee.Feature
     grill_month: grilled month
     overwrite: bool, if any of the assets can be replaced if they already exist
+    crs: the crs property of grid_cell_feature; fetched with getInfo if not
+      given
 
   Returns:
     an ExportParameters object containing arguments for an export job.
@@ -199,26 +1524,15 @@ def create_export(
         'The majority of table ids are not in the requested month %s' %
         grill_month)
 
-  shots = []
-  for table_asset_id in table_asset_ids:
-    shots.append(ee.FeatureCollection(table_asset_id))
+  if crs is None:
+    crs = grid_cell_feature.get('crs').getInfo()
 
-  box = grid_cell_feature.geometry().buffer(2500, 25).bounds()
-  # month_start and month_end are converted to epochs using the
-  # same temporal offset as "delta_time."
-  # pytype: disable=attribute-error
-  shots = ee.FeatureCollection(shots).flatten().filterBounds(box).filter(
-      ee.Filter.rangeContains(
-          'delta_time',
-          gedi_deltatime_epoch(month_start),
-          gedi_deltatime_epoch(month_end))
-    )
-  # pytype: enable=attribute-error
+  start = time.perf_counter()
+  table_ids, shots = _month_shots(table_asset_ids, month_start, month_end)
+  box = grid_cell_feature.geometry().buffer(GRID_CELL_BUFFER, 25).bounds()
   # We use ee.Reducer.first() below, so this will pick the point with the
-  # higherst sensitivity.
-  shots = shots.sort('sensitivity', False)
-
-  crs = grid_cell_feature.get('crs').getInfo()
+  # highest sensitivity.
+  shots = shots.filterBounds(box).sort('sensitivity', False)
 
   image_properties = {
       'month': grill_month.month,
@@ -226,23 +1540,65 @@ def create_export(
       'version': 1,
       'system:time_start': timestamp_ms_for_datetime(month_start),
       'system:time_end': timestamp_ms_for_datetime(month_end),
-      'table_asset_ids': table_asset_ids
+      # The same node as the loaded tables, so the ids are sent only once.
+      'table_asset_ids': table_ids
   }
 
   image = (
-      shots.sort('sensitivity', False).reduceToImage(
+      shots.reduceToImage(
           raster_bands,
           ee.Reducer.first().forEach(raster_bands)).reproject(
-              crs, None, 25).set(image_properties))
+              crs, None, EXPORT_SCALE).set(image_properties))
 
   # This keeps the original (alphabetic) band order.
   image_with_types = image.toDouble().addBands(
       image.select(int_bands).toInt(), overwrite=True)
 
-  return ExportParameters(
+  export_params = ExportParameters(
       asset_id=raster_asset_id,
       image=image_with_types.clip(box),
       pyramiding_policy={'.default': 'sample'},
       crs=crs,
       region=box,
       overwrite=overwrite)
+  export_params.build_seconds = time.perf_counter() - start
+  export_params.payload_bytes = (
+      len(export_params.image.serialize()) +
+      len(export_params.region.serialize()))
+  logging.info('%s: %d tables, graph built in %.3fs, %d payload bytes',
+               raster_asset_id, len(table_asset_ids),
+               export_params.build_seconds, export_params.payload_bytes)
+  return export_params
+
+
+def _month_shots(
+    table_asset_ids: list[str], month_start: datetime.datetime,
+    month_end: datetime.datetime) -> tuple[Any, Any]:
+  """Returns the shots of a month in the given tables.
+
+  The tables are loaded by mapping over a single list of their ids, rather
+  than with one node per table. The graph still grows with the number of
+  tables; with --gedi_catalog, each grid cell only gets the tables routed to
+  it.
+
+  Args:
+    table_asset_ids: table asset ids
+    month_start: first day of the month
+    month_end: first day of the next month
+
+  Returns:
+    (ee.List of the table ids, ee.FeatureCollection of the shots)
+  """
+  table_ids = ee.List(table_asset_ids)
+  # month_start and month_end are converted to epochs using the
+  # same temporal offset as "delta_time."
+  # pytype: disable=attribute-error
+  shots = ee.FeatureCollection(table_ids.map(
+      lambda table_id: ee.FeatureCollection(ee.String(table_id)))).flatten(
+      ).filter(
+          ee.Filter.rangeContains(
+              'delta_time',
+              gedi_deltatime_epoch(month_start),
+              gedi_deltatime_epoch(month_end)))
+  # pytype: enable=attribute-error
+  return table_ids, shots
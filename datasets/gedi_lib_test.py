@@ -0,0 +1,344 @@
+# Copyright 2020 The Google Earth Engine Community Authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Tests for gedi_lib."""
+
+import os
+import tempfile
+
+from absl.testing import absltest
+import h5py
+import numpy as np
+import pandas as pd
+
+import gedi_extract_l2a
+import gedi_extract_l2b
+import gedi_extract_l4a
+import gedi_lib
+import gedi_schema
+import gedi_synthetic
+
+
+def _row_wise_shot_number_breakdown(df: pd.DataFrame) -> None:
+  """The original, string based add_shot_number_breakdown."""
+  df['shot_number_within_beam'] = [
+      int(str(x)[-8:]) for x in df['shot_number']]
+  df['minor_frame_number'] = [int(str(x)[-11:-8]) for x in df['shot_number']]
+  df['orbit_number'] = [int(str(x)[:-13]) for x in df['shot_number']]
+
+
+# For every product, the extractor, its inputs within a synthetic orbit and
+# the output column of the quality flag it filters on.
+_EXTRACTORS = {
+    'l2a': (gedi_extract_l2a.extract_values, slice(0, 2), 'quality_flag'),
+    'l2b': (gedi_extract_l2b.extract_values, slice(1, 2), 'l2b_quality_flag'),
+    'l4a': (gedi_extract_l4a.extract_values, slice(2, 3), 'l4_quality_flag'),
+}
+
+
+def _extract(product: str, orbit_paths: list[str], output_path: str,
+             **kwargs) -> pd.DataFrame:
+  """Extracts a product of a synthetic orbit and reads the table back."""
+  extract_values, inputs, _ = _EXTRACTORS[product]
+  extract_values(orbit_paths[inputs], output_path, 'parquet', **kwargs)
+  return gedi_lib.read_table(output_path, None)
+
+
+class ShotNumberBreakdownTest(absltest.TestCase):
+
+  def test_matches_row_wise_implementation(self):
+    rng = np.random.default_rng(0)
+    shot_numbers = np.concatenate([
+        np.array([
+            154341234599141100,  # The docstring example.
+            10000000000000,  # Orbit 1, every other part 0.
+            19999999999999,  # Orbit 1, every other part at its maximum.
+            999999999999999999,  # The largest orbit, 99999.
+            999990000000000000,
+            154341200500000001,  # Leading zeros in frame and shot.
+            15434120000000099,
+        ], dtype=np.uint64),
+        rng.integers(10**13, 10**18, 1000, dtype=np.uint64),
+    ])
+    expected = pd.DataFrame({'shot_number': shot_numbers})
+    _row_wise_shot_number_breakdown(expected)
+    actual = pd.DataFrame({'shot_number': shot_numbers})
+    gedi_lib.add_shot_number_breakdown(actual)
+
+    pd.testing.assert_frame_equal(actual, expected, check_dtype=False)
+
+  def test_output_types(self):
+    df = pd.DataFrame(
+        {'shot_number': np.array([154341234599141100], dtype=np.uint64)})
+    gedi_lib.add_shot_number_breakdown(df)
+
+    self.assertEqual(df.shot_number_within_beam.dtype, np.uint32)
+    self.assertEqual(df.minor_frame_number.dtype, np.uint16)
+    self.assertEqual(df.orbit_number.dtype, np.uint32)
+    self.assertEqual(df.shot_number_within_beam[0], 99141100)
+    self.assertEqual(df.minor_frame_number[0], 345)
+    self.assertEqual(df.orbit_number[0], 15434)
+
+
+class JoinByShotNumberTest(absltest.TestCase):
+
+  def setUp(self):
+    super().setUp()
+    self.shot_numbers = np.arange(1000, 2000, 3, dtype=np.uint64)
+    self.decoders = gedi_schema.compile_variables((
+        gedi_schema.Variable('agbd', 'float32'),
+        gedi_schema.Variable('l4_quality_flag', 'uint8'),
+    ))
+
+  def _other(self, shot_numbers: np.ndarray) -> h5py.File:
+    """Writes another product whose values are derived from the keys."""
+    path = os.path.join(
+        self.enter_context(tempfile.TemporaryDirectory()), 'other.h5')
+    with h5py.File(path, 'w') as hdf_fh:
+      beam = hdf_fh.create_group('BEAM0000')
+      beam['shot_number'] = shot_numbers
+      beam['agbd'] = (shot_numbers / 10).astype(np.float32)
+      beam['l4_quality_flag'] = (shot_numbers % 2).astype(np.uint8)
+    return self.enter_context(h5py.File(path, 'r'))
+
+  def _join(self, other, rows=None, mismatch='keep'):
+    shot_numbers = self.shot_numbers
+    if rows is not None:
+      shot_numbers = shot_numbers[rows]
+    df = pd.DataFrame({'shot_number': shot_numbers})
+    return gedi_lib.join_by_shot_number(df, other, 'BEAM0000', self.decoders,
+                                        rows, mismatch)
+
+  def _check_values(self, joined):
+    shot_numbers = joined.shot_number.to_numpy()
+    np.testing.assert_array_equal(joined.agbd,
+                                  (shot_numbers / 10).astype(np.float32))
+    np.testing.assert_array_equal(joined.l4_quality_flag, shot_numbers % 2)
+
+  def test_aligned(self):
+    other = self._other(self.shot_numbers)
+    self._check_values(self._join(other))
+    self._check_values(self._join(other, slice(10, 20)))
+    self._check_values(self._join(other, np.array([0, 5, 7])))
+
+  def test_unaligned_windows(self):
+    # Every shot is there, but at other rows.
+    other = self._other(np.arange(900, 2100, dtype=np.uint64))
+    whole = self._join(other)
+    self._check_values(whole)
+    windows = [self._join(other, slice(start, start + 100))
+               for start in range(0, len(self.shot_numbers), 100)]
+    pd.testing.assert_frame_equal(
+        pd.concat(windows, ignore_index=True), whole)
+
+  def test_unsorted_other_product(self):
+    other_shot_numbers = np.arange(900, 2100, dtype=np.uint64)
+    np.random.default_rng(0).shuffle(other_shot_numbers)
+    other = self._other(other_shot_numbers)
+    self._check_values(self._join(other))
+    self._check_values(self._join(other, slice(100, 200)))
+
+  def test_missing_shots(self):
+    other = self._other(self.shot_numbers[::2])
+    missing = np.arange(len(self.shot_numbers)) % 2 == 1
+    for rows in (None, slice(50, 150)):
+      in_rows = missing if rows is None else missing[rows]
+
+      kept = self._join(other, rows, 'keep')
+      self.assertLen(kept, len(in_rows))
+      self.assertTrue(kept.agbd[in_rows].isna().all())
+      self.assertTrue(kept.l4_quality_flag[in_rows].isna().all())
+      self._check_values(kept[~in_rows])
+
+      dropped = self._join(other, rows, 'drop')
+      self.assertLen(dropped, np.count_nonzero(~in_rows))
+      self._check_values(dropped)
+
+      with self.assertRaisesRegex(ValueError, 'shots not found'):
+        self._join(other, rows, 'error')
+
+  def test_key_range(self):
+    other = self._other(self.shot_numbers)
+    key_range = gedi_lib._key_range(  # pylint: disable=protected-access
+        other['BEAM0000/shot_number'], 1100, 1200)
+    self.assertEqual(key_range, slice(34, 67))
+    self.assertEqual(
+        gedi_lib._key_range(  # pylint: disable=protected-access
+            other['BEAM0000/shot_number'], 0, 10),
+        slice(0, 0))
+
+
+class ShotFilterTest(absltest.TestCase):
+
+  def setUp(self):
+    super().setUp()
+    self.tmp_dir = self.enter_context(tempfile.TemporaryDirectory())
+    self.orbit_paths = gedi_synthetic.write_orbit(
+        os.path.join(self.tmp_dir, 'orbit'), 1000, 100)
+
+  def _check_filter(self, shot_filter, keep_fn):
+    for product, (_, _, quality_column) in _EXTRACTORS.items():
+      everything = _extract(
+          product, self.orbit_paths,
+          os.path.join(self.tmp_dir, product + '.parquet'))
+      filtered = _extract(
+          product, self.orbit_paths,
+          os.path.join(self.tmp_dir, product + '_filtered.parquet'),
+          shot_filter=shot_filter)
+
+      expected = everything[keep_fn(everything, quality_column)]
+      self.assertNotEmpty(filtered)
+      self.assertLess(len(filtered), len(everything))
+      pd.testing.assert_frame_equal(
+          filtered, expected.reset_index(drop=True))
+
+  def test_bbox(self):
+    self._check_filter(
+        gedi_lib.ShotFilter(bbox=(-100, -10, -70, 30)),
+        lambda df, _: (df.lon_lowestmode.between(-100, -70) &
+                       df.lat_lowestmode.between(-10, 30)))
+
+  def test_flags(self):
+    self._check_filter(
+        gedi_lib.ShotFilter(quality_flag=1, degrade_flag=0),
+        lambda df, column: (df[column] == 1) & (df.degrade_flag == 0))
+
+  def test_sensitivity_and_time(self):
+    with h5py.File(self.orbit_paths[0], 'r') as hdf_fh:
+      start, end = hdf_fh['BEAM0000/delta_time'][[250, 750]]
+    self._check_filter(
+        gedi_lib.ShotFilter(min_sensitivity=0.9,
+                            delta_time_range=(start, end)),
+        # Missing sensitivities do not pass.
+        lambda df, _: ((df.sensitivity >= np.float32(0.9)) &
+                       (df.delta_time >= start) & (df.delta_time < end)))
+
+
+class ReadBeamsTest(absltest.TestCase):
+
+  def test_windows_and_workers_give_the_same_output(self):
+    tmp_dir = self.enter_context(tempfile.TemporaryDirectory())
+    orbit_paths = gedi_synthetic.write_orbit(
+        os.path.join(tmp_dir, 'orbit'), 500, 100, None)
+    shot_filter = gedi_lib.ShotFilter(bbox=(-100, -10, -70, 30),
+                                      min_sensitivity=0.9)
+    for product in _EXTRACTORS:
+      for filter_or_none in (None, shot_filter):
+        expected = _extract(product, orbit_paths,
+                            os.path.join(tmp_dir, 'whole.parquet'),
+                            shot_filter=filter_or_none)
+        self.assertNotEmpty(expected)
+        # Windows of 150 rows are widened to 200, two HDF5 chunks.
+        for options in ({'window_rows': 150},
+                        {'window_rows': 2000},
+                        {'num_workers': 3},
+                        {'num_workers': 2, 'window_rows': 150},
+                        {'prefetch_depth': 2, 'window_rows': 150}):
+          actual = _extract(product, orbit_paths,
+                            os.path.join(tmp_dir, 'streamed.parquet'),
+                            shot_filter=filter_or_none, **options)
+          pd.testing.assert_frame_equal(actual, expected)
+
+
+class ReadRowsTest(absltest.TestCase):
+
+  def _granule(self, chunk_rows, compression):
+    path = os.path.join(
+        self.enter_context(tempfile.TemporaryDirectory()),
+        gedi_synthetic.L4A_FILENAME)
+    gedi_synthetic.write_granule(path, gedi_schema.L4A, 1000, chunk_rows,
+                                 compression)
+    return self.enter_context(h5py.File(path, 'r'))['BEAM0101']
+
+  def _check_rows(self, beam):
+    rows = np.flatnonzero(np.random.default_rng(0).random(1000) < 0.3)
+    for name in ('agbd', 'land_cover_data/pft_class', 'shot_number'):
+      ds = beam[name]
+      np.testing.assert_array_equal(gedi_lib.read_rows(ds), ds[:])
+      np.testing.assert_array_equal(
+          gedi_lib.read_rows(ds, slice(100, 300)), ds[100:300])
+      np.testing.assert_array_equal(gedi_lib.read_rows(ds, rows), ds[rows])
+      self.assertEmpty(gedi_lib.read_rows(ds, rows[:0]))
+
+  def test_contiguous_datasets_are_mapped(self):
+    beam = self._granule(0, None)
+    mapped = gedi_lib.map_dataset(beam['agbd'])
+    np.testing.assert_array_equal(mapped, beam['agbd'][:])
+    self.assertIsNone(gedi_lib.map_dataset(beam['predict_stratum']))
+    self._check_rows(beam)
+
+  def test_chunked_datasets_are_not_mapped(self):
+    beam = self._granule(100, 'gzip')
+    self.assertIsNone(gedi_lib.map_dataset(beam['agbd']))
+    self._check_rows(beam)
+
+
+class ColumnarTableWriterTest(absltest.TestCase):
+
+  def setUp(self):
+    super().setUp()
+    self.output_dir = self.enter_context(tempfile.TemporaryDirectory())
+
+  def test_empty_beams_write_an_empty_table(self):
+    empty = pd.DataFrame({
+        'agbd': np.array([], dtype=np.float32),
+        'predict_stratum': pd.Series([], dtype=object),
+    })
+    for output_format in ('parquet', 'arrow'):
+      path = os.path.join(self.output_dir, 'empty.' + output_format)
+      with gedi_lib.open_table_writer(path, output_format) as writer:
+        writer.write(empty)
+        writer.write(empty)
+
+      table = gedi_lib.read_table(path, None)
+      self.assertEmpty(table)
+      self.assertEqual(list(table.columns), ['agbd', 'predict_stratum'])
+      self.assertEqual(table.agbd.dtype, np.float32)
+
+  def test_no_beams_write_a_table_without_columns(self):
+    for output_format in ('parquet', 'arrow'):
+      path = os.path.join(self.output_dir, 'none.' + output_format)
+      with gedi_lib.open_table_writer(path, output_format):
+        pass
+
+      self.assertTrue(gedi_lib.read_table(path, None).empty)
+
+  def test_schema_of_first_non_empty_beam(self):
+    for output_format in ('parquet', 'arrow'):
+      path = os.path.join(self.output_dir, 'rows.' + output_format)
+      with gedi_lib.open_table_writer(path, output_format) as writer:
+        writer.write(pd.DataFrame({'agbd': pd.Series([], dtype=object)}))
+        writer.write(pd.DataFrame({'agbd': np.array([1.5], np.float32)}))
+        writer.write(pd.DataFrame({'agbd': pd.Series([None], dtype=object)}))
+
+      table = gedi_lib.read_table(path, None)
+      self.assertEqual(table.agbd.dtype, np.float32)
+      np.testing.assert_array_equal(table.agbd, [1.5, np.nan])
+
+  def test_extraction_without_shots_in_bbox(self):
+    input_path = gedi_synthetic.write_orbit(
+        os.path.join(self.output_dir, 'orbit'), 100, 0, None)[1]
+    shot_filter = gedi_lib.ShotFilter(bbox=(0, 0, 1, 1))
+    for output_format in ('parquet', 'arrow'):
+      path = os.path.join(self.output_dir, 'l2b.' + output_format)
+      gedi_extract_l2b.extract_values([input_path], path, output_format,
+                                      shot_filter=shot_filter)
+
+      table = gedi_lib.read_table(path, None)
+      self.assertEmpty(table)
+      self.assertIn('cover', table.columns)
+      self.assertIn('shot_number', table.columns)
+
+
+if __name__ == '__main__':
+  absltest.main()
@@ -0,0 +1,181 @@
+# Copyright 2020 The Google Earth Engine Community Authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Size estimates of the monthly raster exports, made without EE requests.
+
+For every grid cell, plan_exports estimates the number of shots going into
+its export from the ground track segments in a gedi_catalog, and the number
+of output pixels from the cell's buffered box at the export scale. With
+--plan_output the rasterize scripts write these estimates to a CSV file,
+largest exports first, instead of starting exports; otherwise, if a catalog
+is given, they use the plan to start the largest exports first.
+
+EECU estimates are only added if --eecu_per_million_shots or
+--eecu_per_gigapixel are set, e.g. from the usage of earlier exports.
+"""
+
+import csv
+import math
+import statistics
+from typing import Optional
+
+from absl import flags
+from absl import logging
+import attr
+import numpy as np
+
+import gedi_catalog
+import gedi_grid
+import gedi_lib
+import gedi_spatial_index
+
+PLAN_OUTPUT = flags.DEFINE_string(
+    'plan_output', None,
+    'If set, the estimated size of every export is written to this CSV file '
+    'and no exports are started. Needs --gedi_catalog.')
+
+EECU_PER_MILLION_SHOTS = flags.DEFINE_float(
+    'eecu_per_million_shots', None,
+    'EECU-seconds per million input shots, for the EECU estimates.')
+
+EECU_PER_GIGAPIXEL = flags.DEFINE_float(
+    'eecu_per_gigapixel', None,
+    'EECU-seconds per billion output pixels times bands, for the EECU '
+    'estimates.')
+
+# Exports with this many times the median shot count are logged as
+# candidates for splitting.
+_OUTLIER_FACTOR = 10
+
+
+@attr.s
+class ExportPlan:
+  """Estimated size of the export of one grid cell."""
+  grid_id: int = attr.ib()
+  num_tables: int = attr.ib()
+  num_shots: int = attr.ib()
+  num_pixels: int = attr.ib()
+  num_bands: int = attr.ib()
+  eecu_seconds: Optional[float] = attr.ib(default=None)
+
+
+def estimate_pixels(cell: gedi_grid.GridCell) -> int:
+  """Returns the pixel count of the export region of a grid cell.
+
+  The region is approximated by its extent in meters at the latitude
+  closest to the equator, where it is widest.
+  """
+  min_lon, min_lat, max_lon, max_lat = cell.buffered_bounds(
+      gedi_lib.GRID_CELL_BUFFER)
+  widest_lat = 0 if min_lat <= 0 <= max_lat else min(abs(min_lat),
+                                                     abs(max_lat))
+  width = ((max_lon - min_lon) * gedi_grid.METERS_PER_DEGREE *
+           math.cos(math.radians(widest_lat)))
+  height = (max_lat - min_lat) * gedi_grid.METERS_PER_DEGREE
+  return (math.ceil(width / gedi_lib.EXPORT_SCALE) *
+          math.ceil(height / gedi_lib.EXPORT_SCALE))
+
+
+def _overlap(segments: np.ndarray,
+             box: tuple[float, float, float, float]) -> np.ndarray:
+  """Returns the fraction of every segment within box.
+
+  Segments are taken to be straight lines across their bounding boxes, so
+  the part within box is limited by both the longitude and the latitude
+  overlap.
+  """
+  fractions = []
+  for lo, hi in ((0, 2), (1, 3)):
+    extent = segments[:, hi] - segments[:, lo]
+    overlap = np.clip(
+        np.minimum(segments[:, hi], box[hi]) -
+        np.maximum(segments[:, lo], box[lo]), 0, None)
+    fractions.append(
+        np.divide(overlap, extent, out=np.ones_like(extent),
+                  where=extent > 0))
+  return np.minimum(*fractions)
+
+
+def plan_exports(catalog: gedi_catalog.Catalog,
+                 routes: dict[int, list[str]],
+                 grid_cells: dict[int, gedi_grid.GridCell],
+                 num_bands: int,
+                 eecu_per_million_shots: Optional[float] = None,
+                 eecu_per_gigapixel: Optional[float] = None
+                ) -> list[ExportPlan]:
+  """Estimates the size of the export of every routed grid cell.
+
+  Args:
+    catalog: catalog with the granules of the tables
+    routes: grid_id -> table asset ids, see gedi_spatial_index.route_tables
+    grid_cells: grid_id -> GridCell
+    num_bands: number of raster bands
+    eecu_per_million_shots: optional EECU-seconds per million shots
+    eecu_per_gigapixel: optional EECU-seconds per billion pixels times bands
+
+  Returns:
+    list of ExportPlans, largest first
+  """
+  segments = []
+  for table_asset_id in sorted(set().union(*routes.values())):
+    segments.extend(catalog.segment_shots(table_asset_id))
+  segments = np.array(segments, dtype=np.float64).reshape(-1, 5)
+  tree = gedi_spatial_index.STRTree(segments[:, :4])
+
+  plans = []
+  for grid_id, table_asset_ids in routes.items():
+    if not table_asset_ids:
+      continue
+    box = grid_cells[grid_id].buffered_bounds(gedi_lib.GRID_CELL_BUFFER)
+    hits = segments[tree.query(box)]
+    plan = ExportPlan(
+        grid_id=grid_id,
+        num_tables=len(table_asset_ids),
+        num_shots=int(round(np.sum(hits[:, 4] * _overlap(hits, box)))),
+        num_pixels=estimate_pixels(grid_cells[grid_id]),
+        num_bands=num_bands)
+    if eecu_per_million_shots is not None or eecu_per_gigapixel is not None:
+      plan.eecu_seconds = (
+          plan.num_shots / 1e6 * (eecu_per_million_shots or 0) +
+          plan.num_pixels * num_bands / 1e9 * (eecu_per_gigapixel or 0))
+    plans.append(plan)
+  plans.sort(key=lambda p: (p.num_shots, p.num_pixels), reverse=True)
+
+  if plans:
+    median = statistics.median(p.num_shots for p in plans)
+    for p in plans:
+      if median and p.num_shots > _OUTLIER_FACTOR * median:
+        logging.warning(
+            'Grid cell %d has %d shots, %.0f times the median; consider '
+            'splitting it', p.grid_id, p.num_shots, p.num_shots / median)
+    logging.info('%d exports, %d shots, %d pixels', len(plans),
+                 sum(p.num_shots for p in plans),
+                 sum(p.num_pixels for p in plans))
+  return plans
+
+
+def plan_from_flags(catalog: gedi_catalog.Catalog,
+                    routes: dict[int, list[str]],
+                    grid_cells: dict[int, gedi_grid.GridCell],
+                    num_bands: int) -> list[ExportPlan]:
+  return plan_exports(catalog, routes, grid_cells, num_bands,
+                      EECU_PER_MILLION_SHOTS.value, EECU_PER_GIGAPIXEL.value)
+
+
+def write_plan(plans: list[ExportPlan], output_path: str) -> None:
+  """Writes plans as CSV, in the given order."""
+  with open(output_path, 'w', newline='') as fh:
+    writer = csv.DictWriter(fh, [a.name for a in attr.fields(ExportPlan)])
+    writer.writeheader()
+    for p in plans:
+      writer.writerow(attr.asdict(p))
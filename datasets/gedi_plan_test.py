@@ -0,0 +1,144 @@
+# Copyright 2020 The Google Earth Engine Community Authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Tests for gedi_plan."""
+
+import csv
+import os
+import tempfile
+
+from absl.testing import absltest
+import h5py
+import numpy as np
+
+import gedi_catalog
+import gedi_grid
+import gedi_lib
+import gedi_plan
+
+_NAME = 'GEDI02_A_2019108002011_O01961_03_T03909_02_005_01_V002'
+_TABLE = 'users/a/gedi_l2a/' + _NAME
+# A table of a granule that is not cataloged.
+_UNKNOWN_TABLE = ('users/a/gedi_l2a/GEDI02_A_2019128120000_O02280_01_T01234_'
+                  '02_005_01_V002')
+
+
+def _cell(grid_id: int, min_lon: float, min_lat: float, max_lon: float,
+          max_lat: float) -> gedi_grid.GridCell:
+  return gedi_grid.GridCell(
+      grid_id=grid_id,
+      crs='EPSG:32614',
+      geometry={
+          'type': 'Polygon',
+          'coordinates': [[[min_lon, min_lat], [max_lon, min_lat],
+                           [max_lon, max_lat], [min_lon, max_lat],
+                           [min_lon, min_lat]]]
+      })
+
+
+class PlanExportsTest(absltest.TestCase):
+
+  def setUp(self):
+    super().setUp()
+    tmp_dir = self.enter_context(tempfile.TemporaryDirectory())
+    self.catalog = gedi_catalog.Catalog(os.path.join(tmp_dir, 'catalog.db'))
+    self.addCleanup(self.catalog.close)
+    # One beam going north at lon -100, in ten segments of 10 degrees.
+    self.lats = np.linspace(-50, 50, 100000)
+    path = os.path.join(tmp_dir, _NAME + '.h5')
+    with h5py.File(path, 'w') as hdf_fh:
+      beam = hdf_fh.create_group('BEAM0000')
+      beam['shot_number'] = np.arange(len(self.lats), dtype=np.uint64)
+      beam['lat_lowestmode'] = self.lats
+      beam['lon_lowestmode'] = np.full(len(self.lats), -100.0)
+    self.catalog.add_granules([path])
+    self.grid_cells = {
+        1: _cell(1, -101, -8, -99, -3),
+        2: _cell(2, -101, 5, -99, 25),
+        3: _cell(3, -90, 5, -88, 25),
+        4: _cell(4, -101, 60, -99, 65),
+    }
+
+  def _shots_in(self, grid_id):
+    _, min_lat, _, max_lat = self.grid_cells[grid_id].buffered_bounds(
+        gedi_lib.GRID_CELL_BUFFER)
+    return np.count_nonzero((self.lats >= min_lat) & (self.lats <= max_lat))
+
+  def test_estimates(self):
+    routes = {1: [_TABLE, _UNKNOWN_TABLE], 2: [_TABLE], 3: [_UNKNOWN_TABLE],
+              4: []}
+    plans = gedi_plan.plan_exports(
+        self.catalog, routes, self.grid_cells, 10,
+        eecu_per_million_shots=100, eecu_per_gigapixel=1)
+
+    # Largest first, without the cells that no table is routed to.
+    self.assertEqual([p.grid_id for p in plans], [2, 1, 3])
+    by_id = {p.grid_id: p for p in plans}
+    for grid_id in (1, 2):
+      self.assertAlmostEqual(
+          by_id[grid_id].num_shots, self._shots_in(grid_id), delta=2)
+    # No cataloged segment crosses cell 3.
+    self.assertEqual(by_id[3].num_shots, 0)
+    self.assertEqual([p.num_tables for p in plans], [1, 2, 1])
+    for p in plans:
+      self.assertEqual(p.num_bands, 10)
+      self.assertEqual(p.num_pixels,
+                       gedi_plan.estimate_pixels(self.grid_cells[p.grid_id]))
+      self.assertAlmostEqual(
+          p.eecu_seconds,
+          p.num_shots / 1e6 * 100 + p.num_pixels * 10 / 1e9)
+
+  def test_without_eecu_rates(self):
+    plans = gedi_plan.plan_exports(self.catalog, {1: [_TABLE]},
+                                   self.grid_cells, 10)
+    self.assertIsNone(plans[0].eecu_seconds)
+
+  def test_outliers_are_logged(self):
+    # 20 degrees of track against 1 degree in the other cells.
+    self.grid_cells[5] = _cell(5, -101, 30, -99, 31)
+    self.grid_cells[6] = _cell(6, -101, -20, -99, -19)
+    with self.assertLogs(logger='absl', level='WARNING') as logs:
+      gedi_plan.plan_exports(self.catalog, {2: [_TABLE], 5: [_TABLE],
+                                            6: [_TABLE]},
+                             self.grid_cells, 10)
+    self.assertLen(logs.output, 1)
+    self.assertIn('Grid cell 2 has', logs.output[0])
+
+  def test_estimate_pixels(self):
+    # 2 degrees at the equator.
+    equator = gedi_plan.estimate_pixels(_cell(1, 0, -1, 2, 1))
+    size = (2 * gedi_grid.METERS_PER_DEGREE + 2 * gedi_lib.GRID_CELL_BUFFER
+           ) / gedi_lib.EXPORT_SCALE
+    self.assertAlmostEqual(equator / size**2, 1, delta=0.01)
+    # About half as wide at 60 degrees, where the buffer takes more
+    # longitude.
+    north = gedi_plan.estimate_pixels(_cell(1, 0, 60, 2, 62))
+    self.assertAlmostEqual(north / equator, 0.5, delta=0.02)
+
+  def test_write_plan(self):
+    plans = gedi_plan.plan_exports(
+        self.catalog, {1: [_TABLE], 2: [_TABLE]}, self.grid_cells, 10)
+    output_path = os.path.join(
+        self.enter_context(tempfile.TemporaryDirectory()), 'plan.csv')
+    gedi_plan.write_plan(plans, output_path)
+
+    with open(output_path, newline='') as fh:
+      rows = list(csv.DictReader(fh))
+    self.assertEqual([int(r['grid_id']) for r in rows], [2, 1])
+    self.assertEqual([int(r['num_shots']) for r in rows],
+                     [p.num_shots for p in plans])
+    self.assertEqual(rows[0]['eecu_seconds'], '')
+
+
+if __name__ == '__main__':
+  absltest.main()
@@ -0,0 +1,100 @@
+# Copyright 2020 The Google Earth Engine Community Authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Exports one month of GEDI tables as rasters, one per UTM grid cell.
+
+This is the main loop of gedi_rasterize_l2a.py, gedi_rasterize_l2b.py and
+gedi_rasterize_l4a.py. With --gedi_catalog, tables are routed to the grid
+cells their ground tracks touch (see gedi_spatial_index.py) and the largest
+exports are started first, or only planned with --plan_output (see
+gedi_plan.py). The tasks are started by a gedi_tasks.TaskScheduler, and
+with --export_state cells whose last export is still valid are skipped
+(see gedi_export_state.py).
+"""
+
+import datetime
+from typing import Callable
+
+from absl import app
+from absl import logging
+
+import gedi_catalog
+import gedi_export_state
+import gedi_grid
+import gedi_lib
+import gedi_plan
+import gedi_spatial_index
+import gedi_tasks
+
+
+def rasterize_month(table_asset_ids: list[str], raster_collection: str,
+                    export_function: Callable[..., gedi_lib.ExportParameters],
+                    num_bands: int,
+                    grill_month: datetime.datetime) -> None:
+  """Exports the rasters of all grid cells for one month.
+
+  Args:
+    table_asset_ids: table asset ids of the month
+    raster_collection: image collection of the rasters
+    export_function: export_wrapper of a rasterize script
+    num_bands: number of raster bands, for the plan
+    grill_month: first day of the month to rasterize, see
+      gedi_lib.parse_month
+  """
+  start_id = 1  # First UTM grid cell id
+  grid_cells = gedi_grid.grid_cells_from_flags()
+  grid_cell_ids = list(
+      range(start_id, start_id + gedi_lib.NUM_UTM_GRID_CELLS.value))
+  catalog = gedi_catalog.catalog_from_flags()
+  if gedi_plan.PLAN_OUTPUT.value and catalog is None:
+    raise app.UsageError('--plan_output needs --gedi_catalog')
+  routes = None
+  if catalog is not None:
+    routes = gedi_spatial_index.route_tables(
+        catalog, table_asset_ids,
+        {k: cell.bounds for k, cell in grid_cells.items()})
+    plans = gedi_plan.plan_from_flags(catalog, routes, grid_cells, num_bands)
+    if gedi_plan.PLAN_OUTPUT.value:
+      gedi_plan.write_plan(plans, gedi_plan.PLAN_OUTPUT.value)
+      return
+    # Largest exports first, so that they do not hold up the end of the run.
+    rank = {p.grid_id: i for i, p in enumerate(plans)}
+    grid_cell_ids.sort(key=lambda k: rank.get(k, len(rank)))
+
+  scheduler = gedi_tasks.scheduler_from_flags()
+  export_state = gedi_export_state.state_from_flags()
+  if export_state is not None:
+    export_state.refresh(scheduler.backend)
+  for grid_cell_id in grid_cell_ids:
+    grid_cell = grid_cells[grid_cell_id]
+    cell_table_asset_ids = table_asset_ids
+    if routes is not None:
+      # Only the tables whose ground track passes over the grid cell.
+      cell_table_asset_ids = routes.get(grid_cell_id, [])
+      if not cell_table_asset_ids:
+        logging.info('No tables intersect grid cell %d', grid_cell_id)
+        continue
+    gedi_lib.rasterize_gedi_by_utm_zone(
+        cell_table_asset_ids,
+        gedi_lib.raster_asset_id(raster_collection, grid_cell_id),
+        grid_cell.feature(),
+        grill_month,
+        export_function,
+        overwrite=gedi_lib.ALLOW_GEDI_RASTERIZE_OVERWRITE.value,
+        crs=grid_cell.crs,
+        scheduler=scheduler,
+        export_state=export_state)
+  scheduler.run(wait=gedi_tasks.WAIT_FOR_TASKS.value)
+  if export_state is not None:
+    export_state.update_tasks(scheduler.records.values())
+    export_state.close()
@@ -13,13 +13,13 @@
 # limitations under the License.
 
 import datetime
-from typing import Any
+from typing import Any, Optional
 
 from absl import app
 
 import ee
-from google3.pyglib.function_utils import memoize
 import gedi_lib
+import gedi_rasterize
 
 
 # From https://lpdaac.usgs.gov/products/gedi02_av002/
@@ -59,7 +59,6 @@ INTEGER_PROPS = frozenset({
 })
 
 
-@memoize.Memoize()
 def get_raster_bands(band):
   return [band + str(count) for count in range(30)]
 
@@ -78,9 +77,13 @@ raster_bands = [
 int_bands = [p for p in raster_bands if p in INTEGER_PROPS]
 
 
+RASTER_COLLECTION = 'LARSE/GEDI/GEDI02_B_002_MONTHLY'
+
+
 def export_wrapper(table_asset_ids: list[str], raster_asset_id: str,
                    grid_cell_feature: Any, grill_month: datetime.datetime,
-                   overwrite: bool) -> gedi_lib.ExportParameters:
+                   overwrite: bool,
+                   crs: Optional[str] = None) -> gedi_lib.ExportParameters:
   """Creates an EE export job definition.
 
   Args:
@@ -89,6 +92,7 @@ def export_wrapper(table_asset_ids: list[str], raster_asset_id: str,
     grid_cell_feature: ee.Feature
     grill_month: grilled month
     overwrite: bool, if any of the assets can be replaced if they already exist
+    crs: crs of the grid cell, if known
 
   Returns:
     an ExportParameters object containing arguments for an export job.
@@ -100,28 +104,17 @@ def export_wrapper(table_asset_ids: list[str], raster_asset_id: str,
       int_bands=int_bands,
       grid_cell_feature=grid_cell_feature,
       grill_month=grill_month,
-      overwrite=overwrite)
+      overwrite=overwrite,
+      crs=crs)
 
 
 def main(argv):
-  start_id = 1  # First UTM grid cell id
   ee.Initialize()
-  raster_collection = 'LARSE/GEDI/GEDI02_B_002_MONTHLY'
-
-  for grid_cell_id in range(start_id,
-                            start_id + gedi_lib.NUM_UTM_GRID_CELLS.value):
-    grid_cell_feature = ee.Feature(
-        ee.FeatureCollection(
-            'users/yang/GEETables/GEDI/GEDI_UTM_GRIDS_LandOnly').filterMetadata(
-                'grid_id', 'equals', grid_cell_id).first())
-    with open(argv[1]) as fh:
-      gedi_lib.rasterize_gedi_by_utm_zone(
-          [x.strip() for x in fh],
-          raster_collection + '/' + '%03d' % grid_cell_id,
-          grid_cell_feature,
-          argv[2],
-          export_wrapper,
-          overwrite=gedi_lib.ALLOW_GEDI_RASTERIZE_OVERWRITE.value)
+  with open(argv[1]) as fh:
+    table_asset_ids = [x.strip() for x in fh]
+  gedi_rasterize.rasterize_month(table_asset_ids, RASTER_COLLECTION,
+                                 export_wrapper, len(raster_bands),
+                                 gedi_lib.parse_month(argv[2]))
 
 
 if __name__ == '__main__':
@@ -0,0 +1,58 @@
+# Copyright 2020 The Google Earth Engine Community Authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Tests for gedi_rasterize_l4a."""
+
+from absl.testing import absltest
+
+import gedi_rasterize_l4a
+
+# The bands of the L4A rasters, in the order of the variable lists that
+# gedi_extract_l4a had before gedi_schema.
+_SHOT_VARIABLES = (
+    'agbd', 'agbd_pi_lower', 'agbd_pi_upper', 'agbd_se', 'agbd_t',
+    'agbd_t_se', 'algorithm_run_flag', 'beam', 'channel', 'degrade_flag',
+    'delta_time', 'elev_lowestmode', 'l2_quality_flag', 'l4_quality_flag',
+    'lat_lowestmode', 'lon_lowestmode', 'master_frac', 'master_int',
+    'predictor_limit_flag', 'response_limit_flag', 'selected_algorithm',
+    'selected_mode', 'selected_mode_flag', 'sensitivity', 'solar_elevation',
+    'surface_flag')
+_ALGORITHMS = ('a1', 'a10', 'a2', 'a3', 'a4', 'a5', 'a6')
+_AGBD_PREDICTION = tuple(
+    '%s_%s' % (v, a) for v in (
+        'agbd', 'agbd_pi_lower', 'agbd_pi_upper', 'agbd_se', 'agbd_t',
+        'agbd_t_pi_lower', 'agbd_t_pi_upper', 'agbd_t_se',
+        'algorithm_run_flag', 'l2_quality_flag', 'l4_quality_flag',
+        'predictor_limit_flag', 'response_limit_flag', 'selected_mode',
+        'selected_mode_flag') for a in _ALGORITHMS)
+_GEOLOCATION = tuple(
+    '%s_%s' % (v, a)
+    for v in ('elev_lowestmode', 'lat_lowestmode', 'lon_lowestmode',
+              'sensitivity')
+    for a in _ALGORITHMS) + ('stale_return_flag',)
+_LAND_COVER_DATA = (
+    'landsat_treecover', 'landsat_water_persistence', 'leaf_off_doy',
+    'leaf_off_flag', 'leaf_on_cycle', 'leaf_on_doy', 'pft_class',
+    'region_class', 'urban_focal_window_size', 'urban_proportion')
+
+
+class BandsTest(absltest.TestCase):
+
+  def test_bands_unchanged(self):
+    self.assertEqual(
+        gedi_rasterize_l4a.INTEGER_PROPS,
+        _SHOT_VARIABLES + _AGBD_PREDICTION + _GEOLOCATION + _LAND_COVER_DATA)
+
+
+if __name__ == '__main__':
+  absltest.main()
@@ -0,0 +1,293 @@
+# Copyright 2020 The Google Earth Engine Community Authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Rasterizes extracted GEDI tables locally, like gedi_lib.create_export.
+
+Usage: gedi_rasterize_local.py <product> <tables> <month> <output dir>
+
+product is l2a, l2b or l4a, and month is YYYY-MM. tables is a directory or
+a file listing paths of the CSV, Parquet or Arrow files written by
+gedi_extract_*.
+
+For every UTM grid cell (or the ones in --grid_ids) this does what the EE
+export of the monthly rasters does: it takes the shots of the month within
+the cell's bounding box buffered by 2.5 km, projects them to the cell's UTM
+CRS and keeps the highest sensitivity shot of every 25 m pixel. Pixels are
+aligned to the origin of the CRS, as in EE. Each cell is written as
+<grid id>.tif with the float64 bands and <grid id>_int.tif with the int32
+bands (truncated like ee.Image.toInt). Both are tiled, compressed GeoTIFFs,
+empty pixels are nodata.
+
+This needs pyproj and GDAL, and uses EE only to look up the grid cells (see
+gedi_grid.py). With --gedi_catalog only the tables whose ground track
+touches a cell are read, and with --grid_ids only the shots within the
+buffered bounds of the selected cells are kept.
+"""
+
+import math
+import os
+
+from absl import app
+from absl import flags
+from absl import logging
+import attr
+import numpy as np
+import pandas as pd
+import pyproj
+
+import gedi_catalog
+import gedi_grid
+import gedi_lib
+import gedi_rasterize_l2a
+import gedi_rasterize_l2b
+import gedi_rasterize_l4a
+import gedi_spatial_index
+
+GRID_IDS = flags.DEFINE_list(
+    'grid_ids', None, 'Grid cells to rasterize; all of them by default.')
+
+# Product -> (raster bands, int bands), as passed to create_export.
+_BANDS = {
+    'l2a': (gedi_rasterize_l2a.raster_bands, gedi_rasterize_l2a.int_bands),
+    'l2b': (gedi_rasterize_l2b.raster_bands, gedi_rasterize_l2b.int_bands),
+    'l4a': (gedi_rasterize_l4a.INTEGER_PROPS,
+            gedi_rasterize_l4a.INTEGER_PROPS),
+}
+
+SCALE = gedi_lib.EXPORT_SCALE
+
+# Points per edge of the buffered box when projecting it to the UTM CRS.
+_EDGE_POINTS = 100
+# Pixels per side of the blocks written at a time.
+_WRITE_TILE = 4096
+
+_INT_NODATA = np.iinfo(np.int32).min
+_CREATION_OPTIONS = [
+    'TILED=YES', 'BLOCKXSIZE=512', 'BLOCKYSIZE=512', 'COMPRESS=DEFLATE',
+    'BIGTIFF=IF_SAFER', 'SPARSE_OK=TRUE'
+]
+
+
+@attr.s(frozen=True)
+class PixelGrid:
+  """The 25 m pixel grid of a raster."""
+  crs: str = attr.ib()
+  # Upper left corner, in CRS units.
+  x0: float = attr.ib()
+  y0: float = attr.ib()
+  width: int = attr.ib()
+  height: int = attr.ib()
+
+  @property
+  def geotransform(self) -> tuple[float, ...]:
+    return (self.x0, SCALE, 0, self.y0, 0, -SCALE)
+
+
+def pixel_grid(cell: gedi_grid.GridCell,
+               box: tuple[float, float, float, float]) -> PixelGrid:
+  """Returns the pixel grid covering box in the cell's CRS."""
+  min_lon, min_lat, max_lon, max_lat = box
+  t = np.linspace(0, 1, _EDGE_POINTS)
+  lons = np.concatenate([
+      min_lon + (max_lon - min_lon) * t, np.full(_EDGE_POINTS, max_lon),
+      max_lon - (max_lon - min_lon) * t, np.full(_EDGE_POINTS, min_lon)
+  ])
+  lats = np.concatenate([
+      np.full(_EDGE_POINTS, min_lat), min_lat + (max_lat - min_lat) * t,
+      np.full(_EDGE_POINTS, max_lat), max_lat - (max_lat - min_lat) * t
+  ])
+  transformer = pyproj.Transformer.from_crs(
+      'EPSG:4326', cell.crs, always_xy=True)
+  x, y = transformer.transform(lons, lats)
+  x0 = math.floor(x.min() / SCALE) * SCALE
+  y0 = math.ceil(y.max() / SCALE) * SCALE
+  return PixelGrid(
+      crs=cell.crs,
+      x0=x0,
+      y0=y0,
+      width=math.ceil((x.max() - x0) / SCALE),
+      height=math.ceil((y0 - y.min()) / SCALE))
+
+
+def select_shots(shots: pd.DataFrame,
+                 grid: PixelGrid) -> tuple[np.ndarray, np.ndarray]:
+  """Picks the highest sensitivity shot of every pixel.
+
+  Args:
+    shots: shots with lat_lowestmode, lon_lowestmode and sensitivity
+    grid: pixel grid
+
+  Returns:
+    (flat pixel indices, row positions in shots) of the picked shots
+  """
+  transformer = pyproj.Transformer.from_crs(
+      'EPSG:4326', grid.crs, always_xy=True)
+  x, y = transformer.transform(shots.lon_lowestmode.to_numpy(),
+                               shots.lat_lowestmode.to_numpy())
+  col = np.floor((x - grid.x0) / SCALE).astype(np.int64)
+  row = np.floor((grid.y0 - y) / SCALE).astype(np.int64)
+  inside = np.flatnonzero((col >= 0) & (col < grid.width) & (row >= 0) &
+                          (row < grid.height))
+  pixels = row[inside] * grid.width + col[inside]
+  # Shots without sensitivity come last, as in the descending EE sort.
+  sensitivity = np.nan_to_num(
+      shots.sensitivity.to_numpy(dtype=np.float64)[inside], nan=-np.inf)
+  order = np.lexsort((-sensitivity, pixels))
+  _, first = np.unique(pixels[order], return_index=True)
+  picked = order[first]
+  return pixels[picked], inside[picked]
+
+
+def write_geotiff(path: str, grid: PixelGrid, bands: dict[str, np.ndarray],
+                  pixels: np.ndarray, dtype: np.dtype,
+                  metadata: dict[str, str]) -> None:
+  """Writes band values at flat pixel indices into a tiled GeoTIFF.
+
+  Only the blocks that have pixels are written; the rest stay empty.
+
+  Args:
+    path: output file path
+    grid: pixel grid of the file
+    bands: band name -> values, aligned with pixels
+    pixels: flat pixel indices, row * width + col
+    dtype: np.float64 or np.int32
+    metadata: GeoTIFF metadata items
+  """
+  # GDAL is only needed to write the files.
+  from osgeo import gdal  # pylint: disable=g-import-not-at-top
+  from osgeo import osr  # pylint: disable=g-import-not-at-top
+
+  is_int = np.issubdtype(dtype, np.integer)
+  nodata = _INT_NODATA if is_int else np.nan
+  ds = gdal.GetDriverByName('GTiff').Create(
+      path, grid.width, grid.height, len(bands),
+      gdal.GDT_Int32 if is_int else gdal.GDT_Float64,
+      options=_CREATION_OPTIONS)
+  ds.SetGeoTransform(grid.geotransform)
+  srs = osr.SpatialReference()
+  srs.SetFromUserInput(grid.crs)
+  ds.SetProjection(srs.ExportToWkt())
+  ds.SetMetadata(metadata)
+
+  rows, cols = np.divmod(pixels, grid.width)
+  tiles_per_row = math.ceil(grid.width / _WRITE_TILE)
+  tiles = rows // _WRITE_TILE * tiles_per_row + cols // _WRITE_TILE
+  order = np.argsort(tiles, kind='stable')
+  tile_ids, starts = np.unique(tiles[order], return_index=True)
+  for i, (name, values) in enumerate(bands.items()):
+    band = ds.GetRasterBand(i + 1)
+    band.SetDescription(name)
+    band.SetNoDataValue(float(nodata))
+    for tile_id, in_tile in zip(tile_ids, np.split(order, starts[1:])):
+      yoff = tile_id // tiles_per_row * _WRITE_TILE
+      xoff = tile_id % tiles_per_row * _WRITE_TILE
+      block = np.full((min(_WRITE_TILE, grid.height - yoff),
+                       min(_WRITE_TILE, grid.width - xoff)), nodata, dtype)
+      block[rows[in_tile] - yoff, cols[in_tile] - xoff] = values[in_tile]
+      band.WriteArray(block, xoff, yoff)
+  ds.FlushCache()
+  ds = None
+
+
+def rasterize_cell(shots: pd.DataFrame, cell: gedi_grid.GridCell,
+                   raster_bands: list[str], int_bands: list[str],
+                   output_prefix: str, metadata: dict[str, str]) -> int:
+  """Rasterizes the shots of one grid cell.
+
+  Args:
+    shots: shots of the month, see gedi_lib.read_month
+    cell: grid cell
+    raster_bands: bands to write
+    int_bands: bands written as int32
+    output_prefix: output path without .tif
+    metadata: GeoTIFF metadata items
+
+  Returns:
+    number of pixels with a shot
+  """
+  box = cell.buffered_bounds(gedi_lib.GRID_CELL_BUFFER)
+  shots = shots[shots.lon_lowestmode.between(box[0], box[2]) &
+                shots.lat_lowestmode.between(box[1], box[3])]
+  if shots.empty:
+    return 0
+  grid = pixel_grid(cell, box)
+  pixels, picked = select_shots(shots, grid)
+  picked_shots = shots.iloc[picked]
+
+  float_bands = [b for b in raster_bands if b not in int_bands]
+  int_bands = [b for b in raster_bands if b in int_bands]
+  # Nullable integer columns have NA rather than NaN for missing values.
+  band_values = {
+      b: picked_shots[b].to_numpy(dtype=np.float64, na_value=np.nan)
+      for b in raster_bands
+  }
+  if float_bands:
+    write_geotiff(output_prefix + '.tif', grid,
+                  {b: band_values[b] for b in float_bands}, pixels,
+                  np.float64, metadata)
+  if int_bands:
+    bands = {}
+    for b in int_bands:
+      values = np.trunc(band_values[b])
+      bands[b] = np.where(np.isnan(values), _INT_NODATA,
+                          values).astype(np.int32)
+    write_geotiff(output_prefix + '_int.tif', grid, bands, pixels, np.int32,
+                  metadata)
+  return len(pixels)
+
+
+def main(argv):
+  raster_bands, int_bands = _BANDS[argv[1]]
+  raster_bands, int_bands = list(raster_bands), list(int_bands)
+  table_paths = gedi_lib.list_tables(argv[2])
+  month_start = gedi_lib.parse_month(argv[3])
+  output_dir = argv[4]
+  os.makedirs(output_dir, exist_ok=True)
+
+  grid_cells = gedi_grid.grid_cells_from_flags()
+  cell_bounds = None
+  if GRID_IDS.value:
+    grid_cells = {int(k): grid_cells[int(k)] for k in GRID_IDS.value}
+    # Only the shots the selected cells can use are kept in memory.
+    cell_bounds = [
+        cell.buffered_bounds(gedi_lib.GRID_CELL_BUFFER)
+        for cell in grid_cells.values()
+    ]
+  catalog = gedi_catalog.catalog_from_flags()
+  if catalog is not None:
+    routes = gedi_spatial_index.route_tables(
+        catalog, table_paths,
+        {
+            k: cell.buffered_bounds(gedi_lib.GRID_CELL_BUFFER)
+            for k, cell in grid_cells.items()
+        },
+        margin=0)
+    table_paths = sorted(set().union(*routes.values()))
+
+  shots = gedi_lib.read_month(table_paths, raster_bands, month_start,
+                              cell_bounds)
+  logging.info('%d shots in %d tables', len(shots), len(table_paths))
+  metadata = {
+      'month': str(month_start.month),
+      'year': str(month_start.year),
+      'num_tables': str(len(table_paths)),
+  }
+  for grid_id, cell in sorted(grid_cells.items()):
+    num_pixels = rasterize_cell(shots, cell, raster_bands, int_bands,
+                                os.path.join(output_dir, '%03d' % grid_id),
+                                metadata)
+    logging.info('Grid cell %d: %d pixels', grid_id, num_pixels)
+
+
+if __name__ == '__main__':
+  app.run(main)
@@ -0,0 +1,166 @@
+# Copyright 2020 The Google Earth Engine Community Authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Tests for gedi_rasterize_local."""
+
+import datetime
+import os
+import tempfile
+
+from absl.testing import absltest
+import numpy as np
+import pandas as pd
+import pyproj
+import pytz
+
+import gedi_grid
+import gedi_lib
+import gedi_rasterize_local
+
+try:
+  from osgeo import gdal  # pylint: disable=g-import-not-at-top
+except ImportError:
+  gdal = None
+
+_MONTH = pytz.utc.localize(datetime.datetime(2020, 5, 1))
+_CELL = gedi_grid.GridCell(
+    grid_id=7,
+    crs='EPSG:32610',
+    geometry={
+        'type': 'Polygon',
+        'coordinates': [[[-122.5, 37.5], [-122.45, 37.5], [-122.45, 37.55],
+                         [-122.5, 37.55], [-122.5, 37.5]]]
+    })
+_FLOAT_BANDS = ['rh98', 'sensitivity']
+_INT_BANDS = ['num_detectedmodes']
+
+
+def _shots(rng: np.random.Generator, num_shots: int,
+           box: tuple[float, float, float, float]) -> pd.DataFrame:
+  """Returns random shots of _MONTH within box."""
+  min_lon, min_lat, max_lon, max_lat = box
+  start = gedi_lib.gedi_deltatime_epoch(_MONTH)
+  sensitivity = rng.uniform(0.8, 1, num_shots)
+  sensitivity[rng.random(num_shots) < 0.1] = np.nan
+  # A nullable integer column, as the schema decodes flags with fill values.
+  num_detectedmodes = pd.arrays.IntegerArray(
+      rng.integers(0, 10, num_shots).astype(np.uint8),
+      rng.random(num_shots) < 0.1)
+  return pd.DataFrame({
+      'lon_lowestmode': rng.uniform(min_lon, max_lon, num_shots),
+      'lat_lowestmode': rng.uniform(min_lat, max_lat, num_shots),
+      'delta_time': start + rng.uniform(0, 86400 * 28, num_shots),
+      'sensitivity': sensitivity,
+      'rh98': rng.uniform(0, 50, num_shots),
+      'num_detectedmodes': num_detectedmodes,
+  })
+
+
+class ReadMonthTest(absltest.TestCase):
+
+  def test_keeps_shots_within_bounds(self):
+    rng = np.random.default_rng(0)
+    shots = _shots(rng, 1000, (-123, 37, -122, 38))
+    # Not in the month.
+    shots.loc[:9, 'delta_time'] -= 86400 * 60
+    table_dir = self.enter_context(tempfile.TemporaryDirectory())
+    paths = []
+    for i, part in enumerate(np.array_split(shots, 2)):
+      paths.append(os.path.join(table_dir, '%d.parquet' % i))
+      part.to_parquet(paths[-1], index=False)
+    bounds = [(-123, 37, -122.8, 37.2), (-122.3, 37.7, -122, 38)]
+
+    actual = gedi_lib.read_month(paths, ['rh98'], _MONTH, bounds)
+
+    expected = shots.iloc[10:]
+    expected = expected[
+        (expected.lon_lowestmode.between(-123, -122.8) &
+         expected.lat_lowestmode.between(37, 37.2)) |
+        (expected.lon_lowestmode.between(-122.3, -122) &
+         expected.lat_lowestmode.between(37.7, 38))]
+    self.assertNotEmpty(actual)
+    np.testing.assert_array_equal(actual.rh98, expected.rh98)
+    self.assertLen(gedi_lib.read_month(paths, ['rh98'], _MONTH), 990)
+
+
+class RasterizeLocalTest(absltest.TestCase):
+
+  def setUp(self):
+    super().setUp()
+    self.box = _CELL.buffered_bounds(gedi_lib.GRID_CELL_BUFFER)
+    self.grid = gedi_rasterize_local.pixel_grid(_CELL, self.box)
+    # Dense enough that many pixels have several shots.
+    rng = np.random.default_rng(1)
+    min_lon, min_lat, _, _ = self.box
+    self.shots = _shots(rng, 20000,
+                        (min_lon, min_lat, min_lon + 0.003, min_lat + 0.003))
+
+  def test_select_shots_picks_highest_sensitivity(self):
+    pixels, picked = gedi_rasterize_local.select_shots(self.shots, self.grid)
+
+    transformer = pyproj.Transformer.from_crs(
+        'EPSG:4326', _CELL.crs, always_xy=True)
+    x, y = transformer.transform(self.shots.lon_lowestmode.to_numpy(),
+                                 self.shots.lat_lowestmode.to_numpy())
+    scale = gedi_rasterize_local.SCALE
+    row = np.floor((self.grid.y0 - y) / scale).astype(np.int64)
+    col = np.floor((x - self.grid.x0) / scale).astype(np.int64)
+    expected = pd.DataFrame({
+        'pixel': row * self.grid.width + col,
+        'sensitivity': self.shots.sensitivity.fillna(-np.inf),
+    }).groupby('pixel').sensitivity.max()
+    self.assertGreater(len(self.shots), 2 * len(expected))
+    np.testing.assert_array_equal(pixels, expected.index)
+    np.testing.assert_array_equal(
+        self.shots.sensitivity.fillna(-np.inf).to_numpy()[picked],
+        expected.to_numpy())
+
+  @absltest.skipIf(gdal is None, 'needs GDAL')
+  def test_writes_picked_shots(self):
+    output_prefix = os.path.join(
+        self.enter_context(tempfile.TemporaryDirectory()), '007')
+    num_pixels = gedi_rasterize_local.rasterize_cell(
+        self.shots, _CELL, _FLOAT_BANDS + _INT_BANDS, _INT_BANDS,
+        output_prefix, {'month': '5'})
+
+    pixels, picked = gedi_rasterize_local.select_shots(self.shots, self.grid)
+    self.assertEqual(num_pixels, len(pixels))
+    rows, cols = np.divmod(pixels, self.grid.width)
+    picked_shots = self.shots.iloc[picked]
+    for path, bands in ((output_prefix + '.tif', _FLOAT_BANDS),
+                        (output_prefix + '_int.tif', _INT_BANDS)):
+      ds = gdal.Open(path)
+      self.assertEqual(ds.GetGeoTransform(), self.grid.geotransform)
+      self.assertEqual((ds.RasterXSize, ds.RasterYSize),
+                       (self.grid.width, self.grid.height))
+      self.assertEqual(ds.GetMetadataItem('month'), '5')
+      for i, band in enumerate(bands):
+        values = ds.GetRasterBand(i + 1).ReadAsArray()
+        self.assertEqual(ds.GetRasterBand(i + 1).GetDescription(), band)
+        expected = picked_shots[band].to_numpy(
+            dtype=np.float64, na_value=np.nan)
+        empty = np.ones(values.shape, dtype=bool)
+        empty[rows, cols] = False
+        if band in _INT_BANDS:
+          nodata = np.iinfo(np.int32).min
+          np.testing.assert_array_equal(
+              values[rows, cols],
+              np.where(np.isnan(expected), nodata, np.trunc(expected)))
+          self.assertTrue(np.all(values[empty] == nodata))
+        else:
+          np.testing.assert_array_equal(values[rows, cols], expected)
+          self.assertTrue(np.all(np.isnan(values[empty])))
+
+
+if __name__ == '__main__':
+  absltest.main()
@@ -0,0 +1,368 @@
+# Copyright 2020 The Google Earth Engine Community Authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Variables extracted from the GEDI L2A, L2B and L4A products.
+
+Every variable is listed once with its HDF path (relative to the BEAMxxxx
+group), its output column name, its dtype and the sentinel that marks missing
+values in addition to the dataset's own _FillValue attribute. Each variable is
+compiled once into a Decoder that masks infinities and fill values with
+vectorized numpy operations at read time.
+
+The column order of the extracted tables is the order of the variables here.
+"""
+
+from typing import Optional, Union
+
+from absl import logging
+import attr
+import numpy as np
+import pandas as pd
+
+# Pseudo-dtype of fixed-width byte strings decoded into str columns.
+STRING = 'string'
+
+
+@attr.s(frozen=True)
+class Variable:
+  """A GEDI dataset and the output column(s) it is decoded into."""
+  hdf_path: str = attr.ib()
+  dtype: str = attr.ib()
+  # Value that marks missing data, in addition to the _FillValue attribute.
+  fill_value: Optional[Union[int, float]] = attr.ib(default=None)
+  # Output column name; defaults to the last component of hdf_path.
+  name: Optional[str] = attr.ib(default=None)
+  # For 2-D datasets, the number of columns, named f'{name}{i}'.
+  num_columns: int = attr.ib(default=0)
+
+  @property
+  def output_name(self) -> str:
+    return self.name or self.hdf_path.split('/')[-1]
+
+  @property
+  def column_names(self) -> list[str]:
+    if not self.num_columns:
+      return [self.output_name]
+    return [f'{self.output_name}{i}' for i in range(self.num_columns)]
+
+
+class Decoder:
+  """Turns raw dataset values into output columns for one Variable."""
+
+  def __init__(self, variable: Variable):
+    self.variable = variable
+    self.column_names = variable.column_names
+    self._dtype = None if variable.dtype == STRING else np.dtype(
+        variable.dtype)
+    self._fill_values = (
+        [] if variable.fill_value is None else [variable.fill_value])
+    self._warned = False
+
+  def _cast(self, values: np.ndarray) -> np.ndarray:
+    """Casts to the declared dtype unless that would lose information."""
+    if values.dtype == self._dtype:
+      return values
+    if np.can_cast(values.dtype, self._dtype, 'safe'):
+      return values.astype(self._dtype)
+    if not self._warned:
+      logging.warning('%s is stored as %s, not %s; keeping the stored type',
+                      self.variable.hdf_path, values.dtype, self._dtype)
+      self._warned = True
+    return values
+
+  def decode(self, values: np.ndarray,
+             attr_fill_value=None) -> dict[str, object]:
+    """Decodes the values read from the dataset.
+
+    Args:
+      values: array read from the dataset, 1-D or 2-D
+      attr_fill_value: the dataset's _FillValue attribute, if any
+
+    Returns:
+      dict from output column name to a numpy or pandas array
+    """
+    if self._dtype is None:
+      return {self.column_names[0]: decode_strings(values)}
+
+    fill_values = self._fill_values
+    if attr_fill_value is not None:
+      fill_values = fill_values + [attr_fill_value]
+    values = self._cast(values)
+    mask = None
+    for fill_value in fill_values:
+      fill_mask = values == fill_value
+      mask = fill_mask if mask is None else mask | fill_mask
+
+    if np.issubdtype(values.dtype, np.floating):
+      invalid = ~np.isfinite(values)
+      mask = invalid if mask is None else mask | invalid
+      if mask.any():
+        if not values.flags.writeable:
+          values = values.copy()
+        values[mask] = np.nan
+      return self._columns(values)
+
+    if mask is None or not np.issubdtype(values.dtype, np.integer):
+      return self._columns(values)
+    # A masked integer array keeps the column integral while still
+    # representing fill values as nulls (np.nan would turn it into floats).
+    if values.ndim == 1:
+      return {self.column_names[0]: pd.arrays.IntegerArray(values, mask)}
+    return {
+        name: pd.arrays.IntegerArray(values[:, i], mask[:, i])
+        for i, name in enumerate(self.column_names)
+    }
+
+  def _columns(self, values: np.ndarray) -> dict[str, np.ndarray]:
+    if values.ndim == 1:
+      return {self.column_names[0]: values}
+    return {name: values[:, i] for i, name in enumerate(self.column_names)}
+
+
+def decode_strings(values: np.ndarray) -> np.ndarray:
+  """Decodes an array of byte strings in bulk.
+
+  Fixed-width strings are converted with a single numpy cast, which decodes
+  ASCII without a Python-level loop; UTF-8 is used as a fallback.
+
+  Args:
+    values: array of fixed-width (S) or variable-length (object) byte strings
+
+  Returns:
+    numpy array of str
+  """
+  if values.dtype.kind == 'S':
+    try:
+      return values.astype(np.str_)
+    except UnicodeDecodeError:
+      return np.char.decode(values, 'utf-8')
+  return np.array([x.decode() if isinstance(x, bytes) else x for x in values],
+                  dtype=object)
+
+
+def compile_variables(variables: tuple[Variable, ...]) -> tuple[Decoder, ...]:
+  return tuple(Decoder(v) for v in variables)
+
+
+_ALGORITHMS = ('a1', 'a10', 'a2', 'a3', 'a4', 'a5', 'a6')
+
+
+def _per_algorithm(group: str, name: str, dtype: str,
+                   fill_value=None) -> tuple[Variable, ...]:
+  return tuple(
+      Variable(f'{group}/{name}_{a}', dtype, fill_value)
+      for a in _ALGORITHMS)
+
+
+L2A = (
+    Variable('beam', 'uint16'),
+    Variable('degrade_flag', 'uint8'),
+    Variable('delta_time', 'float64'),
+    Variable('digital_elevation_model', 'float32'),
+    Variable('digital_elevation_model_srtm', 'float32'),
+    Variable('elev_highestreturn', 'float32'),
+    Variable('elev_lowestmode', 'float32'),
+    Variable('elevation_bias_flag', 'uint8'),
+    Variable('energy_total', 'float32'),
+
+    Variable('land_cover_data/landsat_treecover', 'float64'),
+    Variable('land_cover_data/landsat_water_persistence', 'uint8'),
+    Variable('land_cover_data/leaf_off_doy', 'int16'),
+    Variable('land_cover_data/leaf_off_flag', 'uint8'),
+    Variable('land_cover_data/leaf_on_cycle', 'uint8'),
+    Variable('land_cover_data/leaf_on_doy', 'int16'),
+    Variable('land_cover_data/modis_nonvegetated', 'float64'),
+    Variable('land_cover_data/modis_nonvegetated_sd', 'float64'),
+    Variable('land_cover_data/modis_treecover', 'float64'),
+    Variable('land_cover_data/modis_treecover_sd', 'float64'),
+    Variable('land_cover_data/pft_class', 'uint8'),
+    Variable('land_cover_data/region_class', 'uint8'),
+    Variable('land_cover_data/urban_focal_window_size', 'uint8'),
+    Variable('land_cover_data/urban_proportion', 'uint8'),
+
+    Variable('lat_highestreturn', 'float64'),
+    Variable('lat_lowestmode', 'float64'),
+    Variable('lon_highestreturn', 'float64'),
+    Variable('lon_lowestmode', 'float64'),
+
+    Variable('num_detectedmodes', 'uint8'),
+    Variable('quality_flag', 'uint8'),
+
+    Variable('selected_algorithm', 'uint8'),
+    Variable('selected_mode', 'uint8'),
+    Variable('selected_mode_flag', 'uint8'),
+
+    Variable('sensitivity', 'float32'),
+    Variable('solar_azimuth', 'float32'),
+    Variable('solar_elevation', 'float32'),
+    Variable('surface_flag', 'uint8'),
+
+    Variable('shot_number', 'uint64'),
+
+    # Relative heights for percentiles 0 to 100.
+    Variable('rh', 'float32', num_columns=101),
+)
+
+# L2B variables appended to the L2A table.
+L2B_FOR_L2A = (
+    Variable('geolocation/local_beam_azimuth', 'float32'),
+    Variable('geolocation/local_beam_elevation', 'float32'),
+)
+
+L2B = (
+    Variable('cover', 'float32'),
+    Variable('pai', 'float32'),
+    Variable('fhd_normal', 'float32'),
+    Variable('pgap_theta', 'float32'),
+    Variable('beam', 'uint16'),
+    Variable('shot_number', 'uint64'),
+    Variable('l2b_quality_flag', 'uint8'),
+    Variable('algorithmrun_flag', 'uint8'),
+    Variable('selected_rg_algorithm', 'uint8'),
+    Variable('selected_l2a_algorithm', 'uint8'),
+    Variable('sensitivity', 'float32'),
+    Variable('geolocation/degrade_flag', 'uint8'),
+    Variable('geolocation/delta_time', 'float64'),
+    Variable('geolocation/lat_lowestmode', 'float64'),
+    Variable('geolocation/lon_lowestmode', 'float64'),
+    Variable('geolocation/local_beam_azimuth', 'float32'),
+    Variable('geolocation/local_beam_elevation', 'float32'),
+    Variable('geolocation/solar_azimuth', 'float32'),
+    Variable('geolocation/solar_elevation', 'float32'),
+
+    # Metrics over a height profile defined for 30 slices.
+    Variable('cover_z', 'float32', num_columns=30),
+    Variable('pai_z', 'float32', num_columns=30),
+    Variable('pavd_z', 'float32', num_columns=30),
+)
+
+# AGBD estimates use -9999 and the limit flags 255 for missing values, even
+# where the datasets have no _FillValue attribute.
+_AGBD_FILL = -9999
+_FLAG_FILL = 255
+
+L4A = (
+    Variable('agbd', 'float32', _AGBD_FILL),
+    Variable('agbd_pi_lower', 'float32', _AGBD_FILL),
+    Variable('agbd_pi_upper', 'float32', _AGBD_FILL),
+    Variable('agbd_se', 'float32', _AGBD_FILL),
+    Variable('agbd_t', 'float32', _AGBD_FILL),
+    Variable('agbd_t_se', 'float32', _AGBD_FILL),
+    Variable('algorithm_run_flag', 'uint8'),
+    Variable('beam', 'uint16'),
+    Variable('channel', 'uint8'),
+    Variable('degrade_flag', 'uint8'),
+    Variable('delta_time', 'float64'),
+    Variable('elev_lowestmode', 'float32'),
+    Variable('l2_quality_flag', 'uint8'),
+    Variable('l4_quality_flag', 'uint8'),
+    Variable('lat_lowestmode', 'float64'),
+    Variable('lon_lowestmode', 'float64'),
+    Variable('master_frac', 'float64'),
+    Variable('master_int', 'uint32'),
+    Variable('predictor_limit_flag', 'uint8', _FLAG_FILL),
+    Variable('response_limit_flag', 'uint8', _FLAG_FILL),
+    Variable('selected_algorithm', 'uint8'),
+    Variable('selected_mode', 'uint8'),
+    Variable('selected_mode_flag', 'uint8'),
+    Variable('sensitivity', 'float32'),
+    Variable('solar_elevation', 'float32'),
+    Variable('surface_flag', 'uint8'),
+
+    Variable('shot_number', 'uint64'),
+    Variable('predict_stratum', STRING),
+) + (
+    _per_algorithm('agbd_prediction', 'agbd', 'float32', _AGBD_FILL) +
+    _per_algorithm('agbd_prediction', 'agbd_pi_lower', 'float32', _AGBD_FILL) +
+    _per_algorithm('agbd_prediction', 'agbd_pi_upper', 'float32', _AGBD_FILL) +
+    _per_algorithm('agbd_prediction', 'agbd_se', 'float32', _AGBD_FILL) +
+    _per_algorithm('agbd_prediction', 'agbd_t', 'float32', _AGBD_FILL) +
+    _per_algorithm('agbd_prediction', 'agbd_t_pi_lower', 'float32',
+                   _AGBD_FILL) +
+    _per_algorithm('agbd_prediction', 'agbd_t_pi_upper', 'float32',
+                   _AGBD_FILL) +
+    _per_algorithm('agbd_prediction', 'agbd_t_se', 'float32', _AGBD_FILL) +
+    _per_algorithm('agbd_prediction', 'algorithm_run_flag', 'uint8') +
+    _per_algorithm('agbd_prediction', 'l2_quality_flag', 'uint8') +
+    _per_algorithm('agbd_prediction', 'l4_quality_flag', 'uint8') +
+    _per_algorithm('agbd_prediction', 'predictor_limit_flag', 'uint8',
+                   _FLAG_FILL) +
+    _per_algorithm('agbd_prediction', 'response_limit_flag', 'uint8',
+                   _FLAG_FILL) +
+    _per_algorithm('agbd_prediction', 'selected_mode', 'uint8') +
+    _per_algorithm('agbd_prediction', 'selected_mode_flag', 'uint8')
+) + (
+    _per_algorithm('geolocation', 'elev_lowestmode', 'float32') +
+    _per_algorithm('geolocation', 'lat_lowestmode', 'float64') +
+    _per_algorithm('geolocation', 'lon_lowestmode', 'float64') +
+    _per_algorithm('geolocation', 'sensitivity', 'float32') +
+    (Variable('geolocation/stale_return_flag', 'uint8'),)
+) + (
+    Variable('land_cover_data/landsat_treecover', 'float64'),
+    Variable('land_cover_data/landsat_water_persistence', 'uint8'),
+    Variable('land_cover_data/leaf_off_doy', 'int16'),
+    Variable('land_cover_data/leaf_off_flag', 'uint8'),
+    Variable('land_cover_data/leaf_on_cycle', 'uint8'),
+    Variable('land_cover_data/leaf_on_doy', 'int16'),
+    Variable('land_cover_data/pft_class', 'uint8'),
+    Variable('land_cover_data/region_class', 'uint8'),
+    Variable('land_cover_data/urban_focal_window_size', 'uint8'),
+    Variable('land_cover_data/urban_proportion', 'uint8'),
+)
+
+L2A_DECODERS = compile_variables(L2A)
+L2B_FOR_L2A_DECODERS = compile_variables(L2B_FOR_L2A)
+L2B_DECODERS = compile_variables(L2B)
+L4A_DECODERS = compile_variables(L4A)
+
+
+def column_names(variables: tuple[Variable, ...]) -> list[str]:
+  """Returns the output column names of the given variables, in order."""
+  return [name for v in variables for name in v.column_names]
+
+
+def select_variables(variables: tuple[Variable, ...],
+                     names: list[str]) -> tuple[Variable, ...]:
+  """Picks variables by output name or HDF path, in the order given.
+
+  Args:
+    variables: the schema of a product, e.g. L2B
+    names: output names (like 'pai') or HDF paths (like 'geolocation/pai')
+
+  Returns:
+    the selected variables
+
+  Raises:
+    ValueError: if a name is not in the schema
+  """
+  by_name = {}
+  for v in variables:
+    by_name.setdefault(v.output_name, v)
+    by_name.setdefault(v.hdf_path, v)
+  unknown = [name for name in names if name not in by_name]
+  if unknown:
+    raise ValueError(f'Unknown GEDI variables: {", ".join(unknown)}')
+  return tuple(by_name[name] for name in names)
+
+
+def new_variables(variables: tuple[Variable, ...],
+                  existing: tuple[Variable, ...]) -> tuple[Variable, ...]:
+  """Returns the variables whose output columns are not in existing.
+
+  Used to leave out the geolocation and land cover variables that GEDI
+  repeats in every product when tables of several products are combined.
+  """
+  existing_names = set(column_names(existing))
+  return tuple(
+      v for v in variables
+      if not existing_names.intersection(v.column_names))
@@ -0,0 +1,132 @@
+# Copyright 2020 The Google Earth Engine Community Authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Routes GEDI tables to the UTM grid cells their ground tracks touch.
+
+Every grid cell export used to get the whole monthly table list and relied
+on filterBounds to drop the shots outside of the cell. route_tables instead
+looks up the ground track segments of every table in a gedi_catalog, packs
+them into an STR (sort-tile-recursive) R-tree and queries it with the
+buffered box of every cell, so that each export only reads the tables that
+can have shots in it.
+"""
+
+import math
+
+import numpy as np
+
+import gedi_catalog
+
+# Boxes per tree node.
+_NODE_CAPACITY = 16
+
+
+class STRTree:
+  """A static R-tree of boxes, packed with the sort-tile-recursive method.
+
+  The leaves are the boxes sorted into vertical slices by x center and
+  within each slice by y center; every node covers _NODE_CAPACITY
+  consecutive nodes of the level below. Queries walk the levels with numpy,
+  one array operation per level.
+  """
+
+  def __init__(self, boxes: np.ndarray,
+               node_capacity: int = _NODE_CAPACITY):
+    """Builds the tree.
+
+    Args:
+      boxes: array of shape (n, 4) with rows (min_x, min_y, max_x, max_y)
+      node_capacity: children per node
+    """
+    boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+    self._capacity = node_capacity
+    self._items = _str_order(boxes, node_capacity)
+    # Bottom-up list of node boxes; the first level holds the items.
+    self._levels = [boxes[self._items]]
+    while len(self._levels[-1]) > 1:
+      below = self._levels[-1]
+      starts = np.arange(0, len(below), node_capacity)
+      self._levels.append(np.column_stack([
+          np.minimum.reduceat(below[:, 0], starts),
+          np.minimum.reduceat(below[:, 1], starts),
+          np.maximum.reduceat(below[:, 2], starts),
+          np.maximum.reduceat(below[:, 3], starts),
+      ]))
+
+  def __len__(self) -> int:
+    return len(self._items)
+
+  def query(self, box: tuple[float, float, float, float]) -> np.ndarray:
+    """Returns the sorted indices of the boxes intersecting box."""
+    nodes = np.arange(len(self._levels[-1]))
+    for level, level_boxes in enumerate(reversed(self._levels)):
+      if level:
+        # The children of node i are nodes [i * capacity, (i + 1) * capacity)
+        # of the next level down.
+        nodes = (nodes[:, np.newaxis] * self._capacity +
+                 np.arange(self._capacity)).ravel()
+        nodes = nodes[nodes < len(level_boxes)]
+      b = level_boxes[nodes]
+      nodes = nodes[(b[:, 0] <= box[2]) & (b[:, 2] >= box[0]) &
+                    (b[:, 1] <= box[3]) & (b[:, 3] >= box[1])]
+    return np.sort(self._items[nodes])
+
+
+def _str_order(boxes: np.ndarray, node_capacity: int) -> np.ndarray:
+  """Returns the sort-tile-recursive order of boxes."""
+  num_leaves = math.ceil(len(boxes) / node_capacity)
+  slice_size = max(math.ceil(math.sqrt(num_leaves)), 1) * node_capacity
+  x = (boxes[:, 0] + boxes[:, 2]) / 2
+  y = (boxes[:, 1] + boxes[:, 3]) / 2
+  by_x = np.argsort(x, kind='stable')
+  slices = np.arange(len(boxes)) // slice_size
+  return by_x[np.lexsort((y[by_x], slices))]
+
+
+def route_tables(
+    catalog: gedi_catalog.Catalog,
+    table_asset_ids: list[str],
+    cell_bounds: dict[int, tuple[float, float, float, float]],
+    margin: float = gedi_catalog.BOUNDS_MARGIN_DEGREES
+) -> dict[int, list[str]]:
+  """Finds the tables whose ground track intersects every grid cell.
+
+  Tables without segments in the catalog go to every cell.
+
+  Args:
+    catalog: catalog with the granules the tables were extracted from
+    table_asset_ids: table asset ids
+    cell_bounds: grid_id -> (min_lon, min_lat, max_lon, max_lat), see
+      gedi_grid.GridCell.bounds
+    margin: degrees added to the cell boxes on all sides
+
+  Returns:
+    grid_id -> table asset ids, in the order of table_asset_ids
+  """
+  boxes, owners, unknown = [], [], []
+  for i, table_asset_id in enumerate(table_asset_ids):
+    segments = catalog.segments(table_asset_id)
+    if not segments:
+      unknown.append(i)
+    boxes.extend(segments)
+    owners.extend([i] * len(segments))
+  tree = STRTree(np.array(boxes))
+  owners = np.array(owners, dtype=np.int64)
+
+  routes = {}
+  for grid_id, (min_lon, min_lat, max_lon, max_lat) in cell_bounds.items():
+    hits = owners[tree.query((min_lon - margin, min_lat - margin,
+                              max_lon + margin, max_lat + margin))]
+    tables = np.union1d(hits, np.array(unknown, dtype=np.int64))
+    routes[grid_id] = [table_asset_ids[i] for i in tables]
+  return routes
@@ -0,0 +1,113 @@
+# Copyright 2020 The Google Earth Engine Community Authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Tests for gedi_spatial_index."""
+
+import os
+import tempfile
+
+from absl.testing import absltest
+import h5py
+import numpy as np
+
+import gedi_catalog
+import gedi_spatial_index
+
+
+def _brute_force(boxes: np.ndarray, box) -> np.ndarray:
+  return np.flatnonzero((boxes[:, 0] <= box[2]) & (boxes[:, 2] >= box[0]) &
+                        (boxes[:, 1] <= box[3]) & (boxes[:, 3] >= box[1]))
+
+
+class STRTreeTest(absltest.TestCase):
+
+  def test_matches_brute_force(self):
+    rng = np.random.default_rng(0)
+    for num_boxes in (0, 1, 15, 16, 17, 1000):
+      corners = rng.uniform(-180, 180, (num_boxes, 2))
+      sizes = rng.exponential(5, (num_boxes, 2))
+      boxes = np.column_stack([corners, corners + sizes])
+      for capacity in (2, 16):
+        tree = gedi_spatial_index.STRTree(boxes, capacity)
+        self.assertLen(tree, num_boxes)
+        for _ in range(20):
+          x, y = rng.uniform(-180, 180, 2)
+          box = (x, y, x + rng.uniform(0, 30), y + rng.uniform(0, 30))
+          np.testing.assert_array_equal(
+              tree.query(box), _brute_force(boxes, box))
+
+  def test_touching_boxes_intersect(self):
+    tree = gedi_spatial_index.STRTree(np.array([[0, 0, 1, 1]]))
+    np.testing.assert_array_equal(tree.query((1, 1, 2, 2)), [0])
+    self.assertEmpty(tree.query((1.01, 0, 2, 1)))
+
+
+class RouteTablesTest(absltest.TestCase):
+
+  def setUp(self):
+    super().setUp()
+    tmp_dir = self.enter_context(tempfile.TemporaryDirectory())
+    self.catalog = gedi_catalog.Catalog(os.path.join(tmp_dir, 'catalog.db'))
+    self.addCleanup(self.catalog.close)
+    # Two granules with one beam each, one going north at lon -100 and one
+    # going east at lat 40.
+    self.tables = []
+    for orbit, (lats, lons) in enumerate(
+        ((np.linspace(-50, 50, 30000), np.full(30000, -100.0)),
+         (np.full(30000, 40.0), np.linspace(-120, -60, 30000))), 1):
+      name = 'GEDI02_A_2019108002011_O%05d_01_T03909_02_005_01_V002' % orbit
+      path = os.path.join(tmp_dir, name + '.h5')
+      with h5py.File(path, 'w') as hdf_fh:
+        beam = hdf_fh.create_group('BEAM0000')
+        beam['shot_number'] = np.arange(len(lats), dtype=np.uint64)
+        beam['lat_lowestmode'] = lats
+        beam['lon_lowestmode'] = lons
+      self.catalog.add_granules([path])
+      self.tables.append('users/a/gedi_l2a/' + name)
+    # A table of a granule that is not cataloged.
+    self.tables.append('users/a/gedi_l2a/GEDI02_A_2019108002011_O00003_01_'
+                       'T03909_02_005_01_V002')
+
+  def test_routes_tables_to_the_cells_their_tracks_touch(self):
+    cells = {
+        1: (-101, -10, -99, -5),  # Only on the north going track.
+        2: (-80, 39, -79, 41),  # Only on the east going track.
+        3: (-101, 39, -99, 41),  # Where the tracks cross.
+        # Within the bounds of both granules, but on neither track: a
+        # segment of the north going track spans about 33 degrees of
+        # latitude but little longitude.
+        4: (-90, 0, -88, 2),
+    }
+    routes = gedi_spatial_index.route_tables(self.catalog, self.tables, cells)
+
+    first, second, unknown = self.tables
+    self.assertEqual(routes, {
+        1: [first, unknown],
+        2: [second, unknown],
+        3: [first, second, unknown],
+        4: [unknown],
+    })
+
+  def test_margin(self):
+    cells = {1: (-99.97, -10, -99, -5)}
+    first, _, unknown = self.tables
+    self.assertEqual(
+        gedi_spatial_index.route_tables(self.catalog, self.tables, cells,
+                                        margin=0), {1: [unknown]})
+    self.assertEqual(
+        gedi_spatial_index.route_tables(self.catalog, self.tables, cells),
+        {1: [first, unknown]})
+
+
+if __name__ == '__main__':
+  absltest.main()
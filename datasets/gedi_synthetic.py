@@ -0,0 +1,187 @@
+# Copyright 2020 The Google Earth Engine Community Authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Writes synthetic GEDI L2A, L2B and L4A granules.
+
+Usage: gedi_synthetic.py <output dir>
+
+The files have the layout the extractors expect: every variable declared in
+gedi_schema under the eight BEAMxxxx groups, with the declared dtypes, 2-D
+rh and cover_z/pai_z/pavd_z datasets, _FillValue attributes on the float
+datasets and fill values at a different random 2% of the shots of every
+variable. The coordinates and delta_time have no fill values, so no shots
+are dropped and the NaN and nullable integer columns show up in the output.
+The three products of an orbit share their shot numbers. Values are random
+but plausible, e.g. shots follow a ground track and relative heights
+increase with the percentile.
+
+This is meant for benchmarks and for trying the extractors without
+downloading real granules; see gedi_benchmark.py.
+"""
+
+import os
+from typing import Optional
+
+from absl import app
+from absl import flags
+import h5py
+import numpy as np
+
+import gedi_schema
+
+NUM_SHOTS = flags.DEFINE_integer(
+    'num_shots', 20000, 'Number of shots per beam.')
+
+CHUNK_ROWS = flags.DEFINE_integer(
+    'chunk_rows', 10000,
+    'HDF5 chunk size along the shot axis. 0 writes contiguous datasets, '
+    'which requires --compression=none.')
+
+COMPRESSION = flags.DEFINE_enum(
+    'compression', 'gzip', ['gzip', 'lzf', 'none'],
+    'HDF5 compression filter of the datasets.')
+
+SEED = flags.DEFINE_integer('seed', 0, 'Random seed.')
+
+BEAM_KEYS = ('BEAM0000', 'BEAM0001', 'BEAM0010', 'BEAM0011', 'BEAM0101',
+             'BEAM0110', 'BEAM1000', 'BEAM1011')
+
+# File names of one orbit, in the format parsed by gedi_lib.
+L2A_FILENAME = 'GEDI02_A_2019108002011_O01961_03_T03909_02_005_01_V002.h5'
+L2B_FILENAME = 'GEDI02_B_2019108002011_O01961_03_T03909_02_003_01_V002.h5'
+L4A_FILENAME = 'GEDI04_A_2019108002011_O01961_03_T03909_02_002_02_V002.h5'
+
+_ORBIT = 1961
+# GEDI delta_time of the first shot, and the time between shots (242 Hz).
+_START_DELTA_TIME = 40000000.0
+_SHOT_INTERVAL = 1 / 242
+_FLOAT_FILL = -9999
+# Fraction of shots set to fill values, drawn separately for every variable.
+_FILL_FRACTION = 0.02
+# Variables without fill values.
+_NEVER_FILLED = ('delta_time', 'lat_lowestmode', 'lon_lowestmode')
+_STRATA = (b'DBT_coGl', b'EBT_SAs', b'ENT_NAm', b'GSW_WAf')
+
+
+def shot_numbers(beam_key: str, num_shots: int) -> np.ndarray:
+  """Returns the shot numbers of a beam, see add_shot_number_breakdown."""
+  shot = np.arange(num_shots, dtype=np.uint64)
+  return (np.uint64(_ORBIT) * np.uint64(10**13) +
+          np.uint64(int(beam_key[4:], 2)) * np.uint64(10**11) +
+          shot // np.uint64(60) * np.uint64(10**8) + shot)
+
+
+def _values(variable: gedi_schema.Variable, beam_key: str, num_shots: int,
+            rng: np.random.Generator) -> np.ndarray:
+  """Returns plausible values of a variable for one beam."""
+  name = variable.output_name
+  shape = (num_shots, variable.num_columns) if variable.num_columns else (
+      num_shots,)
+  track = np.linspace(0, 1, num_shots)
+  if variable.dtype == gedi_schema.STRING:
+    return rng.choice(np.array(_STRATA), num_shots)
+  if name == 'shot_number':
+    return shot_numbers(beam_key, num_shots)
+  if name == 'beam':
+    return np.full(num_shots, int(beam_key[4:], 2), dtype=variable.dtype)
+  if name == 'delta_time':
+    return _START_DELTA_TIME + np.arange(num_shots) * _SHOT_INTERVAL
+  if name.startswith('lat_'):
+    return -51.6 + 103.2 * track + rng.normal(0, 1e-4, num_shots)
+  if name.startswith('lon_'):
+    return -120 + 60 * track + int(beam_key[4:], 2) * 0.005
+  if name == 'rh':
+    return np.cumsum(rng.gamma(1, 0.3, shape), axis=1).astype(variable.dtype)
+  if name in ('cover_z', 'pai_z', 'pavd_z'):
+    return np.sort(rng.uniform(0, 1, shape), axis=1)[:, ::-1].astype(
+        variable.dtype)
+  dtype = np.dtype(variable.dtype)
+  if np.issubdtype(dtype, np.integer):
+    return rng.integers(0, 2 if 'flag' in name else 10, shape).astype(dtype)
+  if name.startswith('sensitivity'):
+    return rng.uniform(0.8, 1, shape).astype(dtype)
+  return rng.gamma(2, 50, shape).astype(dtype)
+
+
+def write_granule(path: str, variables: tuple[gedi_schema.Variable, ...],
+                  num_shots: int, chunk_rows: int,
+                  compression: Optional[str] = 'gzip',
+                  seed: int = 0) -> None:
+  """Writes a synthetic GEDI file with the given variables in every beam.
+
+  Args:
+    path: output file path
+    variables: schema variables, see gedi_schema
+    num_shots: shots per beam
+    chunk_rows: HDF5 chunk size along the shot axis, 0 for contiguous
+      datasets
+    compression: h5py compression filter, or None
+    seed: random seed; files written with the same seed and shot count have
+      the same shots
+  """
+  rng = np.random.default_rng(seed)
+  with h5py.File(path, 'w') as hdf_fh:
+    hdf_fh.create_group('METADATA')
+    for beam_key in BEAM_KEYS:
+      beam = hdf_fh.create_group(beam_key)
+      for variable in variables:
+        if variable.hdf_path in beam:
+          continue
+        values = _values(variable, beam_key, num_shots, rng)
+        fill_value = variable.fill_value
+        if values.dtype.kind == 'f':
+          fill_value = _FLOAT_FILL
+        if (fill_value is not None and
+            variable.output_name not in _NEVER_FILLED):
+          values[rng.random(num_shots) < _FILL_FRACTION] = fill_value
+        chunks = None
+        if chunk_rows:
+          chunks = (min(chunk_rows, num_shots),) + values.shape[1:]
+        ds = beam.create_dataset(
+            variable.hdf_path, data=values, chunks=chunks,
+            compression=compression)
+        if values.dtype.kind == 'f':
+          ds.attrs['_FillValue'] = values.dtype.type(_FLOAT_FILL)
+
+
+def write_orbit(output_dir: str, num_shots: int, chunk_rows: int,
+                compression: Optional[str] = 'gzip',
+                seed: int = 0) -> list[str]:
+  """Writes the L2A, L2B and L4A files of one synthetic orbit.
+
+  Returns:
+    list of the L2A, L2B and L4A file paths
+  """
+  os.makedirs(output_dir, exist_ok=True)
+  products = (
+      (L2A_FILENAME, gedi_schema.L2A),
+      (L2B_FILENAME, gedi_schema.L2B + gedi_schema.L2B_FOR_L2A),
+      (L4A_FILENAME, gedi_schema.L4A),
+  )
+  paths = []
+  for filename, variables in products:
+    path = os.path.join(output_dir, filename)
+    write_granule(path, variables, num_shots, chunk_rows, compression, seed)
+    paths.append(path)
+  return paths
+
+
+def main(argv):
+  compression = None if COMPRESSION.value == 'none' else COMPRESSION.value
+  for path in write_orbit(argv[1], NUM_SHOTS.value, CHUNK_ROWS.value,
+                          compression, SEED.value):
+    print(path)
+
+
+if __name__ == '__main__':
+  app.run(main)
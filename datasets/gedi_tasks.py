@@ -0,0 +1,364 @@
+# Copyright 2020 The Google Earth Engine Community Authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Scheduler for the EE export tasks of the rasterize scripts.
+
+TaskScheduler takes a queue of gedi_lib.ExportParameters and starts them
+with at most --max_running_tasks tasks running at a time and at most
+--task_submissions_per_second starts per second. Starts failing with
+transient errors (quota, rate limits, server errors) are retried with
+exponential backoff. The states of the running tasks are polled with one
+task list request at a time, and all task ids and states are written to
+--task_state, so that an interrupted run can be resumed without starting
+the same exports twice. Exports are told apart by asset id and fingerprint
+(see gedi_lib.export_fingerprint), so the exports of another month to the
+same asset id are started even if the last month's task is still listed.
+
+The EE calls are behind TaskBackend; FakeBackend runs the scheduler without
+EE, e.g. to try the flags out.
+"""
+
+import collections
+import heapq
+import itertools
+import json
+import os
+import time
+from typing import Callable, Optional
+
+from absl import flags
+from absl import logging
+import attr
+import ee
+
+import gedi_lib
+
+MAX_RUNNING_TASKS = flags.DEFINE_integer(
+    'max_running_tasks', 100,
+    'Maximum number of export tasks that are ready or running at a time.')
+
+TASK_SUBMISSIONS_PER_SECOND = flags.DEFINE_float(
+    'task_submissions_per_second', 5, 'Maximum rate of export task starts.')
+
+TASK_RETRIES = flags.DEFINE_integer(
+    'task_retries', 5,
+    'How often a task start failing with a transient error is retried.')
+
+TASK_POLL_SECONDS = flags.DEFINE_float(
+    'task_poll_seconds', 30, 'Seconds between task state polls.')
+
+TASK_STATE = flags.DEFINE_string(
+    'task_state', None,
+    'JSON file with the task ids and states of the exports. Exports with a '
+    'task that did not fail are not started again.')
+
+WAIT_FOR_TASKS = flags.DEFINE_bool(
+    'wait_for_tasks', False,
+    'Whether to wait until all tasks have finished, rather than until all '
+    'are started.')
+
+# States of the scheduler before and instead of an EE task state.
+QUEUED = 'QUEUED'
+NOT_STARTED = 'NOT_STARTED'
+
+# EE task states of tasks that count against --max_running_tasks.
+_ACTIVE_STATES = frozenset(
+    {'UNSUBMITTED', 'READY', 'RUNNING', 'CANCEL_REQUESTED'})
+# States of exports that are started (again) when submitted.
+_RESTART_STATES = frozenset({QUEUED, NOT_STARTED, 'FAILED', 'CANCELLED'})
+
+_BACKOFF_SECONDS = 2
+_MAX_BACKOFF_SECONDS = 300
+
+# Lower-cased fragments of the messages of transient EE errors.
+_TRANSIENT_MESSAGES = ('quota', 'too many', 'rate limit', 'deadline',
+                       'unavailable', 'internal error', 'timed out',
+                       'try again')
+
+
+class TransientError(Exception):
+  """An error after which starting a task can be retried."""
+
+
+@attr.s
+class TaskRecord:
+  """The task of an export."""
+  asset_id: str = attr.ib()
+  task_id: Optional[str] = attr.ib(default=None)
+  state: str = attr.ib(default=QUEUED)
+  attempts: int = attr.ib(default=0)
+  error: Optional[str] = attr.ib(default=None)
+  # Fingerprint of the export parameters, see gedi_lib.export_fingerprint.
+  fingerprint: Optional[str] = attr.ib(default=None)
+
+
+class TaskBackend:
+  """Starts export tasks and looks up their states."""
+
+  def start(self, export_params: gedi_lib.ExportParameters) -> str:
+    """Starts an export and returns its task id."""
+    raise NotImplementedError
+
+  def states(self, task_ids: list[str]) -> dict[str, tuple[str, str]]:
+    """Returns task id -> (state, error message); unknown ids are left out."""
+    raise NotImplementedError
+
+  def is_transient(self, error: Exception) -> bool:
+    return isinstance(error, TransientError)
+
+
+class EarthEngineBackend(TaskBackend):
+  """Runs the exports as EE batch tasks."""
+
+  def __init__(self):
+    # Asset id -> (export parameters, task). A retried start of the same
+    # export reuses the task and with it the request id, so that EE does not
+    # run the export twice if the failed request did go through.
+    self._tasks = {}
+
+  def start(self, export_params: gedi_lib.ExportParameters) -> str:
+    last_params, task = self._tasks.get(export_params.asset_id, (None, None))
+    if last_params is not export_params:
+      task = gedi_lib.export_task(export_params)
+      self._tasks[export_params.asset_id] = (export_params, task)
+    task.start()
+    del self._tasks[export_params.asset_id]
+    return task.id
+
+  def states(self, task_ids: list[str]) -> dict[str, tuple[str, str]]:
+    # A single paged listing of all recent tasks, rather than a request per
+    # task as with getTaskStatus.
+    task_ids = set(task_ids)
+    return {
+        t['id']: (t['state'], t.get('error_message', ''))
+        for t in ee.data.getTaskList()
+        if t['id'] in task_ids
+    }
+
+  def is_transient(self, error: Exception) -> bool:
+    message = str(error).lower()
+    return super().is_transient(error) or any(
+        m in message for m in _TRANSIENT_MESSAGES)
+
+
+class FakeBackend(TaskBackend):
+  """Pretends to run exports: every task completes after a few polls.
+
+  Args:
+    polls_to_complete: polls a task is RUNNING before it is COMPLETED
+    transient_failures: number of starts that fail with a TransientError
+      before the first one succeeds
+  """
+
+  def __init__(self, polls_to_complete: int = 1,
+               transient_failures: int = 0):
+    self._polls_to_complete = polls_to_complete
+    self._transient_failures = transient_failures
+    self._polls = {}
+    # Asset ids, in the order their tasks were started.
+    self.started = []
+
+  def start(self, export_params: gedi_lib.ExportParameters) -> str:
+    if self._transient_failures:
+      self._transient_failures -= 1
+      raise TransientError('Too many tasks already in the queue')
+    task_id = 'FAKE%06d' % len(self.started)
+    self.started.append(export_params.asset_id)
+    self._polls[task_id] = 0
+    return task_id
+
+  def states(self, task_ids: list[str]) -> dict[str, tuple[str, str]]:
+    states = {}
+    for task_id in task_ids:
+      if task_id not in self._polls:
+        continue
+      self._polls[task_id] += 1
+      done = self._polls[task_id] >= self._polls_to_complete
+      states[task_id] = ('COMPLETED' if done else 'RUNNING', '')
+    return states
+
+
+class TaskScheduler:
+  """Starts queued exports under concurrency and rate limits.
+
+  Args:
+    backend: starts the tasks
+    max_running: maximum number of active tasks, see _ACTIVE_STATES
+    submissions_per_second: maximum rate of task starts
+    max_retries: retries of a start failing with a transient error
+    poll_seconds: seconds between task state polls
+    state_path: optional JSON file in which the task records are kept
+    clock: monotonic time in seconds
+    sleep: sleeps for the given number of seconds
+  """
+
+  def __init__(self,
+               backend: TaskBackend,
+               max_running: int = 100,
+               submissions_per_second: float = 5,
+               max_retries: int = 5,
+               poll_seconds: float = 30,
+               state_path: Optional[str] = None,
+               clock: Callable[[], float] = time.monotonic,
+               sleep: Callable[[float], None] = time.sleep):
+    self._backend = backend
+    self._max_running = max_running
+    self._submission_interval = 1 / submissions_per_second
+    self._max_retries = max_retries
+    self._poll_seconds = poll_seconds
+    self._state_path = state_path
+    self._clock = clock
+    self._sleep = sleep
+    self._records = self._load()
+    # Heap of (not before, sequence number, fingerprint, export parameters).
+    self._queue = []
+    self._sequence = itertools.count()
+    self._next_start = clock()
+
+  def _load(self) -> dict[tuple[str, Optional[str]], TaskRecord]:
+    if not self._state_path or not os.path.exists(self._state_path):
+      return {}
+    with open(self._state_path) as fh:
+      records = [TaskRecord(**r) for r in json.load(fh)]
+    return {(r.asset_id, r.fingerprint): r for r in records}
+
+  def _save(self) -> None:
+    if not self._state_path:
+      return
+    tmp_path = self._state_path + '.tmp'
+    with open(tmp_path, 'w') as fh:
+      json.dump([attr.asdict(r) for r in self._records.values()], fh,
+                indent=1)
+    os.replace(tmp_path, self._state_path)
+
+  @property
+  def records(self) -> dict[tuple[str, Optional[str]], TaskRecord]:
+    """(asset id, fingerprint) -> record of every known export."""
+    return self._records
+
+  @property
+  def backend(self) -> TaskBackend:
+    return self._backend
+
+  def submit(self, export_params: gedi_lib.ExportParameters,
+             fingerprint: Optional[str] = None) -> None:
+    """Queues an export, unless it already has a task that did not fail.
+
+    Args:
+      export_params: the export
+      fingerprint: fingerprint of the export parameters, see
+        gedi_lib.export_fingerprint; an existing task only counts if it was
+        started with the same one
+    """
+    key = (export_params.asset_id, fingerprint)
+    record = self._records.get(key)
+    if record is not None and record.state not in _RESTART_STATES:
+      logging.info('%s already has task %s (%s)', record.asset_id,
+                   record.task_id, record.state)
+      return
+    self._records[key] = TaskRecord(
+        export_params.asset_id, fingerprint=fingerprint)
+    heapq.heappush(
+        self._queue,
+        (self._clock(), next(self._sequence), fingerprint, export_params))
+
+  def _active(self) -> list[TaskRecord]:
+    return [r for r in self._records.values() if r.state in _ACTIVE_STATES]
+
+  def _start_next(self) -> None:
+    """Starts the first queued export, or requeues it after an error."""
+    not_before, _, fingerprint, export_params = heapq.heappop(self._queue)
+    record = self._records[(export_params.asset_id, fingerprint)]
+    wait = max(not_before, self._next_start) - self._clock()
+    if wait > 0:
+      self._sleep(wait)
+    self._next_start = self._clock() + self._submission_interval
+    record.attempts += 1
+    try:
+      record.task_id = self._backend.start(export_params)
+    except Exception as e:  # pylint: disable=broad-except
+      record.error = str(e)
+      if (self._backend.is_transient(e) and
+          record.attempts <= self._max_retries):
+        backoff = min(_BACKOFF_SECONDS * 2**(record.attempts - 1),
+                      _MAX_BACKOFF_SECONDS)
+        logging.warning('Starting %s failed, retrying in %ds: %s',
+                        record.asset_id, backoff, e)
+        heapq.heappush(self._queue,
+                       (self._clock() + backoff, next(self._sequence),
+                        fingerprint, export_params))
+      else:
+        logging.error('Could not start %s: %s', record.asset_id, e)
+        record.state = NOT_STARTED
+    else:
+      record.state = 'READY'
+      record.error = None
+      logging.info('Started task %s for %s', record.task_id, record.asset_id)
+    self._save()
+
+  def poll(self) -> None:
+    """Updates the states of the active tasks."""
+    active = {r.task_id: r for r in self._active()}
+    if not active:
+      return
+    try:
+      states = self._backend.states(list(active))
+    except Exception as e:  # pylint: disable=broad-except
+      logging.warning('Polling task states failed: %s', e)
+      return
+    for task_id, record in active.items():
+      # Tasks missing from the task list are too old or were deleted.
+      state, error = states.get(task_id, ('UNKNOWN', ''))
+      if state == record.state:
+        continue
+      record.state = state
+      record.error = error or None
+      if state == 'FAILED':
+        logging.error('Task %s for %s failed: %s', task_id, record.asset_id,
+                      error)
+      elif state not in _ACTIVE_STATES:
+        logging.info('Task %s for %s: %s', task_id, record.asset_id, state)
+    self._save()
+
+  def run(self,
+          wait: bool = False) -> dict[tuple[str, Optional[str]], TaskRecord]:
+    """Starts all queued exports.
+
+    Args:
+      wait: whether to also wait until all tasks have finished
+
+    Returns:
+      (asset id, fingerprint) -> record
+    """
+    self.poll()
+    while self._queue or (wait and self._active()):
+      if self._queue and len(self._active()) < self._max_running:
+        self._start_next()
+        continue
+      self._sleep(self._poll_seconds)
+      self.poll()
+    self._save()
+    logging.info('Export tasks by state: %s', dict(collections.Counter(
+        r.state for r in self._records.values())))
+    return self._records
+
+
+def scheduler_from_flags(
+    backend: Optional[TaskBackend] = None) -> TaskScheduler:
+  return TaskScheduler(
+      backend or EarthEngineBackend(),
+      max_running=MAX_RUNNING_TASKS.value,
+      submissions_per_second=TASK_SUBMISSIONS_PER_SECOND.value,
+      max_retries=TASK_RETRIES.value,
+      poll_seconds=TASK_POLL_SECONDS.value,
+      state_path=TASK_STATE.value)
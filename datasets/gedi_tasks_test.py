@@ -0,0 +1,193 @@
+# Copyright 2020 The Google Earth Engine Community Authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Tests for gedi_tasks."""
+
+import os
+import tempfile
+
+from absl.testing import absltest
+
+import gedi_lib
+import gedi_tasks
+
+
+class FakeClock:
+  """A clock that only advances when sleeping."""
+
+  def __init__(self):
+    self.now = 0.0
+    self.sleeps = []
+
+  def time(self) -> float:
+    return self.now
+
+  def sleep(self, seconds: float) -> None:
+    self.sleeps.append(seconds)
+    self.now += seconds
+
+
+class TimedBackend(gedi_tasks.FakeBackend):
+  """FakeBackend noting the time and number of active tasks at each start."""
+
+  def __init__(self, clock, **kwargs):
+    super().__init__(**kwargs)
+    self.scheduler = None
+    self.start_times = []
+    self.active_at_start = []
+    self._clock = clock
+
+  def start(self, export_params):
+    task_id = super().start(export_params)
+    self.start_times.append(self._clock.time())
+    active = self.scheduler._active()  # pylint: disable=protected-access
+    self.active_at_start.append(len(active))
+    return task_id
+
+
+class FailingBackend(gedi_tasks.FakeBackend):
+
+  def start(self, export_params):
+    raise ValueError('Asset already exists')
+
+
+def _export(asset_id: str) -> gedi_lib.ExportParameters:
+  return gedi_lib.ExportParameters(
+      asset_id=asset_id,
+      image=None,
+      pyramiding_policy={'.default': 'sample'},
+      crs='EPSG:32610',
+      region=None,
+      overwrite=False)
+
+
+class TaskSchedulerTest(absltest.TestCase):
+
+  def setUp(self):
+    super().setUp()
+    self.clock = FakeClock()
+
+  def _scheduler(self, backend, **kwargs):
+    return gedi_tasks.TaskScheduler(
+        backend, clock=self.clock.time, sleep=self.clock.sleep, **kwargs)
+
+  def test_submission_rate(self):
+    backend = TimedBackend(self.clock)
+    scheduler = self._scheduler(backend, submissions_per_second=2)
+    backend.scheduler = scheduler
+    for i in range(5):
+      scheduler.submit(_export('a/%03d' % i), 'f')
+    scheduler.run()
+
+    self.assertLen(backend.started, 5)
+    for earlier, later in zip(backend.start_times, backend.start_times[1:]):
+      self.assertGreaterEqual(later - earlier, 0.5 - 1e-9)
+
+  def test_max_running(self):
+    backend = TimedBackend(self.clock, polls_to_complete=3)
+    scheduler = self._scheduler(
+        backend, max_running=2, submissions_per_second=100, poll_seconds=10)
+    backend.scheduler = scheduler
+    for i in range(6):
+      scheduler.submit(_export('a/%03d' % i), 'f')
+    records = scheduler.run(wait=True)
+
+    self.assertLen(backend.started, 6)
+    self.assertLessEqual(max(backend.active_at_start), 1)
+    self.assertEqual({r.state for r in records.values()}, {'COMPLETED'})
+    # Tasks take 3 polls, two at a time.
+    self.assertGreaterEqual(self.clock.now, 20)
+
+  def test_retries_transient_errors_with_backoff(self):
+    backend = gedi_tasks.FakeBackend(transient_failures=3)
+    scheduler = self._scheduler(
+        backend, max_retries=5, submissions_per_second=1000)
+    scheduler.submit(_export('a/001'), 'f')
+    records = scheduler.run()
+
+    record = records[('a/001', 'f')]
+    self.assertEqual(record.state, 'READY')
+    self.assertEqual(record.attempts, 4)
+    self.assertIsNone(record.error)
+    self.assertEqual(backend.started, ['a/001'])
+    backoffs = [s for s in self.clock.sleeps if s > 1]
+    self.assertEqual([round(s) for s in backoffs], [2, 4, 8])
+
+  def test_gives_up_after_max_retries(self):
+    backend = gedi_tasks.FakeBackend(transient_failures=10)
+    scheduler = self._scheduler(backend, max_retries=2)
+    scheduler.submit(_export('a/001'), 'f')
+    record = scheduler.run()[('a/001', 'f')]
+
+    self.assertEqual(record.state, gedi_tasks.NOT_STARTED)
+    self.assertEqual(record.attempts, 3)
+    self.assertIn('Too many tasks', record.error)
+
+  def test_does_not_retry_other_errors(self):
+    scheduler = self._scheduler(FailingBackend())
+    scheduler.submit(_export('a/001'), 'f')
+    record = scheduler.run()[('a/001', 'f')]
+
+    self.assertEqual(record.state, gedi_tasks.NOT_STARTED)
+    self.assertEqual(record.attempts, 1)
+
+  def test_resume_across_months(self):
+    state_path = os.path.join(
+        self.enter_context(tempfile.TemporaryDirectory()), 'tasks.json')
+    # The same backend for all runs, like the EE task list.
+    backend = gedi_tasks.FakeBackend(polls_to_complete=2)
+
+    january = self._scheduler(backend, state_path=state_path)
+    january.submit(_export('a/001'), 'january')
+    january.submit(_export('a/002'), 'january')
+    january.run()
+    self.assertEqual(backend.started, ['a/001', 'a/002'])
+
+    # A resumed January run starts nothing, while February exports to the
+    # same asset ids are started although the January tasks are listed.
+    resumed = self._scheduler(backend, state_path=state_path)
+    resumed.submit(_export('a/001'), 'january')
+    resumed.submit(_export('a/002'), 'january')
+    resumed.run()
+    self.assertLen(backend.started, 2)
+
+    february = self._scheduler(backend, state_path=state_path)
+    february.submit(_export('a/001'), 'february')
+    february.submit(_export('a/002'), 'january')
+    february.run(wait=True)
+    self.assertEqual(backend.started, ['a/001', 'a/002', 'a/001'])
+
+    records = self._scheduler(backend, state_path=state_path).records
+    self.assertCountEqual(records, [('a/001', 'january'),
+                                    ('a/002', 'january'),
+                                    ('a/001', 'february')])
+    self.assertEqual({r.state for r in records.values()}, {'COMPLETED'})
+
+  def test_restarts_failed_tasks(self):
+    state_path = os.path.join(
+        self.enter_context(tempfile.TemporaryDirectory()), 'tasks.json')
+    backend = gedi_tasks.FakeBackend()
+    scheduler = self._scheduler(backend, state_path=state_path)
+    scheduler.submit(_export('a/001'), 'f')
+    scheduler.run()
+    scheduler.records[('a/001', 'f')].state = 'FAILED'
+    scheduler.run()
+
+    resumed = self._scheduler(backend, state_path=state_path)
+    resumed.submit(_export('a/001'), 'f')
+    resumed.run()
+    self.assertEqual(backend.started, ['a/001', 'a/001'])
+
+
+if __name__ == '__main__':
+  absltest.main()